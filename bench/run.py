@@ -0,0 +1,379 @@
+"""
+Measures what debugging costs.
+
+Every workload of bench/workloads.py runs natively, under pdb and under
+src/main.py, with and without a breakpoint that is never hit. Also measured
+are the throughput of the channel between debuggee and controller and the
+latency from a command to the stop it causes, and the time from starting
+the debugger to its first prompt. Results are written as JSON.
+
+    python bench/run.py [--modes native,pdb,pxc] [--scale 0.1] [--output results.json]
+
+pxctest (testlib) has to be importable, the pxc modes also need lldb.
+"""
+
+import os
+import re
+import sys
+import ast
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import subprocess
+import importlib.util
+from typing import Optional
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCH)
+SRC = os.path.join(REPO, "src")
+WORKLOADS = os.path.join(BENCH, "workloads.py")
+MAIN = os.path.join(SRC, "main.py")
+
+sys.path.insert(0, SRC)
+import protocol  # noqa: E402
+import transport  # noqa: E402
+
+MODES = ("native", "pdb", "pdb-break", "pxc", "pxc-break")
+RESULT = re.compile(r"PXC_BENCH (\{.*\})")
+# pdb prints the next line to run as "-> source" whenever it stops
+STOP_MARKER = "\n-> "
+NATIVE_STOP_MARKER = "stop reason"
+
+TIMEOUT = 600
+LATENCY_STEPS = 10
+
+
+class DebuggerProcess:
+    """
+    A workload run by a debugger driven through its stdin, the output is
+    collected by a thread so that it can be waited for.
+    """
+
+    def __init__(self, argv: list[str], env: Optional[dict] = None):
+        self.process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=REPO,
+            env=env,
+        )
+        self.output = ""
+        self.closed = False
+        self.changed = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self) -> None:
+        fd = self.process.stdout.fileno()
+        while chunk := os.read(fd, 64 * 1024):
+            with self.changed:
+                self.output += chunk.decode(errors="replace")
+                self.changed.notify_all()
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def send(self, command: str) -> None:
+        self.process.stdin.write((command + "\n").encode())
+        self.process.stdin.flush()
+
+    def wait_for(self, text: str, start: int = 0, timeout: float = TIMEOUT) -> int:
+        """
+        Waits until `text` shows up in the output after `start`.
+        Returns the position right after it.
+        """
+
+        with self.changed:
+            found = self.changed.wait_for(
+                lambda: text in self.output[start:] or self.closed, timeout
+            )
+            position = self.output.find(text, start)
+            if not found or position < 0:
+                raise RuntimeError(
+                    f"{text!r} did not show up, output was:\n{self.output[-2000:]}"
+                )
+            return position + len(text)
+
+    def finish(self, command: Optional[str] = None) -> None:
+        try:
+            if command is not None:
+                self.send(command)
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def breakpoint_line(function: str) -> int:
+    # first statement of a function in workloads.py
+    with open(WORKLOADS) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == function:
+            return node.body[0].lineno
+    raise ValueError(f"No function {function} in {WORKLOADS}")
+
+
+def debugger_argv(mode: str, *args: str) -> list[str]:
+    if mode == "native":
+        return [sys.executable, WORKLOADS, *args]
+    if mode.startswith("pdb"):
+        return [sys.executable, "-m", "pdb", WORKLOADS, *args]
+    return [sys.executable, MAIN, WORKLOADS, *args]
+
+
+def run_workload(mode: str, name: str, size: int) -> dict:
+    args = [name, str(size)]
+    env = dict(os.environ)
+    stats_file = None
+    if mode.startswith("pxc"):
+        fd, stats_file = tempfile.mkstemp(prefix="pxc-stats-", suffix=".json")
+        os.close(fd)
+        env["PXC_STATS_FILE"] = stats_file
+
+    debugger = DebuggerProcess(debugger_argv(mode, *args), env)
+    if mode.endswith("-break"):
+        debugger.send(f"break {WORKLOADS}:{breakpoint_line('never_called')}")
+    if mode != "native":
+        debugger.send("continue")
+
+    end = debugger.wait_for("PXC_BENCH ")
+    debugger.wait_for("\n", end)
+    result = json.loads(RESULT.search(debugger.output).group(1))
+    debugger.finish({"native": None, "pdb": "quit", "pxc": "exit"}[mode.split("-")[0]])
+
+    if stats_file:
+        try:
+            with open(stats_file) as f:
+                stats = json.load(f)
+            result.update(stats)
+            result["messages_per_second"] = stats["messages_sent"] / result["seconds"]
+        except (OSError, ValueError):
+            pass  # the debuggee did not get to write them
+        finally:
+            os.unlink(stats_file)
+    return result
+
+
+def measure_latency(mode: str) -> dict:
+    """
+    Time from sending a command to the stop it causes: `next` over simple
+    lines, and for pxc continuing to a breakpoint in a C function.
+    """
+
+    debugger = DebuggerProcess(debugger_argv(mode, "latency"))
+    position = debugger.wait_for(STOP_MARKER)
+    debugger.send(f"break {WORKLOADS}:{breakpoint_line('latency')}")
+    debugger.send("continue")
+    position = debugger.wait_for(STOP_MARKER, position)
+
+    steps = []
+    for _ in range(LATENCY_STEPS):
+        start = time.perf_counter()
+        debugger.send("next")
+        position = debugger.wait_for(STOP_MARKER, position)
+        steps.append(time.perf_counter() - start)
+    latency = {"next": summarize(steps)}
+
+    if mode == "pxc":
+        debugger.send("break spin")
+        start = time.perf_counter()
+        debugger.send("continue")
+        debugger.wait_for(NATIVE_STOP_MARKER, position)
+        latency["native_breakpoint"] = summarize([time.perf_counter() - start])
+
+    debugger.finish("quit" if mode == "pdb" else "exit")
+    return latency
+
+
+def time_to_first_stop(mode: str, env: Optional[dict] = None) -> float:
+    start = time.perf_counter()
+    debugger = DebuggerProcess(debugger_argv(mode, "latency"), env)
+    debugger.wait_for(STOP_MARKER)
+    elapsed = time.perf_counter() - start
+    debugger.finish("quit" if mode == "pdb" else "exit")
+    return elapsed
+
+
+def measure_startup(mode: str, runs: int) -> dict:
+    """
+    Time from starting the debugger until pdb first stops, i.e. until the
+    user can type. pxc starts once with an empty lldb index cache (cold),
+    then with the cache filled (warm), and once more parsing all symbols
+    up front without a cache (eager).
+    """
+
+    if mode == "pdb":
+        return {"warm": summarize([time_to_first_stop(mode) for _ in range(runs)])}
+
+    cache = tempfile.mkdtemp(prefix="pxc-bench-cache-")
+    env = dict(os.environ, PXC_LLDB_CACHE=cache)
+    try:
+        cold = time_to_first_stop(mode, env)
+        warm = [time_to_first_stop(mode, env) for _ in range(runs)]
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+    env = dict(os.environ, PXC_LLDB_CACHE="", PXC_LLDB_LOAD_ON_DEMAND="0")
+    eager = [time_to_first_stop(mode, env) for _ in range(runs)]
+    return {"cold": cold, "warm": summarize(warm), "eager": summarize(eager)}
+
+
+def summarize(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "median": statistics.median(samples),
+        "max": samples[-1],
+    }
+
+
+def _channel_pair(kind: str) -> tuple[transport.Transport, transport.Transport]:
+    if kind == "shm":
+        path = tempfile.mkdtemp(prefix="pxc-bench-", dir=transport._shm_dir())
+        controller = transport.SharedMemoryTransport(path, controller=True)
+        return controller, transport.SharedMemoryTransport(path, controller=False)
+
+    listener = socket.socket()
+    listener.bind((transport.HOST, 0))
+    listener.listen(1)
+    debuggee = socket.create_connection(listener.getsockname())
+    controller, _ = listener.accept()
+    listener.close()
+    for s in (debuggee, controller):
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return controller, debuggee
+
+
+def measure_ipc(kind: str, events: int = 200_000, round_trips: int = 20_000) -> dict:
+    """
+    Throughput of C function events from the debuggee to the controller,
+    sent one by one and in batches, and round trips of a c_call waiting
+    for the controller's reply as during a step-in.
+    """
+
+    controller_end, debuggee_end = _channel_pair(kind)
+    controller = protocol.Channel(controller_end)
+    debuggee = protocol.Channel(debuggee_end)
+
+    def receive(count: int, reply: bool = False) -> None:
+        received = 0
+        while received < count:
+            message = controller.recv()
+            if message is None:
+                return
+            opcode, payload = message
+            if opcode == protocol.OP_BATCH:
+                received += len(payload) // protocol.BATCH_EVENT.size
+            else:
+                received += 1
+                if reply:
+                    controller.send_flag(protocol.OP_REPLY, True)
+
+    results = {}
+
+    receiver = threading.Thread(target=receive, args=(events,))
+    receiver.start()
+    start = time.perf_counter()
+    for i in range(events):
+        debuggee.send_event(protocol.OP_C_RETURN, "function", i)
+    receiver.join()
+    results["events_per_second"] = events / (time.perf_counter() - start)
+
+    batch = protocol.EventBatch(debuggee)
+    receiver = threading.Thread(target=receive, args=(events,))
+    receiver.start()
+    start = time.perf_counter()
+    for i in range(events):
+        batch.add(protocol.OP_C_RETURN, "function", i)
+    batch.flush()
+    receiver.join()
+    results["batched_events_per_second"] = events / (time.perf_counter() - start)
+
+    receiver = threading.Thread(target=receive, args=(round_trips, True))
+    receiver.start()
+    start = time.perf_counter()
+    for i in range(round_trips):
+        debuggee.send_event(protocol.OP_C_CALL, "function", i)
+        debuggee.recv()
+    receiver.join()
+    results["round_trips_per_second"] = round_trips / (time.perf_counter() - start)
+
+    debuggee.close()
+    controller.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--workloads", default=None, help="comma separated names")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="factor of the workload sizes"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of n runs")
+    parser.add_argument("--output", default="bench-results.json")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BENCH)
+    from workloads import WORKLOADS as ALL_WORKLOADS
+
+    modes = args.modes.split(",")
+    if any(m.startswith("pxc") for m in modes) and not importlib.util.find_spec("lldb"):
+        print("lldb is not importable, skipping the pxc modes", file=sys.stderr)
+        modes = [m for m in modes if not m.startswith("pxc")]
+    names = args.workloads.split(",") if args.workloads else list(ALL_WORKLOADS)
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transport": transport.TRANSPORT,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "workloads": {},
+    }
+
+    for name in names:
+        if name == "latency":
+            continue
+        workload = results["workloads"][name] = {}
+        size = max(1, int(ALL_WORKLOADS[name][1] * args.scale))
+        for mode in modes:
+            print(f"{name}: {mode}", file=sys.stderr)
+            runs = [run_workload(mode, name, size) for _ in range(args.repeat)]
+            workload[mode] = min(runs, key=lambda run: run["seconds"])
+        if "native" in workload:
+            native = workload["native"]["seconds"]
+            for mode in modes:
+                workload[mode]["slowdown"] = workload[mode]["seconds"] / native
+
+    print("ipc", file=sys.stderr)
+    results["ipc"] = {kind: measure_ipc(kind) for kind in ("tcp", "shm")}
+
+    results["latency"] = {}
+    for mode in ("pdb", "pxc"):
+        if mode in modes:
+            print(f"latency: {mode}", file=sys.stderr)
+            results["latency"][mode] = measure_latency(mode)
+
+    results["startup"] = {}
+    for mode in ("pdb", "pxc"):
+        if mode in modes:
+            print(f"startup: {mode}", file=sys.stderr)
+            results["startup"][mode] = measure_startup(mode, args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Workloads timed by bench/run.py, natively or under a debugger.
+
+    workloads.py <workload> [<size>]
+
+Prints a single `PXC_BENCH {...}` line with the time the workload took,
+startup and debugger prompts are not part of it.
+"""
+
+import sys
+import json
+import time
+
+import pxctest
+
+
+def never_called():
+    # bench/run.py sets a breakpoint here so that the debugger has to look
+    # for breakpoints while the workload runs
+    return None
+
+
+def c_calls(size: int) -> None:
+    add = pxctest.add
+    total = 0
+    for i in range(size):
+        total = add(total, i)
+
+
+def c_compute(size: int) -> None:
+    for _ in range(size):
+        pxctest.fib(27)
+
+
+def methods(size: int) -> None:
+    v = pxctest.Vector(1.0, 2.0, 2.0)
+    w = pxctest.Vector(0.5, 0.5, 0.5)
+    for _ in range(size):
+        v.norm()
+        v.dot(w)
+        u = v + w
+        u[1]
+        v.scale(1.0)
+
+
+def python_calls(size: int) -> None:
+    def fib(n: int) -> int:
+        return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+    for _ in range(size):
+        fib(20)
+
+
+def latency(size: int) -> None:
+    # stepped through line by line, then stopped in spin natively
+    x = 0
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    x += 1
+    for i in range(size):
+        pxctest.spin(1000)
+
+
+# name -> (function, default size)
+WORKLOADS = {
+    "c_calls": (c_calls, 1_000_000),
+    "c_compute": (c_compute, 20),
+    "methods": (methods, 200_000),
+    "python_calls": (python_calls, 50),
+    "latency": (latency, 1_000_000),
+}
+
+
+def main() -> None:
+    name = sys.argv[1]
+    function, size = WORKLOADS[name]
+    if len(sys.argv) > 2:
+        size = int(sys.argv[2])
+
+    start = time.perf_counter()
+    function(size)
+    seconds = time.perf_counter() - start
+
+    result = {"workload": name, "size": size, "seconds": seconds}
+    print("PXC_BENCH " + json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
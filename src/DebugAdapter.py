@@ -0,0 +1,610 @@
+import os
+import signal
+import asyncio
+import logging
+from typing import Callable, Optional
+
+import lldb
+from LLDBHost import LLDBException
+from Session import Session
+from pxc import REPR_BUDGET, CrossBreakpoint
+from inspection import PAGE_SIZE
+import dap
+
+logger = logging.getLogger("pxc-dbg")
+
+READ_SIZE = 64 * 1024
+# lldb numbers threads from 1, pdb runs on the main thread
+MAIN_THREAD_ID = 1
+# pdb commands that run the program, and why it stopped once pdb answers
+PDB_RESUME_REASONS = {
+    "c": "breakpoint",
+    "cont": "breakpoint",
+    "continue": "breakpoint",
+    "n": "step",
+    "next": "step",
+    "s": "step",
+    "step": "step",
+    "r": "step",
+    "return": "step",
+    "unt": "step",
+    "until": "step",
+}
+STOP_REASONS = {
+    lldb.eStopReasonBreakpoint: "breakpoint",
+    lldb.eStopReasonPlanComplete: "step",
+    lldb.eStopReasonTrace: "step",
+    lldb.eStopReasonWatchpoint: "data breakpoint",
+    lldb.eStopReasonException: "exception",
+    lldb.eStopReasonSignal: "exception",
+}
+CAPABILITIES = {
+    "supportsConfigurationDoneRequest": True,
+    "supportsFunctionBreakpoints": True,
+    "supportsConditionalBreakpoints": True,
+}
+
+
+class DAPOutput:
+    """
+    What the session writes, sent to the client as output events: the
+    debugger's own messages to the console, the program's to stdout.
+    """
+
+    def __init__(self, adapter: "DebugAdapter"):
+        self.adapter = adapter
+
+    def write(self, data: str, prompt: bool = True) -> None:
+        if data:
+            self.adapter.send_event(
+                "output", {"category": "console", "output": data + "\n"}
+            )
+
+    def write_output(self, data: str) -> None:
+        self.adapter.send_event("output", {"category": "stdout", "output": data})
+
+
+class DebugAdapter:
+    """
+    Serves one session to a Debug Adapter Protocol client. Requests are
+    answered on the loop as they arrive, events are pushed as soon as they
+    happen: native stops from LLDBHost.state_handlers, Python stops from
+    pdb replies on the controller channel and output as it is written.
+
+    Frame ids and variables references are handles into what the client
+    was shown, valid until the program runs again. Variables are fetched
+    a page at a time when the client expands them, never a whole frame.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, input_fd: int, output_fd: int):
+        self.loop = loop
+        self.input_fd = input_fd
+        self.output_fd = output_fd
+        self.reader = dap.MessageReader()
+        self.seq = 1
+        self.io = DAPOutput(self)
+        self.session: Optional[Session] = None
+
+        self.requests: dict[str, Callable[[dict, dict], None]] = {
+            "initialize": self.initialize,
+            "launch": self.launch,
+            "attach": self.attach,
+            "configurationDone": self.configuration_done,
+            "setBreakpoints": self.set_breakpoints,
+            "setFunctionBreakpoints": self.set_function_breakpoints,
+            "threads": self.threads,
+            "stackTrace": self.stack_trace,
+            "scopes": self.scopes,
+            "variables": self.variables,
+            "continue": self.continue_execution,
+            "next": self.step_over,
+            "stepIn": self.step_in,
+            "stepOut": self.step_out,
+            "pause": self.pause,
+            "evaluate": self.evaluate,
+            "disconnect": self.disconnect,
+        }
+
+        # the program runs on after its first stop unless asked not to, but
+        # only once the client has sent its breakpoints
+        self.stop_on_entry = False
+        self.configured = False
+        self.entry_pending = False
+
+        self.handles: dict[int, tuple] = {}
+        self.next_handle = 1
+        # source path -> breakpoints set there by the client
+        self.source_breakpoints: dict[str, list[CrossBreakpoint]] = {}
+        self.function_breakpoints: list[CrossBreakpoint] = []
+        # native threads seen at the last stop
+        self.thread_ids: set[int] = set()
+
+    def run(self) -> None:
+        self.loop.add_reader(self.input_fd, self.read_messages)
+        self.loop.run_forever()
+
+    def read_messages(self) -> None:
+        data = os.read(self.input_fd, READ_SIZE)
+        try:
+            messages = self.reader.feed(data) if data else None
+        except dap.DAPError as e:
+            logger.error(str(e))
+            messages = None
+        if messages is None:  # the client went away
+            self.loop.remove_reader(self.input_fd)
+            if self.session is not None:
+                self.session.execute("exit")
+            self.loop.stop()
+            return
+
+        for message in messages:
+            if message.get("type") == "request":
+                self.dispatch(message)
+
+    def dispatch(self, request: dict) -> None:
+        logger.debug(f"DAP request: {request}")
+        handler = self.requests.get(request.get("command"))
+        if handler is None:
+            self.fail(request, f"Unsupported request {request.get('command')}")
+            return
+        try:
+            handler(request, request.get("arguments") or {})
+        except (dap.DAPError, LLDBException) as e:
+            self.fail(request, str(e))
+
+    def send(self, message: dict) -> None:
+        message["seq"] = self.seq
+        self.seq += 1
+        data = dap.encode(message)
+        while data:
+            data = data[os.write(self.output_fd, data) :]
+
+    def respond(self, request: dict, body: Optional[dict] = None) -> None:
+        self.send(
+            {
+                "type": "response",
+                "request_seq": request["seq"],
+                "command": request["command"],
+                "success": True,
+                "body": body or {},
+            }
+        )
+
+    def fail(self, request: dict, message: str) -> None:
+        self.send(
+            {
+                "type": "response",
+                "request_seq": request["seq"],
+                "command": request["command"],
+                "success": False,
+                "message": message,
+            }
+        )
+
+    def send_event(self, event: str, body: Optional[dict] = None) -> None:
+        self.send({"type": "event", "event": event, "body": body or {}})
+
+    def handle(self, value: tuple) -> int:
+        handle = self.next_handle
+        self.next_handle += 1
+        self.handles[handle] = value
+        return handle
+
+    def resolve(self, handle: int) -> tuple:
+        try:
+            return self.handles[handle]
+        except KeyError:
+            raise dap.DAPError("The program ran since this was shown") from None
+
+    def require_session(self) -> Session:
+        if self.session is None:
+            raise dap.DAPError("No program is being debugged")
+        return self.session
+
+    # session lifetime
+
+    def initialize(self, request: dict, arguments: dict) -> None:
+        self.respond(request, CAPABILITIES)
+
+    def launch(self, request: dict, arguments: dict) -> None:
+        if "program" not in arguments:
+            raise dap.DAPError("No program to launch")
+        self.stop_on_entry = arguments.get("stopOnEntry", False)
+        self.start_session([arguments["program"], *arguments.get("args", [])])
+        self.respond(request)
+        self.send_event("initialized")
+
+    def attach(self, request: dict, arguments: dict) -> None:
+        if not str(arguments.get("pid", "")).isdigit():
+            raise dap.DAPError("No pid to attach to")
+        self.stop_on_entry = arguments.get("stopOnEntry", False)
+        self.start_session([], int(arguments["pid"]))
+        self.respond(request)
+        self.send_event("initialized")
+
+    def start_session(self, args: list[str], pid: Optional[int] = None) -> None:
+        if self.session is not None:
+            raise dap.DAPError("A program is already being debugged")
+        session = Session(1, self.io, self.loop, self.session_closed, args, pid)
+        session.lldb_host.state_handlers.append(self.process_state_changed)
+        session.pxc.pdb_reply_handlers.append(self.pdb_replied)
+        self.session = session
+
+    def configuration_done(self, request: dict, arguments: dict) -> None:
+        self.configured = True
+        self.respond(request)
+        if self.entry_pending:
+            self.entry_pending = False
+            self.entered()
+
+    def disconnect(self, request: dict, arguments: dict) -> None:
+        # an attached process is detached and runs on
+        if self.session is not None:
+            self.session.execute("exit")
+        self.respond(request)
+        self.loop.remove_reader(self.input_fd)
+        self.loop.stop()
+
+    def session_closed(self, session: Session) -> None:
+        self.session = None
+        self.handles.clear()
+        self.send_event("terminated")
+
+    # events
+
+    def process_state_changed(self, state: int) -> None:
+        session = self.session
+        if session is None:
+            return
+        process = session.lldb_host.process
+        if state == lldb.eStateStopped:
+            self.update_threads(process)
+            thread = process.GetSelectedThread()
+            self.stopped(
+                self.stop_reason(thread),
+                thread.GetIndexID(),
+                thread.GetStopDescription(256),
+            )
+        elif state == lldb.eStateExited:
+            self.send_event("exited", {"exitCode": process.GetExitStatus()})
+            # not while lldb is still handing out this event
+            self.loop.call_soon(session.close)
+
+    def update_threads(self, process: lldb.SBProcess) -> None:
+        thread_ids = {thread.GetIndexID() for thread in process}
+        for thread_id in sorted(thread_ids - self.thread_ids):
+            self.send_event("thread", {"reason": "started", "threadId": thread_id})
+        for thread_id in sorted(self.thread_ids - thread_ids):
+            self.send_event("thread", {"reason": "exited", "threadId": thread_id})
+        self.thread_ids = thread_ids
+
+    def stop_reason(self, thread: lldb.SBThread) -> str:
+        reason = thread.GetStopReason()
+        if reason == lldb.eStopReasonBreakpoint:
+            # a step-in into C stops at a one shot breakpoint
+            breakpoint_id = thread.GetStopReasonDataAtIndex(0)
+            if breakpoint_id in self.session.stepping_in_breakpoints:
+                return "step"
+        if reason == lldb.eStopReasonSignal:
+            if thread.GetStopReasonDataAtIndex(0) == signal.SIGSTOP:
+                return "pause"
+        return STOP_REASONS.get(reason, "pause")
+
+    def pdb_replied(self, request_id: int, command: Optional[str], output: str) -> None:
+        if request_id == 0:
+            # pdb stopped for the first time
+            if self.configured:
+                self.entered()
+            else:
+                self.entry_pending = True
+            return
+
+        if command is None:
+            return
+        name, _, argument = command.partition(" ")
+        if name in PDB_RESUME_REASONS:
+            self.stopped(PDB_RESUME_REASONS[name], MAIN_THREAD_ID)
+        elif name == "pxbreak" and output.startswith("Breakpoint "):
+            # pdb found the location, lldb might not have
+            breakpoint_id = int(argument.partition(" ")[0])
+            self.send_event(
+                "breakpoint",
+                {
+                    "reason": "changed",
+                    "breakpoint": {"id": breakpoint_id, "verified": True},
+                },
+            )
+
+    def entered(self) -> None:
+        if self.stop_on_entry:
+            self.stopped("entry", MAIN_THREAD_ID)
+        else:
+            self.session.execute("c")
+
+    def stopped(
+        self, reason: str, thread_id: int, description: Optional[str] = None
+    ) -> None:
+        self.handles.clear()
+        body = {"reason": reason, "threadId": thread_id, "allThreadsStopped": True}
+        if description:
+            body["description"] = description
+        self.send_event("stopped", body)
+
+    # breakpoints
+
+    def set_breakpoints(self, request: dict, arguments: dict) -> None:
+        # the client sends every breakpoint of the source at once
+        session = self.require_session()
+        path = arguments.get("source", {}).get("path")
+        if not path:
+            raise dap.DAPError("Breakpoints need a source path")
+        self.delete_breakpoints(self.source_breakpoints.pop(path, []))
+
+        breakpoints, results = [], []
+        for spec in arguments.get("breakpoints", []):
+            breakpoint = session.pxc.set_breakpoint(f"{path}:{spec['line']}")
+            if spec.get("condition"):
+                session.pxc.set_condition(breakpoint, spec["condition"])
+            breakpoints.append(breakpoint)
+            results.append(
+                self.describe_breakpoint(breakpoint) | {"line": spec["line"]}
+            )
+        self.source_breakpoints[path] = breakpoints
+        self.respond(request, {"breakpoints": results})
+
+    def set_function_breakpoints(self, request: dict, arguments: dict) -> None:
+        session = self.require_session()
+        self.delete_breakpoints(self.function_breakpoints)
+
+        self.function_breakpoints, results = [], []
+        for spec in arguments.get("breakpoints", []):
+            breakpoint = session.pxc.set_breakpoint(spec["name"])
+            if spec.get("condition"):
+                session.pxc.set_condition(breakpoint, spec["condition"])
+            self.function_breakpoints.append(breakpoint)
+            results.append(self.describe_breakpoint(breakpoint))
+        self.respond(request, {"breakpoints": results})
+
+    def delete_breakpoints(self, breakpoints: list[CrossBreakpoint]) -> None:
+        pxc = self.session.pxc
+        for breakpoint in breakpoints:
+            # unless deleted from the console already
+            if breakpoint.id in pxc.breakpoints:
+                pxc.delete_breakpoint(breakpoint)
+
+    def describe_breakpoint(self, breakpoint: CrossBreakpoint) -> dict:
+        # verified once either engine found the location, pdb only answers
+        # when it next stops (see pdb_replied)
+        native = None
+        if breakpoint.lldb_id is not None:
+            native = self.session.lldb_host.breakpoints.get(breakpoint.lldb_id)
+        return {
+            "id": breakpoint.id,
+            "verified": bool(native and native.GetNumLocations()),
+        }
+
+    # running
+
+    def resume(self, command: str) -> None:
+        self.handles.clear()
+        self.require_session().execute(command)
+
+    def continue_execution(self, request: dict, arguments: dict) -> None:
+        self.resume("c")
+        self.respond(request, {"allThreadsContinued": True})
+
+    def step_over(self, request: dict, arguments: dict) -> None:
+        self.resume("n")
+        self.respond(request)
+
+    def step_in(self, request: dict, arguments: dict) -> None:
+        self.resume("s")
+        self.respond(request)
+
+    def step_out(self, request: dict, arguments: dict) -> None:
+        session = self.require_session()
+        if session.lldb_host.is_stopped():
+            self.resume("lldb thread step-out")
+        else:
+            self.resume("pdb r")
+        self.respond(request)
+
+    def pause(self, request: dict, arguments: dict) -> None:
+        # stops in lldb, wherever the program is
+        lldb_host = self.require_session().lldb_host
+        if not lldb_host.is_stopped():
+            error = lldb_host.process.Stop()
+            if error.Fail():
+                raise dap.DAPError(f"Could not pause: {error.GetCString()}")
+        self.respond(request)
+
+    def evaluate(self, request: dict, arguments: dict) -> None:
+        # the debug console takes the commands of the REPL
+        if arguments.get("context") != "repl":
+            raise dap.DAPError("Expressions are evaluated in the debug console only")
+        self.require_session().execute(arguments.get("expression", "").strip())
+        self.respond(request, {"result": "", "variablesReference": 0})
+
+    # stopped state
+
+    def threads(self, request: dict, arguments: dict) -> None:
+        threads = []
+        if self.session is not None:
+            process = self.session.lldb_host.process
+            if process.IsValid():
+                threads = [
+                    {
+                        "id": thread.GetIndexID(),
+                        "name": thread.GetName() or f"thread #{thread.GetIndexID()}",
+                    }
+                    for thread in process
+                ]
+        self.respond(
+            request, {"threads": threads or [{"id": MAIN_THREAD_ID, "name": "main"}]}
+        )
+
+    def stack_trace(self, request: dict, arguments: dict) -> None:
+        session = self.require_session()
+        start = arguments.get("startFrame", 0)
+        levels = arguments.get("levels") or None
+
+        if not session.lldb_host.is_stopped():
+            # stopped in pdb, the debuggee knows its Python frames
+            session.pxc.inspect(
+                {"stack": True},
+                lambda reply: self.python_stack_trace(request, reply, start, levels),
+            )
+            return
+
+        thread = session.lldb_host.process.GetThreadByIndexID(arguments["threadId"])
+        if not thread.IsValid():
+            raise dap.DAPError(f"No thread {arguments['threadId']}")
+        total = thread.GetNumFrames()
+        end = total if levels is None else min(total, start + levels)
+        frames = [
+            self.native_frame(thread.GetFrameAtIndex(i)) for i in range(start, end)
+        ]
+        self.respond(request, {"stackFrames": frames, "totalFrames": total})
+
+    def native_frame(self, frame: lldb.SBFrame) -> dict:
+        pc = hex(frame.GetPC())
+        stack_frame = {
+            "id": self.handle(("native", frame)),
+            "name": frame.GetFunctionName() or pc,
+            "line": 0,
+            "column": 0,
+            "instructionPointerReference": pc,
+        }
+        line_entry = frame.GetLineEntry()
+        if line_entry.IsValid():
+            stack_frame["source"] = {"path": str(line_entry.GetFileSpec())}
+            stack_frame["line"] = line_entry.GetLine()
+            stack_frame["column"] = line_entry.GetColumn()
+        return stack_frame
+
+    def python_stack_trace(
+        self, request: dict, reply: dict, start: int, levels: Optional[int]
+    ) -> None:
+        if "error" in reply:
+            self.fail(request, reply["error"])
+            return
+
+        frames = reply["frames"]
+        end = len(frames) if levels is None else start + levels
+        stack_frames = []
+        for index in range(start, min(end, len(frames))):
+            frame = frames[index]
+            stack_frame = {
+                "id": self.handle(("python", index)),
+                "name": frame["name"],
+                "line": frame["line"],
+                "column": 0,
+            }
+            # code compiled from strings has no file
+            if not frame["file"].startswith("<"):
+                stack_frame["source"] = {"path": frame["file"]}
+            stack_frames.append(stack_frame)
+        self.respond(request, {"stackFrames": stack_frames, "totalFrames": len(frames)})
+
+    def scopes(self, request: dict, arguments: dict) -> None:
+        kind, frame = self.resolve(arguments["frameId"])
+        if kind == "native":
+            locals_handle = self.handle(("locals", frame))
+        else:
+            locals_handle = self.handle(("python", frame, [], False))
+        self.respond(
+            request,
+            {
+                "scopes": [
+                    {
+                        "name": "Locals",
+                        "presentationHint": "locals",
+                        "variablesReference": locals_handle,
+                        "expensive": False,
+                    }
+                ]
+            },
+        )
+
+    def variables(self, request: dict, arguments: dict) -> None:
+        session = self.require_session()
+        reference = self.resolve(arguments["variablesReference"])
+        start = arguments.get("start", 0)
+        count = arguments.get("count") or PAGE_SIZE
+        # containers are paged by index, they have no named children
+        named_only = arguments.get("filter") == "named"
+
+        if reference[0] == "python":
+            _, frame, path, indexed = reference
+            if named_only and indexed:
+                self.respond(request, {"variables": []})
+                return
+            session.pxc.inspect(
+                {
+                    "frame": frame,
+                    "path": path,
+                    "start": start,
+                    "count": count,
+                    "budget": REPR_BUDGET,
+                },
+                lambda reply: self.python_variables(request, reply, frame, path),
+            )
+            return
+
+        kind, value = reference
+        if kind == "locals":
+            values = value.GetVariables(True, True, False, True)
+            size, child = values.GetSize(), values.GetValueAtIndex
+        elif named_only and value.GetType().IsArrayType():
+            size, child = 0, None
+        else:
+            size, child = value.GetNumChildren(), value.GetChildAtIndex
+        variables = [
+            self.native_variable(child(i))
+            for i in range(start, min(size, start + count))
+        ]
+        self.respond(request, {"variables": variables})
+
+    def native_variable(self, value: lldb.SBValue) -> dict:
+        if value.GetTypeName() == "PyObject *":
+            text = self.session.lldb_host.formatter.format(value.GetValueAsUnsigned())
+        else:
+            text = value.GetValue() or value.GetSummary() or ""
+        variable = {
+            "name": value.GetName() or "",
+            "type": value.GetTypeName() or "",
+            "value": text,
+            "variablesReference": 0,
+        }
+        children = value.GetNumChildren()
+        if children:
+            variable["variablesReference"] = self.handle(("value", value))
+            if value.GetType().IsArrayType():
+                variable["indexedVariables"] = children
+        return variable
+
+    def python_variables(
+        self, request: dict, reply: dict, frame: int, path: list[str]
+    ) -> None:
+        if "error" in reply:
+            self.fail(request, reply["error"])
+            return
+
+        variables = []
+        for summary in reply["children"]:
+            variable = {
+                "name": summary["name"],
+                "type": summary["type"],
+                "value": summary["repr"],
+                "variablesReference": 0,
+            }
+            if summary["children"]:
+                # sized containers are paged by the client
+                indexed = "length" in summary
+                variable["variablesReference"] = self.handle(
+                    ("python", frame, path + [summary["name"]], indexed)
+                )
+                if indexed:
+                    variable["indexedVariables"] = summary["length"]
+            variables.append(variable)
+        self.respond(request, {"variables": variables})
@@ -1,5 +1,7 @@
 import os
 import sys
+import codecs
+import asyncio
 from typing import Optional
 from threading import Lock
 
@@ -9,9 +11,29 @@ logger = logging.getLogger("pxc-dbg")
 
 io_lock = Lock()
 
+# reads and output writes are done in chunks of at most this size
+CHUNK_SIZE = 64 * 1024
+# output of the debugged program is written at most this often
+FLUSH_INTERVAL = 0.02
+
 
 class IOManager:
-    def __init__(self, prompt: str = ">>> "):
+    def __init__(
+        self, prompt: str = ">>> ", loop: Optional[asyncio.AbstractEventLoop] = None
+    ):
+        self.set_prompt(prompt)
+        self.read_buffer = bytearray(CHUNK_SIZE)
+        # a read may end inside a character, its first bytes are kept here
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        # output of the debugged program waiting to be written, without a
+        # loop it is written right away
+        self.loop = loop
+        self.pending: list[str] = []
+        self.pending_size = 0
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def set_prompt(self, prompt: str):
         self.prompt = prompt
         self.replace_blank = "\b" * len(prompt) + " " * len(prompt)
 
@@ -24,28 +46,64 @@ class IOManager:
             print(self.replace_blank, end="", flush=True)
 
     def write(self, data: str, prompt: bool = True):
+        # keep program output ahead of what the debugger says about it
+        self.flush_output()
+        self._write(data, prompt)
+
+    def write_output(self, data: str):
+        """
+        Queues output of the debugged program. Everything queued within
+        FLUSH_INTERVAL is written at once, so a chatty program costs one
+        terminal write per interval instead of one per chunk. Once a chunk
+        worth of output is pending it is written synchronously, which pushes
+        back on lldb and in turn on the program.
+        """
+
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.loop is None or self.pending_size >= CHUNK_SIZE:
+            self.flush_output()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(FLUSH_INTERVAL, self.flush_output)
+
+    def flush_output(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+
+        data = "".join(self.pending)
+        self.pending.clear()
+        self.pending_size = 0
+        self._write(data)
+
+    def _write(self, data: str, prompt: bool = True):
         with io_lock:
             logger.debug(f"Write: {data}")
             print(
                 self.replace_blank,
                 "\r",
-                data[:-6] if data.endswith("(Pdb) ") else data,
+                data,
                 "\n",
                 self.prompt if prompt else "",
                 end="",
                 flush=True,
             )
 
-    def read(self, blocking: bool = False) -> Optional[str]:
-        with io_lock:
-            os.set_blocking(sys.stdin.fileno(), blocking)
-            try:
-                content = os.read(sys.stdin.fileno(), 1024 * 1024 * 10).decode().strip()
-            except BlockingIOError:
-                content = None
-
-        if content is not None:
-            logger.debug(f"Read: {content}")
+    def read(self) -> Optional[str]:
+        """
+        Reads what the user typed, meant to be called once stdin is readable.
+        Returns None once stdin is closed.
+        """
+
+        size = os.readv(sys.stdin.fileno(), [self.read_buffer])
+        if not size:
+            self.decoder.reset()
+            return None
+
+        content = self.decoder.decode(self.read_buffer[:size]).strip()
+        logger.debug(f"Read: {content}")
         return content
 
 
@@ -54,5 +112,5 @@ if __name__ == "__main__":
     io = IOManager()
     io.start()
     io.write("Hello World")
-    io.write("Got: " + io.read(True))
+    io.write("Got: " + io.read())
     io.stop()
@@ -1,79 +1,366 @@
 import os
+import sys
 import logging
+import asyncio
+import tempfile
+import linecache
+from typing import Callable, Iterable, Optional
 import lldb
 from IOManager import IOManager
+from PyObjectFormatter import FormatterError, PyObjectFormatter, UnsupportedVersion
+from PyBacktrace import EVAL_FUNCTION, PyBacktrace
 from threading import Thread
 
 logger = logging.getLogger("pxc-dbg")
 
+# seconds the event pump waits for an lldb event before looking around,
+# by default it waits until an event or a shutdown request arrives
+EVENT_TIMEOUT = int(os.getenv("PXC_LLDB_EVENT_TIMEOUT", lldb.UINT32_MAX))
+SHUTDOWN_EVENT = 1
+OUTPUT_CHUNK_SIZE = 64 * 1024
+EXPRESSION_TIMEOUT_US = 5_000_000
+# debug info of a module is parsed once something needs it, not when the
+# module loads, which is most of the startup time with large extensions
+LOAD_ON_DEMAND = os.getenv("PXC_LLDB_LOAD_ON_DEMAND", "1") == "1"
+# lldb keeps the symbol indexes of the interpreter and extensions here, so
+# later runs skip indexing unchanged modules; empty disables the cache
+INDEX_CACHE = os.getenv(
+    "PXC_LLDB_CACHE",
+    os.path.join(
+        os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "pxc-dbg", "lldb"
+    ),
+)
+# schedules PyRun_SimpleString(source) as a pending call, which the main
+# thread runs with the GIL held once it next executes bytecode
+PENDING_CALL_EXPRESSION = (
+    "(int)((int (*)(int (*)(void *), void *))Py_AddPendingCall)"
+    "((int (*)(void *))PyRun_SimpleString, (void *){addr})"
+)
+
 
 class LLDBException(Exception):
     pass
 
 
 class LLDBEventHandler(Thread):
-    def __init__(self, debugger: "LLDBHost", io_manager: IOManager):
+    def __init__(
+        self, debugger: "LLDBHost", io_manager: IOManager, timeout: int = EVENT_TIMEOUT
+    ):
         super().__init__()
         self.debugger_host = debugger
         self.stop_event_handler = False
         self.io_manager = io_manager
+        self.timeout = timeout
+
+        # broadcasting on this wakes the pump up when it has to stop
+        self.shutdown_broadcaster = lldb.SBBroadcaster("pxc.shutdown")
 
     def run(self):
         listener = self.debugger_host.debugger.GetListener()
-        event = lldb.SBEvent()
+        listener.StartListeningForEvents(self.shutdown_broadcaster, SHUTDOWN_EVENT)
         while not self.stop_event_handler:
-            if listener.WaitForEvent(1, event):
-                if event.GetBroadcaster().GetName() == "lldb.process":
-                    if (
-                        event.GetType() == lldb.SBProcess.eBroadcastBitStateChanged
-                        and self.debugger_host.is_stopped()
-                    ):
-                        output, result = self.debugger_host.execute("process status")
-                        assert result
-                        if output:
-                            self.io_manager.write(output)
-                    elif event.GetType() == lldb.SBProcess.eBroadcastBitSTDOUT:
-                        output = self.debugger_host.get_stdout()
-                        if output:
-                            self.io_manager.write(output)
-                    elif event.GetType() == lldb.SBProcess.eBroadcastBitSTDERR:
-                        output = self.debugger_host.get_stderr()
-                        if output:
-                            self.io_manager.write(output)
-
-                stream = lldb.SBStream()
-                event.GetDescription(stream)
-                logger.debug(f"Received LLDB Event: {stream.GetData()}")
+            event = lldb.SBEvent()
+            if not listener.WaitForEvent(self.timeout, event):
+                continue
+            if event.BroadcasterMatchesRef(self.shutdown_broadcaster):
+                continue
+
+            # lldb has no file descriptor to select on, events are
+            # handed over to the loop of the controller when there is one
+            if self.debugger_host.loop:
+                self.debugger_host.loop.call_soon_threadsafe(self.handle_event, event)
+            else:
+                self.handle_event(event)
 
+        listener.StopListeningForEvents(self.shutdown_broadcaster, SHUTDOWN_EVENT)
         listener.Clear()
 
+    def stop(self):
+        self.stop_event_handler = True
+        self.shutdown_broadcaster.BroadcastEventByType(SHUTDOWN_EVENT)
+
+    def handle_event(self, event: lldb.SBEvent):
+        if lldb.SBProcess.EventIsProcessEvent(event):
+            event_type = event.GetType()
+            if event_type & lldb.SBProcess.eBroadcastBitStateChanged:
+                state = lldb.SBProcess.GetStateFromEvent(event)
+                if state == lldb.eStateStopped:
+                    self.io_manager.write(self.debugger_host.describe_stop())
+                for handler in self.debugger_host.state_handlers:
+                    handler(state)
+            elif event_type & lldb.SBProcess.eBroadcastBitSTDOUT:
+                output = self.debugger_host.get_stdout()
+                if output:
+                    self.io_manager.write_output(output)
+            elif event_type & lldb.SBProcess.eBroadcastBitSTDERR:
+                output = self.debugger_host.get_stderr()
+                if output:
+                    self.io_manager.write_output(output)
+        elif lldb.SBTarget.EventIsTargetEvent(event):
+            modules = [
+                lldb.SBTarget.GetModuleAtIndexFromEvent(i, event)
+                for i in range(lldb.SBTarget.GetNumModulesFromEvent(event))
+            ]
+            if event.GetType() & lldb.SBTarget.eBroadcastBitModulesLoaded:
+                self.debugger_host.symbols.add(modules)
+            elif event.GetType() & lldb.SBTarget.eBroadcastBitModulesUnloaded:
+                self.debugger_host.symbols.remove(modules)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            stream = lldb.SBStream()
+            event.GetDescription(stream)
+            logger.debug(f"Received LLDB Event: {stream.GetData()}")
+
+
+class BreakpointManager:
+    """
+    Breakpoints made through the SB API instead of the command interpreter,
+    indexed by address so an address never gets a second breakpoint.
+    """
+
+    def __init__(self, target: lldb.SBTarget):
+        self.target = target
+        # address -> breakpoint id, one shot breakpoints may be gone already
+        self.by_address: dict[int, int] = {}
+
+    def at_address(self, addr: int, one_shot: bool = False) -> int:
+        """
+        Returns the id of the breakpoint at addr, creating it if needed.
+        """
+
+        breakpoint_id = self.by_address.get(addr)
+        if breakpoint_id is not None:
+            if self.target.FindBreakpointByID(breakpoint_id).IsValid():
+                return breakpoint_id
+            del self.by_address[addr]
+
+        breakpoint = self.target.BreakpointCreateByAddress(addr)
+        if not breakpoint.IsValid():
+            raise LLDBException(f"Could not set a breakpoint at {hex(addr)}")
+        breakpoint.SetOneShot(one_shot)
+
+        breakpoint_id = breakpoint.GetID()
+        logger.debug(f"Breakpoint {breakpoint_id} at {hex(addr)}")
+        self.by_address[addr] = breakpoint_id
+        return breakpoint_id
+
+    def by_symbol(
+        self, symbol: str, modules: Optional[list[str]] = None
+    ) -> lldb.SBBreakpoint:
+        """
+        Breakpoint on a function name or a file:line location, pending
+        until the symbol shows up in a loaded module. A name is only looked
+        for in `modules` when given, instead of in every module.
+        """
+
+        filename, _, line = symbol.rpartition(":")
+        if filename and line.isdigit():
+            breakpoint = self.target.BreakpointCreateByLocation(filename, int(line))
+        elif modules:
+            module_list = lldb.SBFileSpecList()
+            for path in modules:
+                module_list.Append(lldb.SBFileSpec(path))
+            breakpoint = self.target.BreakpointCreateByName(
+                symbol, module_list, lldb.SBFileSpecList()
+            )
+        else:
+            breakpoint = self.target.BreakpointCreateByName(symbol)
+        if not breakpoint.IsValid():
+            raise LLDBException(f"Could not set a breakpoint at {symbol}")
+        return breakpoint
+
+    def get(self, breakpoint_id: int) -> Optional[lldb.SBBreakpoint]:
+        breakpoint = self.target.FindBreakpointByID(breakpoint_id)
+        return breakpoint if breakpoint.IsValid() else None
+
+    def delete(self, breakpoint_ids: Iterable[int]) -> None:
+        breakpoint_ids = set(breakpoint_ids)
+        if not breakpoint_ids:
+            return
+
+        for breakpoint_id in breakpoint_ids:
+            # one shot breakpoints delete themselves when hit
+            self.target.BreakpointDelete(breakpoint_id)
+        self.by_address = {
+            addr: breakpoint_id
+            for addr, breakpoint_id in self.by_address.items()
+            if breakpoint_id not in breakpoint_ids
+        }
+
+
+class SymbolIndex:
+    """
+    Names of the code symbols of the loaded modules -> paths of the modules
+    defining them, so that a breakpoint on a name goes to those modules only
+    (see BreakpointManager.by_symbol). Modules are added as lldb reports
+    them loaded and indexed when a name is first looked up after that, each
+    only once.
+    """
+
+    def __init__(self, target: lldb.SBTarget):
+        self.names: dict[str, set[str]] = {}
+        # module path -> the names it defines, or None until it is indexed
+        self.modules: dict[str, Optional[list[str]]] = {}
+        self.pending: list[lldb.SBModule] = []
+        self.add(target.GetModuleAtIndex(i) for i in range(target.GetNumModules()))
+
+    @staticmethod
+    def path(module: lldb.SBModule) -> str:
+        return str(module.GetFileSpec())
+
+    def add(self, modules: Iterable[lldb.SBModule]) -> None:
+        for module in modules:
+            path = self.path(module)
+            if path not in self.modules:
+                self.modules[path] = None
+                self.pending.append(module)
+
+    def remove(self, modules: Iterable[lldb.SBModule]) -> None:
+        for module in modules:
+            path = self.path(module)
+            for name in self.modules.pop(path, None) or []:
+                paths = self.names.get(name)
+                if paths is not None:
+                    paths.discard(path)
+                    if not paths:
+                        del self.names[name]
+        self.pending = [m for m in self.pending if self.path(m) in self.modules]
+
+    def lookup(self, name: str) -> list[str]:
+        self.index_pending()
+        return sorted(self.names.get(name, ()))
+
+    def index_pending(self) -> None:
+        while self.pending:
+            module = self.pending.pop()
+            path = self.path(module)
+            names = set()
+            for i in range(module.GetNumSymbols()):
+                symbol = module.GetSymbolAtIndex(i)
+                if symbol.GetType() != lldb.eSymbolTypeCode or not symbol.GetName():
+                    continue
+                # C++ names come with their parameters, breakpoints are set
+                # on the qualified or the base name
+                name = symbol.GetName().partition("(")[0]
+                names.add(name)
+                names.add(name.rpartition("::")[2])
+            for name in names:
+                self.names.setdefault(name, set()).add(path)
+            self.modules[path] = list(names)
+            logger.debug(f"Indexed {len(names)} symbols of {path}")
+
 
 class LLDBHost:
-    def __init__(self, exe: str, io_manager: IOManager, args: list[str] = []):
+    """
+    Launches `exe` with `args` under lldb, or attaches to the running
+    process `pid` instead. Every host has a debugger of its own.
+    """
+
+    def __init__(
+        self,
+        exe: Optional[str],
+        io_manager: IOManager,
+        args: list[str] = [],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        pid: Optional[int] = None,
+        env: Optional[dict[str, str]] = None,
+    ):
         logger.debug("Creating lldb instance")
         self.exe = exe
         self.args = args
+        self.loop = loop
+        self.attached = pid is not None
+        # files run by an attached process, removed when the debugger stops
+        self.temporary_files: list[str] = []
+        # called with every state the process changes to, on the loop if any
+        self.state_handlers: list[Callable[[int], None]] = []
         self.debugger = lldb.SBDebugger.Create()
         self.debugger.SetAsync(True)
         self.debugger.SetUseColor(True)
 
         self.command_interpreter = self.debugger.GetCommandInterpreter()
+        # before the first target, which parses symbols as it is created
+        self.configure_symbols()
 
-        logger.debug(f"Creating target for {self.exe}")
-        self.target = self.debugger.CreateTarget(self.exe)
+        if pid is None:
+            logger.debug(f"Creating target for {self.exe}")
+            self.target = self.debugger.CreateTarget(self.exe)
+            self.breakpoints = BreakpointManager(self.target)
+            self.listen_for_modules()
 
-        logger.debug(f"Launching process for {self.exe} with args {self.args}")
-        self.process = self.target.LaunchSimple(self.args, None, os.getcwd())
+            logger.debug(f"Launching process for {self.exe} with args {self.args}")
+            envp = [f"{name}={value}" for name, value in env.items()] if env else None
+            self.process = self.target.LaunchSimple(self.args, envp, os.getcwd())
+        else:
+            # lldb finds the executable and modules of the process itself
+            self.target = self.debugger.CreateTarget("")
+            self.breakpoints = BreakpointManager(self.target)
+            self.listen_for_modules()
+
+            logger.debug(f"Attaching to process {pid}")
+            error = lldb.SBError()
+            # synchronously, the process is stopped once this returns
+            self.debugger.SetAsync(False)
+            self.process = self.target.AttachToProcessWithID(
+                self.debugger.GetListener(), pid, error
+            )
+            self.debugger.SetAsync(True)
+            if error.Fail():
+                raise LLDBException(
+                    f"Could not attach to process {pid}: {error.GetCString()}"
+                )
+        # after launching or attaching, the modules loaded by then are added
+        # here and later ones as their events arrive
+        self.symbols = SymbolIndex(self.target)
+        self.formatter = PyObjectFormatter(
+            self.process, self.target, self.python_version
+        )
+        self.python_frames = PyBacktrace(self.target, self.formatter)
 
         self.start_events_handler(io_manager)
 
+    def listen_for_modules(self) -> None:
+        # see SymbolIndex
+        self.debugger.GetListener().StartListeningForEvents(
+            self.target.GetBroadcaster(),
+            lldb.SBTarget.eBroadcastBitModulesLoaded
+            | lldb.SBTarget.eBroadcastBitModulesUnloaded,
+        )
+
+    def configure_symbols(self) -> None:
+        settings = []
+        if LOAD_ON_DEMAND:
+            settings.append("symbols.load-on-demand true")
+        if INDEX_CACHE:
+            try:
+                os.makedirs(INDEX_CACHE, exist_ok=True)
+                settings.append("symbols.enable-lldb-index-cache true")
+                settings.append(f'symbols.lldb-index-cache-path "{INDEX_CACHE}"')
+            except OSError as e:
+                logger.debug(f"No lldb index cache: {e}")
+
+        for setting in settings:
+            output, succeeded = self.execute(f"settings set {setting}")
+            if not succeeded:
+                # older lldb, startup is just slower
+                logger.debug(f"Could not set {setting}: {output}")
+
     def get_stdout(self) -> str:
         logger.debug("Getting STDOUT")
-        return self.process.GetSTDOUT(1024 * 1024 * 10)
+        return self._drain(self.process.GetSTDOUT)
 
     def get_stderr(self) -> str:
         logger.debug("Getting STDERR")
-        return self.process.GetSTDERR(1024 * 1024 * 10)
+        return self._drain(self.process.GetSTDERR)
+
+    @staticmethod
+    def _drain(read) -> str:
+        # the bindings allocate the requested size on every call, so read
+        # modest chunks until lldb has nothing left
+        chunks = []
+        while chunk := read(OUTPUT_CHUNK_SIZE):
+            chunks.append(chunk)
+        return "".join(chunks)
 
     def set_stdin(self, data: str) -> None:
         logger.debug(f"Putting {data} to STDIN")
@@ -82,17 +369,190 @@ class LLDBHost:
     def is_stopped(self) -> bool:
         return self.process.GetState() == lldb.eStateStopped
 
+    def describe_stop(self) -> str:
+        """
+        Describes where the process stopped, like `process status` but read
+        straight from the SB API.
+        """
+
+        thread = self.process.GetSelectedThread()
+        frame = thread.GetSelectedFrame()
+
+        description = [
+            f"Process {self.process.GetProcessID()} stopped",
+            f"* thread #{thread.GetIndexID()}, name = '{thread.GetName()}', "
+            f"stop reason = {thread.GetStopDescription(256)}",
+        ]
+
+        location = self.describe_frame(frame)
+        line_entry = frame.GetLineEntry()
+        if line_entry.IsValid():
+            file_spec = line_entry.GetFileSpec()
+            source = linecache.getline(str(file_spec), line_entry.GetLine())
+            if source:
+                location += f"\n-> {line_entry.GetLine()}\t{source.rstrip()}"
+        description.append(location)
+
+        return "\n".join(description)
+
+    @staticmethod
+    def describe_frame(frame: lldb.SBFrame) -> str:
+        location = f"    frame #{frame.GetFrameID()}: {hex(frame.GetPC())}"
+        module = frame.GetModule().GetFileSpec().GetFilename()
+        if module:
+            location += f" {module}`{frame.GetFunctionName() or '??'}"
+        line_entry = frame.GetLineEntry()
+        if line_entry.IsValid():
+            file_spec = line_entry.GetFileSpec()
+            location += f" at {file_spec.GetFilename()}:{line_entry.GetLine()}"
+        return location
+
+    def symbol_name(self, addr: int) -> Optional[str]:
+        """
+        Returns module`symbol of a load address in the running process, or
+        None if lldb has no symbol there.
+        """
+
+        address = self.target.ResolveLoadAddress(addr)
+        symbol = address.GetSymbol()
+        if not symbol.IsValid():
+            return None
+        module = address.GetModule().GetFileSpec().GetFilename()
+        return f"{module}`{symbol.GetName()}"
+
+    def python_version(self) -> Optional[tuple[int, int]]:
+        """
+        Major and minor version of the interpreter in the process, read from
+        Py_Version (3.11 and later). None if there is no such symbol.
+        """
+
+        symbols = self.target.FindSymbols("Py_Version")
+        for i in range(symbols.GetSize()):
+            address = symbols.GetContextAtIndex(i).GetSymbol().GetStartAddress()
+            load_address = address.GetLoadAddress(self.target)
+            if load_address == lldb.LLDB_INVALID_ADDRESS:
+                continue
+            error = lldb.SBError()
+            version = self.process.ReadUnsignedFromMemory(load_address, 4, error)
+            if error.Success():
+                return version >> 24, (version >> 16) & 0xFF
+        return None
+
+    def run_python(self, source: str) -> None:
+        """
+        Makes the main thread of the stopped process run `source` in
+        __main__ the next time it executes bytecode, after the process is
+        continued. A thread blocked in a system call runs it once it
+        returns to Python code.
+        """
+
+        pid = self.process.GetProcessID()
+        if (
+            hasattr(sys, "remote_exec")
+            and self.python_version() == sys.version_info[:2]
+        ):
+            # PEP 768: the interpreter looks for the script at a safe point
+            fd, path = tempfile.mkstemp(prefix="pxc-attach-", suffix=".py")
+            with os.fdopen(fd, "w") as f:
+                f.write(source)
+            self.temporary_files.append(path)
+            try:
+                sys.remote_exec(pid, path)
+                return
+            except (OSError, RuntimeError) as e:
+                logger.debug(f"sys.remote_exec failed, injecting a call: {e}")
+
+        data = source.encode() + b"\0"
+        error = lldb.SBError()
+        # never freed, the pending call reads it whenever it runs
+        addr = self.process.AllocateMemory(
+            len(data), lldb.ePermissionsReadable | lldb.ePermissionsWritable, error
+        )
+        if error.Success():
+            self.process.WriteMemory(addr, data, error)
+        if error.Fail():
+            raise LLDBException(
+                f"Could not write to process {pid}: {error.GetCString()}"
+            )
+
+        options = lldb.SBExpressionOptions()
+        options.SetIgnoreBreakpoints(True)
+        options.SetUnwindOnError(True)
+        options.SetTimeoutInMicroSeconds(EXPRESSION_TIMEOUT_US)
+        result = self.target.EvaluateExpression(
+            PENDING_CALL_EXPRESSION.format(addr=hex(addr)), options
+        )
+        if result.GetError().Fail():
+            raise LLDBException(
+                f"Could not call into process {pid}: {result.GetError().GetCString()}"
+            )
+        if result.GetValueAsSigned() != 0:
+            raise LLDBException(f"Process {pid} has too many pending calls")
+
+    def backtrace(self) -> str:
+        """
+        Backtrace of the selected thread with the Python frames run by each
+        interpreter loop listed under its native frame.
+        """
+
+        thread = self.process.GetSelectedThread()
+        lines = [f"* thread #{thread.GetIndexID()}, name = '{thread.GetName()}'"]
+        try:
+            invocations = self.python_frames.python_stack(thread)
+        except UnsupportedVersion as e:
+            lines.append(f"  No Python frames: {e}")
+            invocations = []
+        except FormatterError as e:
+            logger.debug(f"Cannot read Python frames: {e}")
+            invocations = []
+
+        for frame in thread:
+            lines.append(self.describe_frame(frame))
+            if frame.GetFunctionName() == EVAL_FUNCTION and invocations:
+                for filename, line, function in invocations.pop(0):
+                    lines.append(
+                        f'        File "{filename}", line {line}, in {function}'
+                    )
+        return "\n".join(lines)
+
+    def format_pyobject(self, expression: str) -> str:
+        """
+        Formats the PyObject* held by a variable of the selected frame, or at
+        a literal address, by reading memory only.
+        """
+
+        frame = self.process.GetSelectedThread().GetSelectedFrame()
+        value = frame.GetValueForVariablePath(expression)
+        if value.IsValid():
+            addr = value.GetValueAsUnsigned()
+        else:
+            try:
+                addr = int(expression, 0)
+            except ValueError:
+                return f"No variable {expression}"
+        return self.formatter.format(addr)
+
     def start_events_handler(self, io_manager: IOManager):
         self.events_handler = LLDBEventHandler(self, io_manager)
         self.events_handler.start()
 
     def stop_events_handler(self):
-        self.events_handler.stop_event_handler = True
+        self.events_handler.stop()
         self.events_handler.join()
 
     def stop(self):
         self.stop_events_handler()
-        self.process.Destroy()
+        if self.attached:
+            # lldb removes its breakpoints and the process runs on
+            self.process.Detach()
+        else:
+            self.process.Destroy()
+        for path in self.temporary_files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        lldb.SBDebugger.Destroy(self.debugger)
 
     def execute(self, command: str) -> tuple[str, bool]:
         """
@@ -0,0 +1,259 @@
+import bisect
+import logging
+from typing import Iterator, Optional
+import lldb
+from PyObjectFormatter import FormatterError, PyObjectFormatter, UnsupportedVersion
+
+logger = logging.getLogger("pxc-dbg")
+
+# native function running the Python frames of one interpreter invocation
+EVAL_FUNCTION = "_PyEval_EvalFrameDefault"
+# owner of the entry frame 3.12 pushes on every EVAL_FUNCTION call
+FRAME_OWNED_BY_CSTACK = 3
+
+# offsets on 64 bit builds, used when libpython has no debug info
+STACK_OFFSETS = {
+    (3, 11): {
+        ("_PyRuntimeState", "interpreters.head"): 40,
+        ("PyInterpreterState", "next"): 0,
+        ("PyInterpreterState", "threads.head"): 16,
+        ("PyThreadState", "next"): 8,
+        ("PyThreadState", "cframe"): 56,
+        ("PyThreadState", "native_thread_id"): 160,
+        ("_PyCFrame", "current_frame"): 8,
+        ("_PyInterpreterFrame", "f_code"): 32,
+        ("_PyInterpreterFrame", "previous"): 48,
+        ("_PyInterpreterFrame", "prev_instr"): 56,
+        ("_PyInterpreterFrame", "is_entry"): 68,
+        ("PyCodeObject", "co_firstlineno"): 72,
+        ("PyCodeObject", "co_filename"): 112,
+        ("PyCodeObject", "co_qualname"): 128,
+        ("PyCodeObject", "co_linetable"): 136,
+    },
+    (3, 12): {
+        ("_PyRuntimeState", "interpreters.head"): 40,
+        ("PyInterpreterState", "next"): 0,
+        ("PyInterpreterState", "threads.head"): 72,
+        ("PyThreadState", "next"): 8,
+        ("PyThreadState", "cframe"): 56,
+        ("PyThreadState", "native_thread_id"): 144,
+        ("_PyCFrame", "current_frame"): 0,
+        ("_PyInterpreterFrame", "f_code"): 0,
+        ("_PyInterpreterFrame", "previous"): 8,
+        ("_PyInterpreterFrame", "prev_instr"): 56,
+        ("_PyInterpreterFrame", "owner"): 70,
+        ("PyCodeObject", "co_firstlineno"): 68,
+        ("PyCodeObject", "co_filename"): 112,
+        ("PyCodeObject", "co_qualname"): 128,
+        ("PyCodeObject", "co_linetable"): 136,
+    },
+}
+CODE_UNIT = 2
+
+
+def parse_linetable(table: bytes, firstlineno: int) -> tuple[list[int], list[int]]:
+    """
+    Decodes a 3.11+ location table into two parallel lists: the code unit
+    index each entry ends at and its line (-1 when it has none).
+    """
+
+    ends: list[int] = []
+    lines: list[int] = []
+    data = iter(table)
+
+    def varint() -> int:
+        byte = next(data)
+        value, shift = byte & 63, 0
+        while byte & 64:
+            byte = next(data)
+            shift += 6
+            value |= (byte & 63) << shift
+        return value
+
+    def signed_varint() -> int:
+        value = varint()
+        return -(value >> 1) if value & 1 else value >> 1
+
+    line, end = firstlineno, 0
+    for first in data:
+        code = (first >> 3) & 15
+        end += (first & 7) + 1
+        if code == 15:  # no location
+            ends.append(end)
+            lines.append(-1)
+            continue
+
+        if code == 14:  # long form
+            line += signed_varint()
+            varint(), varint(), varint()
+        elif code == 13:  # no column
+            line += signed_varint()
+        elif code >= 10:  # one line form
+            line += code - 10
+            next(data), next(data)
+        else:  # short form
+            next(data)
+        ends.append(end)
+        lines.append(line)
+    return ends, lines
+
+
+class CodeInfo:
+    __slots__ = ("fields", "qualname", "filename", "ends", "lines")
+
+    def __init__(
+        self,
+        fields: tuple[int, ...],
+        qualname: str,
+        filename: str,
+        ends: list[int],
+        lines: list[int],
+    ):
+        # what the rest was decoded from, see PyBacktrace.code_info
+        self.fields = fields
+        self.qualname = qualname
+        self.filename = filename
+        self.ends = ends
+        self.lines = lines
+
+    def line(self, index: int) -> int:
+        i = bisect.bisect_right(self.ends, index)
+        return self.lines[i] if i < len(self.lines) else -1
+
+
+class PyBacktrace:
+    """
+    Recovers the Python frames of a stopped thread from the interpreter
+    frame chain of its thread state, without running code in the debuggee.
+    Decoded code objects are cached by address: code of frames on a stack
+    outlives the stop, so a repeated backtrace reads only the frame chain
+    and the few fields that tell whether the code at an address is still
+    the one that was decoded.
+    """
+
+    def __init__(self, target: lldb.SBTarget, formatter: PyObjectFormatter):
+        self.target = target
+        self.formatter = formatter
+        self.layout = formatter.layout
+        # version of the process, known once its libpython is loaded
+        self.version: Optional[tuple[int, int]] = None
+
+        self.runtime: Optional[int] = None
+        # offset of the bytecode inside a code object, tp_basicsize of code
+        self.code_start: Optional[int] = None
+        self.codes: dict[int, CodeInfo] = {}
+
+    def _runtime_address(self) -> int:
+        if self.runtime is None:
+            symbols = self.target.FindSymbols("_PyRuntime")
+            for i in range(symbols.GetSize()):
+                address = symbols.GetContextAtIndex(i).GetSymbol().GetStartAddress()
+                load_address = address.GetLoadAddress(self.target)
+                if load_address != lldb.LLDB_INVALID_ADDRESS:
+                    self.runtime = load_address
+                    break
+            else:
+                raise FormatterError("No _PyRuntime symbol")
+        return self.runtime
+
+    def thread_state(self, native_thread_id: int) -> Optional[int]:
+        f = self.formatter
+        interp = f.pointer(
+            f.field(self._runtime_address(), "_PyRuntimeState", "interpreters.head")
+        )
+        while interp:
+            tstate = f.pointer(f.field(interp, "PyInterpreterState", "threads.head"))
+            while tstate:
+                thread_id = f.pointer(
+                    f.field(tstate, "PyThreadState", "native_thread_id")
+                )
+                if thread_id == native_thread_id:
+                    return tstate
+                tstate = f.pointer(f.field(tstate, "PyThreadState", "next"))
+            interp = f.pointer(f.field(interp, "PyInterpreterState", "next"))
+        return None
+
+    def code_info(self, code: int) -> CodeInfo:
+        f = self.formatter
+        firstlineno = int.from_bytes(
+            f.read(f.field(code, "PyCodeObject", "co_firstlineno"), 4),
+            "little",
+            signed=True,
+        )
+        linetable = f.pointer(f.field(code, "PyCodeObject", "co_linetable"))
+        qualname = f.pointer(f.field(code, "PyCodeObject", "co_qualname"))
+        filename = f.pointer(f.field(code, "PyCodeObject", "co_filename"))
+
+        # code objects are freed while the program runs and their address
+        # reused by others, which then differ in at least one of these
+        fields = (firstlineno, linetable, qualname, filename)
+        info = self.codes.get(code)
+        if info is not None and info.fields == fields:
+            return info
+
+        table = f.read(
+            f.field(linetable, "PyBytesObject", "ob_sval"),
+            f.ssize(f.field(linetable, "PyVarObject", "ob_size")),
+        )
+        ends, lines = parse_linetable(table, firstlineno)
+        info = CodeInfo(fields, f.string(qualname), f.string(filename), ends, lines)
+        self.codes[code] = info
+        return info
+
+    def _describe(self, frame: int) -> tuple[str, int, str]:
+        f = self.formatter
+        code = f.pointer(f.field(frame, "_PyInterpreterFrame", "f_code"))
+        if self.code_start is None:
+            code_type = f.pointer(f.field(code, "PyObject", "ob_type"))
+            self.code_start = f.ssize(
+                f.field(code_type, "PyTypeObject", "tp_basicsize")
+            )
+
+        info = self.code_info(code)
+        prev_instr = f.pointer(f.field(frame, "_PyInterpreterFrame", "prev_instr"))
+        index = (prev_instr - code - self.code_start) // CODE_UNIT
+        return info.filename, info.line(index), info.qualname
+
+    def _frames(self, tstate: int) -> Iterator[tuple[bool, int]]:
+        # yields (starts a new invocation, frame) from the innermost frame
+        f = self.formatter
+        cframe = f.pointer(f.field(tstate, "PyThreadState", "cframe"))
+        frame = f.pointer(f.field(cframe, "_PyCFrame", "current_frame"))
+        while frame:
+            if self.version >= (3, 12):
+                owner = f.read(f.field(frame, "_PyInterpreterFrame", "owner"), 1)[0]
+                yield owner == FRAME_OWNED_BY_CSTACK, frame
+            else:
+                yield False, frame
+                is_entry = f.read(f.field(frame, "_PyInterpreterFrame", "is_entry"), 1)
+                if is_entry[0]:
+                    yield True, 0
+            frame = f.pointer(f.field(frame, "_PyInterpreterFrame", "previous"))
+
+    def python_stack(self, thread: lldb.SBThread) -> list[list[tuple[str, int, str]]]:
+        """
+        Returns the Python frames of the thread as (file, line, function),
+        innermost first, split into one list per EVAL_FUNCTION call.
+        """
+
+        if self.version is None:
+            # refused by the formatter if the version has no known layouts
+            version = self.formatter.version
+            if version not in STACK_OFFSETS:
+                raise UnsupportedVersion("No frame layout for Python %d.%d" % version)
+            self.layout.defaults.update(STACK_OFFSETS[version])
+            self.version = version
+
+        tstate = self.thread_state(thread.GetThreadID())
+        if tstate is None:
+            return []
+
+        invocations: list[list[tuple[str, int, str]]] = [[]]
+        for entry, frame in self._frames(tstate):
+            if entry:
+                invocations.append([])
+            else:
+                invocations[-1].append(self._describe(frame))
+        if not invocations[-1]:
+            invocations.pop()
+        return invocations
@@ -0,0 +1,357 @@
+import struct
+import logging
+from typing import Callable, Optional
+import lldb
+
+logger = logging.getLogger("pxc-dbg")
+
+# default limits of what is read for one object
+MAX_DEPTH = 2
+MAX_ELEMENTS = 10
+MAX_STRING = 200
+
+# tp_flags bits telling the builtin base of a type
+Py_TPFLAGS_LONG_SUBCLASS = 1 << 24
+Py_TPFLAGS_LIST_SUBCLASS = 1 << 25
+Py_TPFLAGS_TUPLE_SUBCLASS = 1 << 26
+Py_TPFLAGS_BYTES_SUBCLASS = 1 << 27
+Py_TPFLAGS_UNICODE_SUBCLASS = 1 << 28
+Py_TPFLAGS_DICT_SUBCLASS = 1 << 29
+
+PTR = 8
+
+# offsets on 64 bit builds, used when libpython has no debug info
+DEFAULT_OFFSETS = {
+    ("PyObject", "ob_type"): 8,
+    ("PyVarObject", "ob_size"): 16,
+    ("PyTypeObject", "tp_name"): 24,
+    ("PyTypeObject", "tp_basicsize"): 32,
+    ("PyTypeObject", "tp_flags"): 168,
+    ("PyListObject", "ob_item"): 24,
+    ("PyTupleObject", "ob_item"): 24,
+    ("PyFloatObject", "ob_fval"): 16,
+    ("PyLongObject", "ob_digit"): 24,
+    ("PyBytesObject", "ob_sval"): 32,
+    ("PyASCIIObject", "length"): 16,
+    ("PyASCIIObject", "state"): 32,
+    ("PyDictObject", "ma_used"): 16,
+    ("PyDictObject", "ma_keys"): 32,
+    ("PyDictObject", "ma_values"): 40,
+    ("PyDictKeysObject", "dk_log2_index_bytes"): 9,
+    ("PyDictKeysObject", "dk_kind"): 10,
+    ("PyDictKeysObject", "dk_nentries"): 24,
+    ("PyDictKeysObject", "dk_indices"): 32,
+}
+# by version of the interpreter in the process, which may not be that of
+# the controller once attached
+DEFAULT_SIZES = {
+    (3, 11): {"PyASCIIObject": 48, "PyCompactUnicodeObject": 72},
+    # 3.12 dropped the wstr members
+    (3, 12): {"PyASCIIObject": 40, "PyCompactUnicodeObject": 56},
+}
+# debug info names some structs differently than the typedefs
+TYPE_NAMES = {
+    "PyDictKeysObject": "_dictkeysobject",
+    "PyTypeObject": "_typeobject",
+    "PyInterpreterState": "_is",
+    "PyThreadState": "_ts",
+    "_PyRuntimeState": "pyruntimestate",
+}
+
+
+class FormatterError(Exception):
+    pass
+
+
+class UnsupportedVersion(FormatterError):
+    pass
+
+
+class Layout:
+    """
+    Offsets and sizes of CPython structs, from the debug info of the target
+    when it has any and from `defaults` otherwise. Looked up once.
+    Fields of nested structs are named with dots, e.g. "threads.head".
+    """
+
+    def __init__(self, target: lldb.SBTarget, defaults: dict = DEFAULT_OFFSETS):
+        self.target = target
+        self.defaults = dict(defaults)
+        # of the version of the process, see PyObjectFormatter.version
+        self.sizes: dict[str, int] = {}
+        self.types: dict[str, Optional[lldb.SBType]] = {}
+        self.offsets: dict[tuple[str, str], int] = {}
+
+    def _type(self, name: str) -> Optional[lldb.SBType]:
+        if name not in self.types:
+            sbtype = self.target.FindFirstType(name)
+            if not sbtype.IsValid():
+                sbtype = self.target.FindFirstType(TYPE_NAMES.get(name, name))
+            self.types[name] = sbtype if sbtype.IsValid() else None
+        return self.types[name]
+
+    def offset(self, struct_name: str, field: str) -> int:
+        key = (struct_name, field)
+        if key not in self.offsets:
+            self.offsets[key] = self._lookup_offset(struct_name, field)
+        return self.offsets[key]
+
+    def _lookup_offset(self, struct_name: str, field: str) -> int:
+        sbtype = self._type(struct_name)
+        offset = 0
+        for name in field.split("."):
+            if sbtype is None:
+                return self.defaults[(struct_name, field)]
+            for i in range(sbtype.GetNumberOfFields()):
+                member = sbtype.GetFieldAtIndex(i)
+                if member.GetName() == name:
+                    offset += member.GetOffsetInBytes()
+                    sbtype = member.GetType()
+                    break
+            else:
+                sbtype = None
+        return offset
+
+    def size(self, struct_name: str) -> int:
+        sbtype = self._type(struct_name)
+        if sbtype is not None:
+            return sbtype.GetByteSize()
+        return self.sizes[struct_name]
+
+
+class PyObjectFormatter:
+    """
+    Formats PyObject* values by reading the memory of the stopped process,
+    nothing is evaluated or executed in the debuggee.
+    Only a handful of builtin types are decoded, anything else is shown as
+    <type object at address>.
+
+    Layouts are those of the Python version of the process, given by
+    `python_version` once it is first needed. Objects of a version without
+    known layouts are not read at all.
+    """
+
+    def __init__(
+        self,
+        process: lldb.SBProcess,
+        target: lldb.SBTarget,
+        python_version: Callable[[], Optional[tuple[int, int]]],
+    ):
+        self.process = process
+        self.layout = Layout(target)
+        self.python_version = python_version
+        self._version: Optional[tuple[int, int]] = None
+        # type object address -> (tp_name, tp_flags), types never move
+        self.types: dict[int, tuple[str, int]] = {}
+
+    @property
+    def version(self) -> tuple[int, int]:
+        if self._version is None:
+            # looked up again later if libpython is not loaded yet
+            version = self.python_version()
+            if version is None:
+                raise UnsupportedVersion(
+                    "Cannot tell the Python version of the process, "
+                    "it has no Py_Version symbol"
+                )
+            if version not in DEFAULT_SIZES:
+                known = ", ".join("%d.%d" % v for v in DEFAULT_SIZES)
+                raise UnsupportedVersion(
+                    "Cannot read objects of Python %d.%d, only of %s"
+                    % (*version, known)
+                )
+            self.layout.sizes.update(DEFAULT_SIZES[version])
+            self._version = version
+        return self._version
+
+    # memory access
+
+    def read(self, addr: int, size: int) -> bytes:
+        error = lldb.SBError()
+        data = self.process.ReadMemory(addr, size, error)
+        if not error.Success():
+            raise FormatterError(f"Cannot read memory at {hex(addr)}")
+        return data
+
+    def pointer(self, addr: int) -> int:
+        return struct.unpack("<Q", self.read(addr, PTR))[0]
+
+    def ssize(self, addr: int) -> int:
+        return struct.unpack("<q", self.read(addr, PTR))[0]
+
+    def field(self, addr: int, struct_name: str, field: str) -> int:
+        return addr + self.layout.offset(struct_name, field)
+
+    # type lookup
+
+    def type_of(self, addr: int) -> tuple[str, int]:
+        type_addr = self.pointer(self.field(addr, "PyObject", "ob_type"))
+        if type_addr not in self.types:
+            name_addr = self.pointer(self.field(type_addr, "PyTypeObject", "tp_name"))
+            error = lldb.SBError()
+            name = self.process.ReadCStringFromMemory(name_addr, 256, error)
+            if not error.Success():
+                raise FormatterError(f"Invalid type object at {hex(type_addr)}")
+            flags = self.process.ReadUnsignedFromMemory(
+                self.field(type_addr, "PyTypeObject", "tp_flags"), PTR, error
+            )
+            self.types[type_addr] = (name, flags)
+        return self.types[type_addr]
+
+    # formatting
+
+    def format(
+        self,
+        addr: int,
+        depth: int = MAX_DEPTH,
+        max_elements: int = MAX_ELEMENTS,
+        max_string: int = MAX_STRING,
+    ) -> str:
+        if addr == 0:
+            return "NULL"
+
+        try:
+            self.version
+        except UnsupportedVersion as e:
+            return f"<{e}>"
+
+        try:
+            name, flags = self.type_of(addr)
+            if name == "NoneType":
+                return "None"
+            if name == "bool":
+                return "True" if self._int(addr) else "False"
+            if name == "float":
+                fval = self.read(self.field(addr, "PyFloatObject", "ob_fval"), 8)
+                return repr(struct.unpack("<d", fval)[0])
+            if flags & Py_TPFLAGS_LONG_SUBCLASS:
+                return str(self._int(addr))
+            if flags & Py_TPFLAGS_UNICODE_SUBCLASS:
+                return repr(self.string(addr, max_string))
+            if flags & Py_TPFLAGS_BYTES_SUBCLASS:
+                return self._bytes(addr, max_string)
+            if flags & (Py_TPFLAGS_LIST_SUBCLASS | Py_TPFLAGS_TUPLE_SUBCLASS):
+                return self._sequence(addr, flags, depth, max_elements, max_string)
+            if flags & Py_TPFLAGS_DICT_SUBCLASS:
+                return self._dict(addr, depth, max_elements, max_string)
+            return f"<{name} object at {hex(addr)}>"
+        except FormatterError as e:
+            logger.debug(str(e))
+            return f"<unreadable object at {hex(addr)}>"
+
+    def _int(self, addr: int) -> int:
+        if self.version < (3, 12):
+            size = self.ssize(self.field(addr, "PyVarObject", "ob_size"))
+            ndigits, sign = abs(size), (-1 if size < 0 else 1)
+        else:
+            # lv_tag: number of digits << 3 | sign (0 positive, 1 zero, 2 negative)
+            tag = self.pointer(self.field(addr, "PyVarObject", "ob_size"))
+            ndigits, sign = tag >> 3, 1 - (tag & 3)
+
+        digits = b""
+        if ndigits:
+            digits = self.read(
+                self.field(addr, "PyLongObject", "ob_digit"), 4 * ndigits
+            )
+        value = 0
+        for (digit,) in reversed(list(struct.iter_unpack("<I", digits))):
+            value = (value << 30) | digit
+        return sign * value
+
+    def string(self, addr: int, max_string: int = MAX_STRING) -> str:
+        length = self.ssize(self.field(addr, "PyASCIIObject", "length"))
+        state = struct.unpack(
+            "<I", self.read(self.field(addr, "PyASCIIObject", "state"), 4)
+        )[0]
+        kind, compact, ascii = (state >> 2) & 7, (state >> 5) & 1, (state >> 6) & 1
+        if not compact:
+            return f"<str of length {length}>"
+
+        if ascii:
+            data = addr + self.layout.size("PyASCIIObject")
+        else:
+            data = addr + self.layout.size("PyCompactUnicodeObject")
+        shown = min(length, max_string)
+        raw = self.read(data, kind * shown) if shown else b""
+        text = raw.decode({1: "latin-1", 2: "utf-16-le", 4: "utf-32-le"}[kind])
+        return text if shown == length else text + "..."
+
+    def _bytes(self, addr: int, max_string: int) -> str:
+        length = self.ssize(self.field(addr, "PyVarObject", "ob_size"))
+        shown = min(length, max_string)
+        raw = self.read(self.field(addr, "PyBytesObject", "ob_sval"), shown)
+        return repr(raw) if shown == length else repr(raw)[:-1] + "...'"
+
+    def _sequence(
+        self, addr: int, flags: int, depth: int, max_elements: int, max_string: int
+    ) -> str:
+        is_list = bool(flags & Py_TPFLAGS_LIST_SUBCLASS)
+        length = self.ssize(self.field(addr, "PyVarObject", "ob_size"))
+        brackets = "[]" if is_list else "()"
+        if depth <= 0:
+            return f"{brackets[0]}...{length} items{brackets[1]}"
+
+        if is_list:
+            items = self.pointer(self.field(addr, "PyListObject", "ob_item"))
+        else:
+            items = self.field(addr, "PyTupleObject", "ob_item")
+
+        shown = min(length, max_elements)
+        pointers = struct.unpack(f"<{shown}Q", self.read(items, PTR * shown))
+        elements = [
+            self.format(p, depth - 1, max_elements, max_string) for p in pointers
+        ]
+        if shown < length:
+            elements.append(f"...{length - shown} more")
+        text = ", ".join(elements)
+        if not is_list and length == 1:
+            text += ","
+        return brackets[0] + text + brackets[1]
+
+    def _dict(self, addr: int, depth: int, max_elements: int, max_string: int) -> str:
+        used = self.ssize(self.field(addr, "PyDictObject", "ma_used"))
+        if depth <= 0:
+            return f"{{...{used} items}}"
+
+        keys = self.pointer(self.field(addr, "PyDictObject", "ma_keys"))
+        values = self.pointer(self.field(addr, "PyDictObject", "ma_values"))
+        header = self.read(keys, self.layout.offset("PyDictKeysObject", "dk_indices"))
+        log2_index_bytes = header[
+            self.layout.offset("PyDictKeysObject", "dk_log2_index_bytes")
+        ]
+        kind = header[self.layout.offset("PyDictKeysObject", "dk_kind")]
+        nentries = struct.unpack_from(
+            "<q", header, self.layout.offset("PyDictKeysObject", "dk_nentries")
+        )[0]
+
+        # entries follow the hash index, general tables store the hash too
+        entries = (
+            keys
+            + self.layout.offset("PyDictKeysObject", "dk_indices")
+            + (1 << log2_index_bytes)
+        )
+        entry_size = 3 * PTR if kind == 0 else 2 * PTR
+        key_offset = PTR if kind == 0 else 0
+
+        items = []
+        for i in range(nentries):
+            if len(items) == max_elements:
+                break
+            entry = entries + i * entry_size
+            key = self.pointer(entry + key_offset)
+            value = (
+                self.pointer(values + i * PTR)
+                if values
+                else self.pointer(entry + key_offset + PTR)
+            )
+            if not key or not value:
+                continue  # deleted entry
+            items.append(
+                self.format(key, depth - 1, max_elements, max_string)
+                + ": "
+                + self.format(value, depth - 1, max_elements, max_string)
+            )
+
+        if used > len(items):
+            items.append(f"...{used - len(items)} more")
+        return "{" + ", ".join(items) + "}"
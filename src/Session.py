@@ -0,0 +1,438 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable, Optional
+
+from LLDBHost import LLDBHost, LLDBException
+from pxc import PXC
+from IOManager import IOManager
+import profiler
+import protocol
+import transport
+
+logger = logging.getLogger("pyc-dbg")
+
+PXCDB = Path(__file__).parent / "pxcdb.py"
+STEPPING_IN_ACK_TIMEOUT = 5
+ATTACH_TIMEOUT = 10
+# run by the main thread of an attached process, which neither inherits our
+# environment nor has src on its path; frame 1 is the injected exec
+ATTACH_BOOTSTRAP = """\
+import sys
+sys.path.insert(0, {src!r})
+try:
+    import pxcdb
+finally:
+    sys.path.remove({src!r})
+pxcdb.attach({address!r}, sys._getframe(1).f_back)
+"""
+
+
+class SessionOutput:
+    """
+    What a session writes, through the IOManager shared by all sessions.
+    Lines are labelled with the session id while several sessions are open.
+    """
+
+    def __init__(
+        self, io_manager: IOManager, session_id: int, labelled: Callable[[], bool]
+    ):
+        self.io_manager = io_manager
+        self.prefix = f"[{session_id}] "
+        self.labelled = labelled
+        # whether the program's output so far ended with a complete line
+        self.line_start = True
+
+    def write(self, data: str, prompt: bool = True) -> None:
+        if self.labelled():
+            data = self.prefix + data.replace("\n", "\n" + self.prefix)
+        self.io_manager.write(data, prompt)
+
+    def write_output(self, data: str) -> None:
+        if self.labelled():
+            start = self.prefix if self.line_start else ""
+            self.line_start = data.endswith("\n")
+            body = data[:-1] if self.line_start else data
+            data = start + body.replace("\n", "\n" + self.prefix)
+            if self.line_start:
+                data += "\n"
+        self.io_manager.write_output(data)
+
+
+class Session:
+    """
+    One debuggee: a process launched with pxcdb or attached to, its lldb
+    debugger and the channel to its pdb. Every session listens on an
+    endpoint of its own, passed to a launched debuggee in PXC_ENDPOINT.
+    """
+
+    def __init__(
+        self,
+        session_id: int,
+        io: SessionOutput,
+        loop: asyncio.AbstractEventLoop,
+        on_close: Callable[["Session"], None],
+        args: list[str] = [],
+        pid: Optional[int] = None,
+        c_profiler: Optional[profiler.CProfiler] = None,
+        profile_format: str = "table",
+        profile_output: Optional[str] = None,
+    ):
+        # startup is timed until pdb first stops, see pdb_replied
+        self.started = time.perf_counter()
+        self.id = session_id
+        self.io = io
+        self.loop = loop
+        self.on_close = on_close
+        # pdb options, script and its arguments, or the pid to attach to
+        self.args = args
+        self.pid = pid
+        # set by --profile, the debuggee runs once and its C calls are timed
+        self.c_profiler = c_profiler
+        self.profile_format = profile_format
+        self.profile_output = profile_output
+
+        self.pipe: Optional[protocol.Channel] = None
+        self.closed = False
+        self.stepping_in = False
+        # run once the debuggee has acknowledged that a step-in is pending
+        self.stepping_in_ack: Optional[Callable[[], None]] = None
+        self.stepping_in_ack_timer: Optional[asyncio.TimerHandle] = None
+        # one shot breakpoints set while stepping in, removed on the next command
+        self.stepping_in_breakpoints: set[int] = set()
+        # called with every batch of (opcode, fn_name, fn_addr) C function events
+        self.c_event_handlers: list[Callable[[list[tuple[int, str, int]]], None]] = []
+
+        # the endpoint has to exist before the debuggee is launched
+        logger.debug(f"Starting {transport.TRANSPORT} transport for session {self.id}")
+        self.endpoint = transport.controller_listen()
+        self.address = transport.endpoint_address(self.endpoint)
+        try:
+            if pid is None:
+                env = dict(os.environ)
+                env[transport.ENDPOINT_ENV] = self.address
+                if c_profiler is not None:
+                    env["PXC_PROFILE"] = "1"
+                self.lldb_host = LLDBHost(
+                    sys.executable, io, [str(PXCDB), *args], loop, env=env
+                )
+            else:
+                self.lldb_host = LLDBHost(None, io, loop=loop, pid=pid)
+        except LLDBException:
+            if isinstance(self.endpoint, transport.SharedMemoryTransport):
+                self.endpoint.close()
+            transport.controller_close(self.endpoint)
+            raise
+        logger.info(
+            f"Session {self.id}: lldb ready after "
+            f"{time.perf_counter() - self.started:.3f}s"
+        )
+        self.pxc = PXC(self.lldb_host, io)
+        self.pxc.pdb_reply_handlers.append(self.pdb_replied)
+
+        if isinstance(self.endpoint, transport.SharedMemoryTransport):
+            loop.call_soon(self.connect_debuggee, self.endpoint)
+        else:
+            loop.add_reader(self.endpoint, self.accept_debuggee)
+        if pid is not None:
+            self.inject_debugger()
+
+    def describe(self) -> str:
+        process = self.lldb_host.process
+        if self.closed or not process.IsValid():
+            state = "gone"
+        elif self.lldb_host.is_stopped():
+            state = "stopped in lldb"
+        elif self.pipe is None:
+            state = "starting"
+        else:
+            state = "running"
+        what = f"attached to {self.pid}" if self.pid else " ".join(self.args)
+        return f"{self.id}: pid {process.GetProcessID()}, {state}, {what}"
+
+    def inject_debugger(self) -> None:
+        bootstrap = ATTACH_BOOTSTRAP.format(src=str(PXCDB.parent), address=self.address)
+        try:
+            # exec'd in a dict of its own, __main__ of the process stays as it is
+            self.lldb_host.run_python(f"exec({bootstrap!r}, {{}})")
+        except LLDBException as e:
+            self.io.write(f"{e}, detaching")
+            self.loop.call_soon(self.execute, "detach")
+            return
+        self.lldb_host.process.Continue()
+        self.io.write(
+            f"Attached to process {self.pid}, "
+            "pdb starts once its main thread runs Python code"
+        )
+        self.loop.call_later(ATTACH_TIMEOUT, self.check_attached)
+
+    def check_attached(self) -> None:
+        if self.pxc.channel is None and not self.closed:
+            self.io.write(
+                f"The debugger did not start in process {self.pid} yet. Its main "
+                "thread may be blocked, or pxc_extension is not importable there "
+                "(see its stderr)"
+            )
+
+    def pdb_replied(self, request_id: int, command: Optional[str], output: str) -> None:
+        # request 0 is the first stop, from here on commands are answered
+        if request_id == 0:
+            logger.info(
+                f"Session {self.id}: first prompt after "
+                f"{time.perf_counter() - self.started:.3f}s"
+            )
+
+    def execute(self, command: str) -> bool:
+        """
+        Executes a single debugger command.
+        Returns False once the session is closed.
+        """
+
+        if self.closed:
+            return False
+
+        pxc, lldb_host, io = self.pxc, self.lldb_host, self.io
+        self.set_stepping_in(False)
+        lldb_host.breakpoints.delete(self.stepping_in_breakpoints)
+        self.stepping_in_breakpoints.clear()
+
+        if command.startswith("pdb "):
+            actual_command = command[4:]
+            logger.debug(f"Sending command to pdb: {actual_command}")
+            pxc.send_pdb([actual_command])
+
+        elif command.startswith("lldb "):
+            actual_command = command[5:]
+            output, _ = lldb_host.execute(actual_command)
+            if output:
+                io.write(output)
+
+        # handle printing locals
+        elif command == "v" or command == "vars":
+            pxc.print_variables()
+        elif command.startswith("v "):
+            pxc.print_variables(command[2:].split())
+        elif command.startswith("vars "):
+            pxc.print_variables(command[5:].split())
+
+        # handle backtrace
+        elif command == "bt" or command == "backtrace":
+            pxc.print_backtrace()
+
+        # handle breakpoints
+        elif command.startswith("b "):
+            pxc.set_breakpoint(command[2:].strip())
+        elif command.startswith("break "):
+            pxc.set_breakpoint(command[6:].strip())
+        elif command.startswith("breakpoint "):
+            pxc.set_breakpoint(command[11:].strip())
+        # handle breakpoint actions
+        elif command.startswith("br "):
+            pxc.process_breakpoints(command[3:].strip())
+        elif command.startswith("breakpoints "):
+            pxc.process_breakpoints(command[12:].strip())
+
+        # handle step over
+        elif command == "n" or command == "next":
+            pxc.step_over()
+
+        # handle step in
+        elif command == "s" or command == "step":
+            if not lldb_host.is_stopped():
+                # pdb may only step once the debuggee reports C calls
+                self.set_stepping_in(True, pxc.step_in)
+            else:
+                pxc.step_in()
+
+        # handle continue
+        elif command == "c" or command == "continue":
+            pxc.continue_execution()
+
+        # handle print
+        elif command.startswith("p "):
+            pxc.print_variable(command[2:].strip())
+        elif command.startswith("print "):
+            pxc.print_variable(command[6:].strip())
+
+        # handle pretty print
+        elif command.startswith("pp "):
+            pxc.pprint_variable(command[3:].strip())
+        elif command.startswith("pprint "):
+            pxc.pprint_variable(command[7:].strip())
+
+        elif command == "detach" and not lldb_host.attached:
+            io.write("Not attached to a process, use exit")
+
+        elif command == "exit" or command == "quit" or command == "detach":
+            if lldb_host.attached:
+                # removes breakpoints and hooks, the process runs on
+                pxc.detach()
+            else:
+                pxc.send_pdb(["exit"])
+            self.close()
+            return False
+
+        elif command == "":
+            io.write("")
+
+        else:
+            io.write("Unknown Command")
+
+        pxc.process_python_command_queue()
+        return True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.stepping_in_ack_timer:
+            self.stepping_in_ack_timer.cancel()
+        self.lldb_host.stop()
+        self.disconnect_debuggee()
+        self.close_endpoint()
+        self.on_close(self)
+
+    def close_endpoint(self) -> None:
+        # shared memory is closed with the channel
+        if not isinstance(self.endpoint, transport.SharedMemoryTransport):
+            self.loop.remove_reader(self.endpoint)
+            transport.controller_close(self.endpoint)
+
+    def set_stepping_in(
+        self, value: bool, on_ack: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Tells the debuggee whether a step-in is pending.
+        The debuggee only reports C calls to the controller while it is.
+        on_ack runs once the debuggee has seen the change.
+        """
+
+        if self.stepping_in == value or self.pipe is None:
+            self.stepping_in = value
+            if on_ack:
+                on_ack()
+            return
+
+        self.stepping_in = value
+        self.pipe.send_flag(protocol.OP_STEP_IN, value)
+
+        # arming has to reach the debuggee before pdb steps, disarming does not
+        # (the debuggee might be stopped in lldb and unable to reply)
+        if on_ack:
+            self.stepping_in_ack = on_ack
+            self.stepping_in_ack_timer = self.loop.call_later(
+                STEPPING_IN_ACK_TIMEOUT, self.step_in_acknowledged, True
+            )
+
+    def step_in_acknowledged(self, timed_out: bool = False) -> None:
+        if timed_out:
+            logger.debug("Debuggee did not acknowledge step-in in time")
+        elif self.stepping_in_ack_timer:
+            self.stepping_in_ack_timer.cancel()
+
+        callback = self.stepping_in_ack
+        self.stepping_in_ack, self.stepping_in_ack_timer = None, None
+        if callback:
+            callback()
+
+    def process_c_events(self, events: list[tuple[int, str, int]]) -> None:
+        logger.debug(f"Received a batch of {len(events)} C function events")
+        for handler in self.c_event_handlers:
+            handler(events)
+
+    def accept_debuggee(self) -> None:
+        conn = transport.controller_accept(self.endpoint)
+        self.loop.remove_reader(self.endpoint)
+        self.connect_debuggee(conn)
+
+    def connect_debuggee(self, conn: transport.Transport) -> None:
+        if self.closed:
+            conn.close()
+            return
+        logger.debug(f"Session {self.id} connected to debuggee")
+        self.pipe = protocol.Channel(conn)
+        self.pxc.channel = self.pipe
+        self.pxc.process_python_command_queue()
+        self.loop.add_reader(self.pipe.fileno(), self.receive_messages)
+        # shared memory only wakes us up once we have seen it empty
+        self.receive_messages()
+
+    def disconnect_debuggee(self) -> None:
+        if self.pipe is not None:
+            self.loop.remove_reader(self.pipe.fileno())
+            self.pipe.close()
+        self.pipe = None
+        self.pxc.channel = None
+        logger.debug(f"Session {self.id} disconnected from debuggee")
+
+    def receive_messages(self) -> None:
+        pipe = self.pipe
+        try:
+            self._receive_messages(pipe)
+            closed = pipe.closed
+        except protocol.ProtocolError as e:
+            # nothing after a bad message can be trusted to be framed right
+            logger.error(f"Session {self.id} received a malformed message: {e}")
+            closed = True
+
+        if closed:
+            self.disconnect_debuggee()
+            if self.c_profiler is not None:
+                self.execute("exit")
+
+    def _receive_messages(self, pipe: protocol.Channel) -> None:
+        for opcode, payload in pipe.poll():
+            logger.debug(f"Received: {opcode = }")
+            if opcode == protocol.OP_STEP_IN_ACK:
+                self.step_in_acknowledged()
+            elif opcode == protocol.OP_STEP_TARGET:
+                fn_name, fn_addr = pipe.decode_event(payload)
+                self.arm_step_target(fn_name, fn_addr)
+                self.step_in_acknowledged()
+            elif opcode == protocol.OP_BATCH:
+                self.process_c_events(pipe.decode_batch(payload))
+            elif opcode == protocol.OP_PROFILE_BATCH:
+                self.c_profiler.process(pipe.decode_profile_batch(payload))
+            elif opcode == protocol.OP_PROFILE_END:
+                self.write_profile()
+                pipe.send_flag(protocol.OP_REPLY, True)
+            elif opcode == protocol.OP_INSPECT_REPLY:
+                self.pxc.inspection_replied(pipe.decode_json(payload))
+            elif opcode == protocol.OP_PDB_REPLY:
+                self.pxc.show_pdb_reply(*pipe.decode_request(payload))
+            elif opcode == protocol.OP_C_CALL:
+                fn_name, fn_addr = pipe.decode_event(payload)
+                self.process_c_call(fn_name, fn_addr)
+                pipe.send_flag(protocol.OP_REPLY, True)
+
+    def arm_step_target(self, fn_name: str, fn_addr: int) -> None:
+        if fn_addr:
+            logger.debug(f"Stepping in to {fn_name} at {hex(fn_addr)}")
+            try:
+                self.stepping_in_breakpoints.add(
+                    self.lldb_host.breakpoints.at_address(fn_addr, one_shot=True)
+                )
+            except LLDBException as e:
+                logger.debug(str(e))
+
+    def process_c_call(self, fn_name: str, fn_addr: int) -> None:
+        if not self.stepping_in:
+            return
+
+        if fn_addr:
+            self.arm_step_target(fn_name, fn_addr)
+        else:
+            logger.debug(f"Should be stepping in but pointer for {fn_name} is NULL")
+
+    def write_profile(self) -> None:
+        report = self.c_profiler.report(self.profile_format, self.lldb_host.symbol_name)
+        if self.profile_output is None:
+            self.io.write(report)
+            return
+
+        with open(self.profile_output, "w") as f:
+            f.write(report + "\n")
+        self.io.write(f"Profile written to {self.profile_output}")
@@ -0,0 +1,57 @@
+import json
+from typing import Optional
+
+# Debug Adapter Protocol messages are JSON, each preceded by a header
+HEADER_END = b"\r\n\r\n"
+CONTENT_LENGTH = b"content-length"
+
+
+class DAPError(Exception):
+    pass
+
+
+def encode(message: dict) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode()
+    return b"Content-Length: %d\r\n\r\n" % len(body) + body
+
+
+class MessageReader:
+    """
+    Splits what the client sends into messages. Data may arrive in any
+    chunks, a message is returned once all of it has arrived.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # length of the body being waited for, None while reading a header
+        self.length: Optional[int] = None
+
+    def feed(self, data: bytes) -> list[dict]:
+        self.buffer += data
+        messages = []
+        while True:
+            if self.length is None:
+                end = self.buffer.find(HEADER_END)
+                if end < 0:
+                    break
+                self.length = self.parse_header(bytes(self.buffer[:end]))
+                del self.buffer[: end + len(HEADER_END)]
+
+            if len(self.buffer) < self.length:
+                break
+            body = bytes(self.buffer[: self.length])
+            del self.buffer[: self.length]
+            self.length = None
+            try:
+                messages.append(json.loads(body))
+            except ValueError as e:
+                raise DAPError(f"Invalid message: {e}") from None
+        return messages
+
+    @staticmethod
+    def parse_header(header: bytes) -> int:
+        for line in header.split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == CONTENT_LENGTH and value.strip().isdigit():
+                return int(value)
+        raise DAPError(f"No Content-Length in {header!r}")
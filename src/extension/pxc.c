@@ -1,11 +1,31 @@
 #include "pxc.h"
 #include "longobject.h"
 #include <Python.h>
+#include <frameobject.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <time.h>
 
 
 static PyMethodDef pxcExtensionMethods[] = {
     {"resolve_location", resolve_location, METH_VARARGS,
      "Resolve address of C function"},
+    {"start_profile", start_profile, METH_VARARGS,
+     "Install the native profile hook calling back on C function events"},
+    {"stop_profile", stop_profile, METH_NOARGS,
+     "Remove the native profile hook from all threads"},
+    {"set_stepping_in", set_stepping_in, METH_VARARGS,
+     "Enable or disable reporting of C function events"},
+    {"set_profiling", set_profiling, METH_VARARGS,
+     "Call back with timestamped C function events, None to stop"},
+    {"start_recording", start_recording, METH_VARARGS,
+     "Record Python and C function events of this thread to a trace log"},
+    {"stop_recording", stop_recording, METH_NOARGS,
+     "Stop recording, returns the number of records written"},
+    {"clear_location_cache", clear_location_cache, METH_NOARGS,
+     "Drop all cached C function addresses"},
+    {"resolve_slot", resolve_slot, METH_VARARGS,
+     "Resolve address of a type slot function, e.g. nb_add"},
     {NULL, NULL, 0, NULL},
 };
 
@@ -21,26 +41,713 @@ PyMODINIT_FUNC PyInit_pxc_extension(void) {
     return PyModule_Create(&pxcExtensionModule);
 }
 
+// C function events are only reported while a step-in is pending
+static int stepping_in = 0;
+// set by stop_profile, the hook removes itself from threads it still runs on
+static int profile_removed = 0;
+// called on every C function event with a timestamp while profiling
+static PyObject *profiling_callback = NULL;
+// time spent in profile_hook, left out of the timestamps of its events
+static unsigned long long hook_time = 0;
+
+static int is_method_descriptor(PyObject *func) {
+    return Py_IS_TYPE(func, &PyMethodDescr_Type) ||
+           Py_IS_TYPE(func, &PyClassMethodDescr_Type);
+}
+
+static void *resolve_function_pointer(PyObject *func) {
+    if (PyCFunction_Check(func))
+        return PyCFunction_GET_FUNCTION(func);
+
+    // unbound methods of C types, e.g. list.append or dict.fromkeys; their
+    // vectorcall is a trampoline shared by all methods of the same calling
+    // convention, the function itself is in the method definition
+    if (is_method_descriptor(func))
+        return ((PyMethodDescrObject *)func)->d_method->ml_meth;
+
+    // Python code is stepped into by pdb
+    if (PyFunction_Check(func) || PyMethod_Check(func))
+        return NULL;
+
+    // any other callable with a vectorcall, e.g. a C type whose vectorcall
+    // creates its instances; for some, like functools.partial, that is only
+    // a trampoline to what they wrap
+    PyTypeObject *type = Py_TYPE(func);
+    if (!PyType_HasFeature(type, Py_TPFLAGS_HAVE_VECTORCALL) ||
+        type->tp_vectorcall_offset <= 0)
+        return NULL;
+
+    void *func_addr = NULL;
+    memcpy(&func_addr, (char *)func + type->tp_vectorcall_offset,
+           sizeof(func_addr));
+    return func_addr;
+}
+
+// Direct mapped cache of callable -> resolved address, for the callables
+// resolved through their vectorcall.
+// The callable is only used as a key; an entry is valid while the weak
+// reference still points to it. C functions and method descriptors are not
+// cached: their address is read from their method definition, which costs
+// no more than a lookup, while a bound method is created for every call
+// and would need a new weak reference each time.
+#define LOCATION_CACHE_SIZE 256
+
+typedef struct {
+    PyObject *func;
+    PyObject *ref;
+    void *addr;
+} LocationCacheEntry;
+
+static LocationCacheEntry location_cache[LOCATION_CACHE_SIZE];
+
+static LocationCacheEntry *location_cache_entry(PyObject *func) {
+    return &location_cache[((uintptr_t)func >> 4) % LOCATION_CACHE_SIZE];
+}
+
+static void location_cache_clear_entry(LocationCacheEntry *entry) {
+    Py_CLEAR(entry->ref);
+    entry->func = NULL;
+    entry->addr = NULL;
+}
+
+static void *resolve_function_pointer_cached(PyObject *func) {
+    if (PyCFunction_Check(func) || is_method_descriptor(func))
+        return resolve_function_pointer(func);
+
+    LocationCacheEntry *entry = location_cache_entry(func);
+    if (entry->func == func && PyWeakref_GET_OBJECT(entry->ref) == func)
+        return entry->addr;
+
+    void *addr = resolve_function_pointer(func);
+    if (!PyType_SUPPORTS_WEAKREFS(Py_TYPE(func)))
+        return addr;
+    PyObject *ref = PyWeakref_NewRef(func, NULL);
+    if (ref == NULL) {
+        PyErr_Clear();
+        return addr;
+    }
+
+    location_cache_clear_entry(entry);
+    entry->func = func;
+    entry->ref = ref;
+    entry->addr = addr;
+    return addr;
+}
+
 static PyObject *resolve_location(PyObject *self, PyObject *args) {
     const char *name;
-    const PyObject *func;
+    PyObject *func;
 
     if (!PyArg_ParseTuple(args, "sO", &name, &func))
         return NULL;
 
-    if (PyCFunction_Check(func))
-        return PyLong_FromVoidPtr(PyCFunction_GET_FUNCTION(func));
+    return PyLong_FromVoidPtr(resolve_function_pointer_cached(func));
+}
+
+static PyObject *clear_location_cache(PyObject *self,
+                                      PyObject *Py_UNUSED(ignored)) {
+    for (int i = 0; i < LOCATION_CACHE_SIZE; i++)
+        location_cache_clear_entry(&location_cache[i]);
+    Py_RETURN_NONE;
+}
+
+// Slots an operator or a call may dispatch to
+static const struct {
+    const char *name;
+    int slot;
+} type_slots[] = {
+    {"tp_call", Py_tp_call},
+    {"tp_new", Py_tp_new},
+    {"tp_init", Py_tp_init},
+    {"tp_richcompare", Py_tp_richcompare},
+    {"mp_subscript", Py_mp_subscript},
+    {"mp_ass_subscript", Py_mp_ass_subscript},
+    {"sq_item", Py_sq_item},
+    {"sq_ass_item", Py_sq_ass_item},
+    {"sq_contains", Py_sq_contains},
+    {"nb_add", Py_nb_add},
+    {"nb_subtract", Py_nb_subtract},
+    {"nb_multiply", Py_nb_multiply},
+    {"nb_matrix_multiply", Py_nb_matrix_multiply},
+    {"nb_true_divide", Py_nb_true_divide},
+    {"nb_floor_divide", Py_nb_floor_divide},
+    {"nb_remainder", Py_nb_remainder},
+    {"nb_power", Py_nb_power},
+    {"nb_lshift", Py_nb_lshift},
+    {"nb_rshift", Py_nb_rshift},
+    {"nb_and", Py_nb_and},
+    {"nb_or", Py_nb_or},
+    {"nb_xor", Py_nb_xor},
+    {"nb_inplace_add", Py_nb_inplace_add},
+    {"nb_inplace_subtract", Py_nb_inplace_subtract},
+    {"nb_inplace_multiply", Py_nb_inplace_multiply},
+    {"nb_inplace_matrix_multiply", Py_nb_inplace_matrix_multiply},
+    {"nb_inplace_true_divide", Py_nb_inplace_true_divide},
+    {"nb_inplace_floor_divide", Py_nb_inplace_floor_divide},
+    {"nb_inplace_remainder", Py_nb_inplace_remainder},
+    {"nb_inplace_power", Py_nb_inplace_power},
+    {"nb_inplace_lshift", Py_nb_inplace_lshift},
+    {"nb_inplace_rshift", Py_nb_inplace_rshift},
+    {"nb_inplace_and", Py_nb_inplace_and},
+    {"nb_inplace_or", Py_nb_inplace_or},
+    {"nb_inplace_xor", Py_nb_inplace_xor},
+    {NULL, 0},
+};
+
+static PyObject *resolve_slot(PyObject *self, PyObject *args) {
+    PyTypeObject *type;
+    const char *name;
+
+    if (!PyArg_ParseTuple(args, "O!s", &PyType_Type, &type, &name))
+        return NULL;
+
+    for (int i = 0; type_slots[i].name != NULL; i++) {
+        if (strcmp(type_slots[i].name, name) == 0) {
+            // PyType_GetSlot accepts static types since 3.10
+            void *addr = PyType_GetSlot(type, type_slots[i].slot);
+            if (addr == NULL && PyErr_Occurred())
+                return NULL;
+            return PyLong_FromVoidPtr(addr);
+        }
+    }
+
+    PyErr_Format(PyExc_ValueError, "Unknown slot %s", name);
+    return NULL;
+}
 
-    int flags = PyCFunction_GET_FLAGS(func);
-    if (!(flags & METH_VARARGS)) {
-        Py_ssize_t offset = Py_TYPE(func)->tp_vectorcall_offset;
-        if (offset <= 0)
-            return PyLong_FromLong(0);
+static unsigned long long monotonic_ns(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (unsigned long long)now.tv_sec * 1000000000ULL + now.tv_nsec;
+}
+
+static int call_back(PyObject *callback, const char *format, ...) {
+    va_list va;
+    va_start(va, format);
+    PyObject *args = Py_VaBuildValue(format, va);
+    va_end(va);
+    if (args == NULL)
+        return -1;
+
+    PyObject *result = PyObject_CallObject(callback, args);
+    Py_DECREF(args);
+    if (result == NULL)
+        return -1;
+    Py_DECREF(result);
+    return 0;
+}
+
+static int profile_event(PyObject *callback, PyObject *arg, const char *event,
+                         unsigned long long timestamp) {
+    PyObject *name = PyObject_GetAttrString(arg, "__name__");
+    if (name == NULL) {
+        PyErr_Clear();
+        name = Py_NewRef(Py_None);
+    }
+    PyObject *addr = PyLong_FromVoidPtr(resolve_function_pointer_cached(arg));
+    if (addr == NULL) {
+        Py_DECREF(name);
+        return -1;
+    }
+
+    // c_exception is delivered with the exception set, it has to survive
+    // the call back into Python
+    PyObject *exc_type, *exc_value, *exc_tb;
+    PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+
+    int status = 0;
+    if (profiling_callback != NULL)
+        status = call_back(profiling_callback, "sOOK", event, name, addr,
+                           timestamp);
+    if (status == 0 && stepping_in)
+        status = call_back(callback, "sOO", event, name, addr);
+    Py_DECREF(name);
+    Py_DECREF(addr);
+
+    if (status < 0) {
+        Py_XDECREF(exc_type);
+        Py_XDECREF(exc_value);
+        Py_XDECREF(exc_tb);
+        return -1;
+    }
+
+    PyErr_Restore(exc_type, exc_value, exc_tb);
+    return 0;
+}
+
+static int profile_hook(PyObject *callback, PyFrameObject *frame, int what,
+                        PyObject *arg) {
+    if (profile_removed) {
+        PyEval_SetProfile(NULL, NULL);
+        return 0;
+    }
+    if (!stepping_in && profiling_callback == NULL)
+        return 0;
+
+    const char *event;
+    switch (what) {
+    case PyTrace_C_CALL:
+        event = "c_call";
+        break;
+    case PyTrace_C_RETURN:
+        event = "c_return";
+        break;
+    case PyTrace_C_EXCEPTION:
+        event = "c_exception";
+        break;
+    default:
+        return 0;
+    }
+
+    // Timestamps are taken on entry, on a clock that stops while the hook
+    // runs: c_return and c_exception are stamped before the hook did any
+    // work, a c_call as if right before the hook returns. Neither the work
+    // of the hook nor the callbacks are attributed to the function.
+    unsigned long long entered = monotonic_ns();
+    int status = profile_event(callback, arg, event, entered - hook_time);
+    hook_time += monotonic_ns() - entered;
+    return status;
+}
+
+static PyObject *start_profile(PyObject *self, PyObject *args) {
+    PyObject *callback;
 
-        void *func_addr = NULL;
-        memcpy(&func_addr, (char *)func + offset, sizeof(func_addr));
-        return PyLong_FromVoidPtr(func_addr);
+    if (!PyArg_ParseTuple(args, "O", &callback))
+        return NULL;
+
+    if (!PyCallable_Check(callback)) {
+        PyErr_SetString(PyExc_TypeError, "callback must be callable");
+        return NULL;
+    }
+
+    profile_removed = 0;
+    PyEval_SetProfile(profile_hook, callback);
+    Py_RETURN_NONE;
+}
+
+static PyObject *stop_profile(PyObject *self, PyObject *Py_UNUSED(ignored)) {
+    // the hook is per thread, a detaching debugger stops it from another one
+    profile_removed = 1;
+    PyEval_SetProfile(NULL, NULL);
+    Py_RETURN_NONE;
+}
+
+static PyObject *set_stepping_in(PyObject *self, PyObject *args) {
+    int value;
+
+    if (!PyArg_ParseTuple(args, "p", &value))
+        return NULL;
+
+    stepping_in = value;
+    Py_RETURN_NONE;
+}
+
+static PyObject *set_profiling(PyObject *self, PyObject *args) {
+    PyObject *callback;
+
+    if (!PyArg_ParseTuple(args, "O", &callback))
+        return NULL;
+
+    if (callback == Py_None) {
+        Py_CLEAR(profiling_callback);
+        Py_RETURN_NONE;
+    }
+    if (!PyCallable_Check(callback)) {
+        PyErr_SetString(PyExc_TypeError, "callback must be callable");
+        return NULL;
     }
 
-    return PyLong_FromLong(0);
+    hook_time = 0;
+    Py_XSETREF(profiling_callback, Py_NewRef(callback));
+    Py_RETURN_NONE;
+}
+
+// Trace recording: line, call, return and exception events of Python code
+// and C function events of the recording thread are appended to a log of
+// fixed size records, names are interned in a side table of strings.
+// tracelog.py reads both, see there for the layout.
+
+#define TRACE_MAGIC "PXCTRACE"
+#define TRACE_VERSION 1
+#define TRACE_BUFFER_RECORDS 65536
+#define TRACE_MAX_DEPTH 65535
+
+enum {
+    TRACE_CALL = 1,
+    TRACE_RETURN,
+    TRACE_LINE,
+    TRACE_EXCEPTION,
+    TRACE_C_CALL,
+    TRACE_C_RETURN,
+    TRACE_C_EXCEPTION,
+};
+
+typedef struct {
+    uint8_t kind;
+    uint8_t flags;
+    uint16_t depth;
+    uint32_t func;
+    uint32_t file;
+    uint32_t line;
+    uint64_t timestamp;
+    // caller line of a call, exception type name of an exception,
+    // function address of a C event
+    uint64_t arg;
+} TraceRecord;
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    uint32_t record_size;
+    uint64_t start;
+    uint64_t reserved;
+} TraceHeader;
+
+_Static_assert(sizeof(TraceRecord) == 32, "trace records are 32 bytes");
+_Static_assert(sizeof(TraceHeader) == sizeof(TraceRecord),
+               "records are aligned to their size");
+
+// Open addressing table of pointer -> id. Objects used as keys are
+// referenced so that their address cannot be reused while recording.
+typedef struct {
+    void *key;
+    uint64_t value;
+} TableEntry;
+
+typedef struct {
+    TableEntry *entries;
+    size_t capacity;
+    size_t count;
+    int owns_keys;
+} PointerTable;
+
+static size_t table_slot(PointerTable *table, void *key) {
+    size_t mask = table->capacity - 1;
+    size_t slot = ((uintptr_t)key >> 4) & mask;
+    while (table->entries[slot].key != NULL && table->entries[slot].key != key)
+        slot = (slot + 1) & mask;
+    return slot;
+}
+
+static int table_get(PointerTable *table, void *key, uint64_t *value) {
+    if (table->capacity == 0)
+        return 0;
+    TableEntry *entry = &table->entries[table_slot(table, key)];
+    if (entry->key == NULL)
+        return 0;
+    *value = entry->value;
+    return 1;
+}
+
+static int table_put(PointerTable *table, void *key, uint64_t value) {
+    if (2 * (table->count + 1) > table->capacity) {
+        size_t capacity = table->capacity ? 2 * table->capacity : 1024;
+        TableEntry *entries = table->entries;
+        size_t old_capacity = table->capacity;
+        table->entries = PyMem_Calloc(capacity, sizeof(TableEntry));
+        if (table->entries == NULL) {
+            table->entries = entries;
+            PyErr_NoMemory();
+            return -1;
+        }
+        table->capacity = capacity;
+        for (size_t i = 0; i < old_capacity; i++)
+            if (entries[i].key != NULL)
+                table->entries[table_slot(table, entries[i].key)] = entries[i];
+        PyMem_Free(entries);
+    }
+
+    TableEntry *entry = &table->entries[table_slot(table, key)];
+    if (entry->key == NULL) {
+        if (table->owns_keys)
+            Py_INCREF((PyObject *)key);
+        entry->key = key;
+        table->count++;
+    }
+    entry->value = value;
+    return 0;
+}
+
+static void table_clear(PointerTable *table) {
+    if (table->owns_keys)
+        for (size_t i = 0; i < table->capacity; i++)
+            Py_XDECREF((PyObject *)table->entries[i].key);
+    PyMem_Free(table->entries);
+    table->entries = NULL;
+    table->capacity = table->count = 0;
+}
+
+static struct {
+    FILE *log;
+    FILE *strings;
+    TraceRecord buffer[TRACE_BUFFER_RECORDS];
+    size_t buffered;
+    uint64_t written;
+    // str -> id, id 0 is the empty string
+    PyObject *string_ids;
+    uint32_t next_string;
+    // code objects -> func | file << 32, exception types -> name
+    PointerTable objects;
+    // C function address -> name
+    PointerTable functions;
+    // Python frames entered since recording started, may go below 0 when
+    // frames entered before return
+    int depth;
+    uint32_t lines[TRACE_MAX_DEPTH + 1];
+} recorder;
+
+static uint16_t trace_depth(void) {
+    if (recorder.depth < 0)
+        return 0;
+    return recorder.depth > TRACE_MAX_DEPTH ? TRACE_MAX_DEPTH : recorder.depth;
+}
+
+static void trace_flush(void) {
+    fwrite(recorder.buffer, sizeof(TraceRecord), recorder.buffered,
+           recorder.log);
+    recorder.written += recorder.buffered;
+    recorder.buffered = 0;
+}
+
+static void trace_append(uint8_t kind, uint32_t func, uint32_t file,
+                         uint32_t line, uint64_t arg) {
+    TraceRecord *record = &recorder.buffer[recorder.buffered];
+    record->kind = kind;
+    record->flags = 0;
+    record->depth = trace_depth();
+    record->func = func;
+    record->file = file;
+    record->line = line;
+    record->timestamp = monotonic_ns();
+    record->arg = arg;
+    if (++recorder.buffered == TRACE_BUFFER_RECORDS)
+        trace_flush();
+}
+
+// Returns the id of a string, 0 (the empty string) if it cannot be
+// interned. Never leaves an exception set.
+static uint32_t intern_string(PyObject *string) {
+    if (string == NULL || !PyUnicode_Check(string))
+        return 0;
+
+    PyObject *id = PyDict_GetItemWithError(recorder.string_ids, string);
+    if (id != NULL)
+        return (uint32_t)PyLong_AsUnsignedLong(id);
+
+    Py_ssize_t size;
+    const char *utf8 = PyUnicode_AsUTF8AndSize(string, &size);
+    if (utf8 == NULL)
+        goto error;
+    id = PyLong_FromUnsignedLong(recorder.next_string);
+    if (id == NULL || PyDict_SetItem(recorder.string_ids, string, id) < 0) {
+        Py_XDECREF(id);
+        goto error;
+    }
+    Py_DECREF(id);
+
+    uint32_t length = (uint32_t)size;
+    fwrite(&length, sizeof(length), 1, recorder.strings);
+    fwrite(utf8, 1, size, recorder.strings);
+    return recorder.next_string++;
+
+error:
+    PyErr_Clear();
+    return 0;
+}
+
+static uint64_t code_names(PyCodeObject *code) {
+    uint64_t names;
+    if (table_get(&recorder.objects, code, &names))
+        return names;
+
+    names = intern_string(code->co_qualname) |
+            (uint64_t)intern_string(code->co_filename) << 32;
+    if (table_put(&recorder.objects, code, names) < 0)
+        PyErr_Clear();
+    return names;
+}
+
+static uint32_t type_name(PyObject *type) {
+    uint64_t name;
+    if (table_get(&recorder.objects, type, &name))
+        return (uint32_t)name;
+
+    PyObject *qualname = PyType_GetQualName((PyTypeObject *)type);
+    name = intern_string(qualname);
+    Py_XDECREF(qualname);
+    if (table_put(&recorder.objects, type, name) < 0)
+        PyErr_Clear();
+    return (uint32_t)name;
+}
+
+static uint32_t function_name(PyObject *func, void *addr) {
+    uint64_t name;
+    if (addr != NULL && table_get(&recorder.functions, addr, &name))
+        return (uint32_t)name;
+
+    PyObject *qualname = PyObject_GetAttrString(func, "__qualname__");
+    if (qualname == NULL) {
+        PyErr_Clear();
+        qualname = PyObject_GetAttrString(func, "__name__");
+    }
+    name = intern_string(qualname);
+    Py_XDECREF(qualname);
+    if (addr != NULL && table_put(&recorder.functions, addr, name) < 0)
+        PyErr_Clear();
+    return (uint32_t)name;
+}
+
+static int record_trace(PyObject *obj, PyFrameObject *frame, int what,
+                        PyObject *arg) {
+    PyCodeObject *code = PyFrame_GetCode(frame);
+    uint64_t names = code_names(code);
+    uint32_t func = (uint32_t)names, file = (uint32_t)(names >> 32);
+
+    switch (what) {
+    case PyTrace_CALL: {
+        uint32_t caller_line = recorder.lines[trace_depth()];
+        recorder.depth++;
+        recorder.lines[trace_depth()] = code->co_firstlineno;
+        trace_append(TRACE_CALL, func, file, code->co_firstlineno, caller_line);
+        break;
+    }
+    case PyTrace_RETURN:
+        trace_append(TRACE_RETURN, func, file, recorder.lines[trace_depth()], 0);
+        recorder.depth--;
+        break;
+    case PyTrace_LINE: {
+        uint32_t line = PyFrame_GetLineNumber(frame);
+        recorder.lines[trace_depth()] = line;
+        trace_append(TRACE_LINE, func, file, line, 0);
+        break;
+    }
+    case PyTrace_EXCEPTION:
+        trace_append(TRACE_EXCEPTION, func, file, PyFrame_GetLineNumber(frame),
+                     type_name(PyTuple_GET_ITEM(arg, 0)));
+        break;
+    }
+
+    Py_DECREF(code);
+    return 0;
+}
+
+static int record_profile(PyObject *obj, PyFrameObject *frame, int what,
+                          PyObject *arg) {
+    uint8_t kind;
+    switch (what) {
+    case PyTrace_C_CALL:
+        kind = TRACE_C_CALL;
+        break;
+    case PyTrace_C_RETURN:
+        kind = TRACE_C_RETURN;
+        break;
+    case PyTrace_C_EXCEPTION:
+        kind = TRACE_C_EXCEPTION;
+        break;
+    default:
+        return 0; // Python events come from record_trace
+    }
+
+    // c_exception is delivered with the exception set
+    PyObject *exc_type, *exc_value, *exc_tb;
+    PyErr_Fetch(&exc_type, &exc_value, &exc_tb);
+
+    void *addr = resolve_function_pointer_cached(arg);
+    trace_append(kind, function_name(arg, addr), 0,
+                 recorder.lines[trace_depth()], (uintptr_t)addr);
+
+    PyErr_Restore(exc_type, exc_value, exc_tb);
+    return 0;
+}
+
+static PyObject *start_recording(PyObject *self, PyObject *args) {
+    PyObject *path, *strings_path = NULL;
+
+    if (!PyArg_ParseTuple(args, "O&", PyUnicode_FSConverter, &path))
+        return NULL;
+
+    if (recorder.log != NULL) {
+        Py_DECREF(path);
+        PyErr_SetString(PyExc_RuntimeError, "Already recording");
+        return NULL;
+    }
+
+    strings_path = PyBytes_FromFormat("%s.strings", PyBytes_AS_STRING(path));
+    if (strings_path == NULL)
+        goto error;
+    recorder.log = fopen(PyBytes_AS_STRING(path), "wb");
+    if (recorder.log == NULL) {
+        PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, path);
+        goto error;
+    }
+    recorder.strings = fopen(PyBytes_AS_STRING(strings_path), "wb");
+    if (recorder.strings == NULL) {
+        PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, strings_path);
+        goto error;
+    }
+    recorder.string_ids = PyDict_New();
+    if (recorder.string_ids == NULL)
+        goto error;
+
+    TraceHeader header = {
+        .magic = TRACE_MAGIC,
+        .version = TRACE_VERSION,
+        .record_size = sizeof(TraceRecord),
+        .start = monotonic_ns(),
+    };
+    fwrite(&header, sizeof(header), 1, recorder.log);
+    recorder.next_string = 0;
+    PyObject *empty = PyUnicode_FromString("");
+    if (empty == NULL)
+        goto error;
+    intern_string(empty);
+    Py_DECREF(empty);
+
+    recorder.objects.owns_keys = 1;
+    recorder.buffered = recorder.written = 0;
+    recorder.depth = 0;
+    recorder.lines[0] = 0;
+    Py_DECREF(path);
+    Py_DECREF(strings_path);
+
+    // both hooks of this thread belong to the recorder until it stops
+    PyEval_SetTrace(record_trace, NULL);
+    PyEval_SetProfile(record_profile, NULL);
+    Py_RETURN_NONE;
+
+error:
+    if (recorder.log != NULL)
+        fclose(recorder.log);
+    if (recorder.strings != NULL)
+        fclose(recorder.strings);
+    recorder.log = recorder.strings = NULL;
+    Py_CLEAR(recorder.string_ids);
+    Py_DECREF(path);
+    Py_XDECREF(strings_path);
+    return NULL;
+}
+
+static PyObject *stop_recording(PyObject *self, PyObject *Py_UNUSED(ignored)) {
+    if (recorder.log == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "Not recording");
+        return NULL;
+    }
+
+    PyEval_SetTrace(NULL, NULL);
+    PyEval_SetProfile(NULL, NULL);
+    trace_flush();
+
+    int failed = ferror(recorder.log) || ferror(recorder.strings);
+    failed |= fclose(recorder.log) != 0;
+    failed |= fclose(recorder.strings) != 0;
+    recorder.log = recorder.strings = NULL;
+    Py_CLEAR(recorder.string_ids);
+    table_clear(&recorder.objects);
+    table_clear(&recorder.functions);
+
+    if (failed) {
+        PyErr_SetString(PyExc_OSError, "Could not write the trace log");
+        return NULL;
+    }
+    return PyLong_FromUnsignedLongLong(recorder.written);
 }
@@ -5,5 +5,14 @@
 
 
 static PyObject *resolve_location(PyObject *self, PyObject *args);
+static PyObject *start_profile(PyObject *self, PyObject *args);
+static PyObject *stop_profile(PyObject *self, PyObject *Py_UNUSED(ignored));
+static PyObject *set_stepping_in(PyObject *self, PyObject *args);
+static PyObject *set_profiling(PyObject *self, PyObject *args);
+static PyObject *start_recording(PyObject *self, PyObject *args);
+static PyObject *stop_recording(PyObject *self, PyObject *Py_UNUSED(ignored));
+static PyObject *clear_location_cache(PyObject *self,
+                                      PyObject *Py_UNUSED(ignored));
+static PyObject *resolve_slot(PyObject *self, PyObject *args);
 
 #endif
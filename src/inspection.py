@@ -0,0 +1,191 @@
+import reprlib
+from typing import Any, Optional
+
+# default number of characters of a value's repr that are sent
+REPR_BUDGET = 80
+# default number of children sent when a value is expanded
+PAGE_SIZE = 100
+
+# len() of these never runs user code, as long as the type is exactly one of
+# them: a subclass may define its own __len__
+SIZED_TYPES = (str, bytes, bytearray, list, tuple, dict, set, frozenset, range)
+SEQUENCE_TYPES = (list, tuple, range, str, bytes, bytearray)
+SET_TYPES = (set, frozenset)
+
+
+class InspectionError(Exception):
+    pass
+
+
+def _repr(value: Any, budget: int) -> str:
+    r = reprlib.Repr()
+    r.maxstring = r.maxother = r.maxlong = budget
+    r.maxlevel = 2
+    try:
+        text = r.repr(value)
+    except Exception as e:
+        return f"<repr failed: {type(e).__name__}>"
+    return text if len(text) <= budget else text[: budget - 3] + "..."
+
+
+def _error(e: Exception, budget: int) -> str:
+    return f"{type(e).__name__}: {_repr(e, budget)}"
+
+
+def _attributes(value: Any) -> dict:
+    # unlike getattr, skips a __getattribute__ of the class, a __dict__
+    # property still runs
+    try:
+        attributes = object.__getattribute__(value, "__dict__")
+    except AttributeError:
+        return {}
+    return attributes if type(attributes) is dict else {}
+
+
+def has_children(value: Any) -> bool:
+    if type(value) in (str, bytes, bytearray, range):
+        return False
+    if type(value) in SIZED_TYPES:
+        return len(value) > 0
+    return bool(_attributes(value))
+
+
+def summarize(name: str, value: Any, budget: int = REPR_BUDGET) -> dict:
+    """
+    Describes a value without walking it: its type, its length when that
+    is cheap to know and a repr cut to `budget` characters. Code of the
+    value that fails is reported in "error" instead.
+    """
+
+    summary = {"name": name, "type": type(value).__qualname__}
+    try:
+        summary["repr"] = _repr(value, budget)
+        summary["children"] = has_children(value)
+        if type(value) in SIZED_TYPES:
+            summary["length"] = len(value)
+    except Exception as e:
+        summary["error"] = _error(e, budget)
+    return summary
+
+
+def _items(value: Any, budget: int = REPR_BUDGET) -> list[tuple[str, Any]]:
+    if type(value) is dict:
+        return [(_repr(k, budget), v) for k, v in value.items()]
+    if type(value) in SEQUENCE_TYPES + SET_TYPES:
+        return [(str(i), v) for i, v in enumerate(value)]
+    return list(_attributes(value).items())
+
+
+def children(
+    value: Any, start: int = 0, count: int = PAGE_SIZE, budget: int = REPR_BUDGET
+) -> list[dict]:
+    if type(value) is dict:
+        items = value.items()
+        page = []
+        for i, (k, v) in enumerate(items):
+            if i >= start + count:
+                break
+            if i >= start:
+                page.append(summarize(_repr(k, budget), v, budget))
+        return page
+    if type(value) in SEQUENCE_TYPES:
+        return [
+            summarize(str(i), value[i], budget)
+            for i in range(start, min(len(value), start + count))
+        ]
+    return [
+        summarize(k, v, budget) for k, v in _items(value, budget)[start : start + count]
+    ]
+
+
+def child(value: Any, key: str, budget: int = REPR_BUDGET) -> Any:
+    """
+    Looks up one child the way `children` names it: an index for
+    sequences, the repr (or str) of a key for dicts, an attribute otherwise.
+    Keys are cut to the `budget` the listing was made with.
+    """
+
+    if type(value) is dict:
+        for k, v in value.items():
+            if key == _repr(k, budget) or key == str(k):
+                return v
+        raise InspectionError(f"No key {key}")
+    if type(value) in SEQUENCE_TYPES:
+        try:
+            return value[int(key)]
+        except (ValueError, IndexError):
+            raise InspectionError(f"No index {key}") from None
+    if type(value) in SET_TYPES:
+        for k, v in _items(value):
+            if k == key:
+                return v
+        raise InspectionError(f"No index {key}")
+
+    attributes = _attributes(value)
+    if key not in attributes:
+        raise InspectionError(f"No attribute {key}")
+    return attributes[key]
+
+
+def resolve(local_vars: dict, path: list[str], budget: int = REPR_BUDGET) -> Any:
+    if path[0] not in local_vars:
+        raise InspectionError(f"No variable {path[0]}")
+    value = local_vars[path[0]]
+    for key in path[1:]:
+        value = child(value, key, budget)
+    return value
+
+
+class Inspector:
+    """
+    Answers inspection requests for the frame pdb is stopped in.
+    Answers are cached until `invalidate` is called, i.e. until the next
+    step, as locals can only change while the program runs.
+    """
+
+    def __init__(self):
+        self.cache: dict[tuple, dict] = {}
+
+    def invalidate(self) -> None:
+        self.cache.clear()
+
+    def inspect(self, frame_id: int, local_vars: Optional[dict], request: dict) -> dict:
+        path = request.get("path", [])
+        start = request.get("start", 0)
+        count = request.get("count", PAGE_SIZE)
+        budget = request.get("budget", REPR_BUDGET)
+
+        key = (frame_id, tuple(path), start, count, budget)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        if local_vars is None:
+            return {"error": "Not stopped in Python"}
+
+        try:
+            if path:
+                value = resolve(local_vars, path, budget)
+                reply = {
+                    "path": path,
+                    "value": summarize(path[-1], value, budget),
+                    "children": children(value, start, count, budget),
+                }
+            else:
+                names = [k for k in local_vars if not k.startswith("_")]
+                reply = {
+                    "path": path,
+                    "length": len(names),
+                    "children": [
+                        summarize(k, local_vars[k], budget)
+                        for k in names[start : start + count]
+                    ],
+                }
+        except InspectionError as e:
+            return {"error": str(e)}
+        except Exception as e:
+            # raised by code of the inspected value, e.g. its __iter__
+            return {"error": _error(e, budget)}
+
+        self.cache[key] = reply
+        return reply
@@ -1,24 +1,27 @@
 import sys
 import logging
 import os
-import time
-from typing import NoReturn
-import threading
-import pickle
-import socket
-
-from LLDBHost import LLDBHost
-from pxc import PXC
-from IOManager import IOManager
-
+import asyncio
+from typing import NoReturn, Optional
 
-HOST = "127.0.0.1"
-PORT = 30_000
-pipe = ...
-sock = ...
-stepping_in = False  # ???: Do you need a lock?
-ControlFlowLock = threading.Lock()
-stepping_in_breakpoints = []
+from LLDBHost import LLDBException
+from IOManager import IOManager
+from Session import PXCDB, Session, SessionOutput
+from DebugAdapter import DebugAdapter
+import profiler
+
+
+# set by --profile, the session started from the command line runs once and
+# its C calls are timed
+c_profiler: Optional[profiler.CProfiler] = None
+profile_format = "table"
+profile_output: Optional[str] = None
+# set by --record, the debuggee runs once and its events go to this trace log
+record_path: Optional[str] = None
+# set by --attach, the process to debug is already running
+attach_pid: Optional[int] = None
+# set by --dap, a Debug Adapter Protocol client talks over stdin and stdout
+dap_mode = False
 
 # Setup logging
 logger = logging.getLogger("pyc-dbg")
@@ -36,187 +39,233 @@ else:
     logging.basicConfig(level=log_level)
 
 
+USAGE = """\
+usage: main.py [--profile[=table|collapsed]] [--profile-output=<file>] \
+[--record=<log>] [pdb options] <script> [<args> ...]
+       main.py --attach=<pid>
+       main.py --dap"""
+
 HELP_TEXT = """\
     (h)elp: print this help text
     (b)reak or breakpoint <symbol name>: sets breakpoint in both C/C++ and Python
+    br list|cond|ignore|enable|disable|delete [<id> ...]: manages breakpoints
     (n)ext: steps over current line of code
     (s)tep: steps into the function
     (c)ontinue: continue execution until next breakpoint is reached
-    (v)ars: print all local variables
+    (v)ars [<variable> [<key> ...]]: print all local variables or expand one
     (bt)backtrace: print backtrace
     (p)rint <variable>: prints the value of the variable
     (pp)rint <variable>: pretty prints the value of the variable
     pdb <command ...>: sends command to pdb session
     lldb <command ...>: sends command to lldb session
-    exit or quit: exits debugger
+    exit or quit: ends the session, an attached process is detached
+    detach: detaches from an attached process, which keeps running
+    session new [pdb options] <script> [<args> ...]: debugs another script
+    session attach <pid>: debugs another running process
+    session list: lists the sessions, * marks the current one
+    session <id>: makes session <id> the current one
+    @<id> <command>: runs a command in session <id> instead of the current one
+The debugger exits once no session is left.
 """
 
-pxc = ...
+io_manager = ...
+loop = ...
+# session id -> session, commands go to the current one
+sessions: dict[int, Session] = {}
+current: Optional[Session] = None
+next_session_id = 1
 
 
-def pxc_start(args: list[str]) -> NoReturn:
-    global pxc, stepping_in
-    io_manager = IOManager("(px-dbg) > ")
+def pxc_start(args: list[str], pid: Optional[int] = None) -> None:
+    global io_manager
+    io_manager = IOManager("(px-dbg) > ", loop)
     io_manager.start()
-    lldb_host = LLDBHost(sys.executable, io_manager, args)
-    pxc = PXC(lldb_host, io_manager)
-
-    while True:
-        command = io_manager.read()
-        while command is None:
-            time.sleep(0)
-            command = io_manager.read()
-
-        stepping_in = False
-        for _ in range(len(stepping_in_breakpoints)):
-            i = stepping_in_breakpoints.pop()
-            lldb_host.execute(f"br del {i}")
-
-        if command.startswith("pdb "):
-            actual_command = command[4:]
-            logger.debug(f"Sending command to pdb: {actual_command}")
-            lldb_host.set_stdin(actual_command + "\n")
-
-        elif command.startswith("lldb "):
-            actual_command = command[5:]
-            output, _ = lldb_host.execute(actual_command)
-            if output:
-                io_manager.write(output)
-
-        # handle help
-        elif command == "h" or command == "help":
-            io_manager.write(HELP_TEXT)
-
-        # handle printing locals
-        elif command == "v" or command == "vars":
-            pxc.print_variables()
-
-        # handle backtrace
-        elif command == "bt" or command == "backtrace":
-            pxc.print_backtrace()
-
-        # handle breakpoints
-        elif command.startswith("b "):
-            pxc.set_breakpoint(command[2:].strip())
-        elif command.startswith("break "):
-            pxc.set_breakpoint(command[6:].strip())
-        elif command.startswith("breakpoint "):
-            pxc.set_breakpoint(command[11:].strip())
-        # handle breakpoint actions
-        elif command.startswith("br "):
-            pxc.process_breakpoints(command[3:].strip())
-        elif command.startswith("breakpoints "):
-            pxc.process_breakpoints(command[12:].strip())
-
-        # handle step over
-        elif command == "n" or command == "next":
-            pxc.step_over()
-
-        # handle step in
-        elif command == "s" or command == "step":
-            stepping_in = True
-            pxc.step_in()
-
-        # handle continue
-        elif command == "c" or command == "continue":
-            pxc.continue_execution()
-
-        # handle print
-        elif command.startswith("p "):
-            pxc.print_variable(command[2:].strip())
-        elif command.startswith("print "):
-            pxc.print_variable(command[6:].strip())
-
-        # handle pretty print
-        elif command.startswith("pp "):
-            pxc.pprint_variable(command[3:].strip())
-        elif command.startswith("pprint "):
-            pxc.pprint_variable(command[7:].strip())
-
-        elif command == "exit" or command == "quit":
-            lldb_host.set_stdin("exit" + "\n")
-            lldb_host.stop()
-            io_manager.stop()
+    try:
+        start_session(
+            args,
+            pid,
+            c_profiler=c_profiler,
+            profile_format=profile_format,
+            profile_output=profile_output,
+        )
+    except LLDBException as e:
+        io_manager.stop()
+        print(e, file=sys.stderr)
+        exit(1)
+
+    # everything happens on the loop: user input, messages from the
+    # debuggees and lldb events (handed over by the lldb event threads)
+    loop.add_reader(sys.stdin.fileno(), read_commands)
+    loop.run_forever()
+
+
+def dap_start() -> None:
+    loop = asyncio.new_event_loop()
+    # the protocol owns stdout, whatever else gets printed goes to stderr
+    output_fd = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    DebugAdapter(loop, sys.stdin.fileno(), output_fd).run()
+    loop.close()
+    logger.debug("Exiting Safely")
+
+
+def start_session(
+    args: list[str], pid: Optional[int] = None, **profile_options
+) -> Session:
+    global next_session_id
+    session_id = next_session_id
+    next_session_id += 1
+    io = SessionOutput(io_manager, session_id, lambda: len(sessions) > 1)
+    session = Session(session_id, io, loop, close_session, args, pid, **profile_options)
+    sessions[session_id] = session
+    select_session(session)
+    return session
+
+
+def close_session(session: Session) -> None:
+    sessions.pop(session.id, None)
+    if sessions:
+        select_session(current if current is not session else sessions[min(sessions)])
+        return
+
+    # nothing left to debug
+    loop.remove_reader(sys.stdin.fileno())
+    io_manager.stop()
+    loop.stop()
+
+
+def select_session(session: Session) -> None:
+    global current
+    current = session
+    # the prompt names the session once there is a choice
+    io_manager.set_prompt(
+        f"(px-dbg {session.id}) > " if len(sessions) > 1 else "(px-dbg) > "
+    )
+
+
+def read_commands() -> None:
+    content = io_manager.read()
+    if content is None:  # stdin closed
+        for session in list(sessions.values()):
+            session.execute("exit")
+        return
+
+    for command in content.splitlines() or [""]:
+        execute_command(command.strip())
+        if not sessions:
             break
 
-        elif command == "":
-            io_manager.write("")
 
+def execute_command(command: str) -> None:
+    """
+    Executes a single debugger command, in the current session unless it
+    is addressed to another one with @<id>.
+    """
+
+    if command == "h" or command == "help":
+        io_manager.write(HELP_TEXT)
+    elif command == "session" or command.startswith("session "):
+        manage_sessions(command[8:].strip())
+    elif command.startswith("@"):
+        session_id, _, command = command[1:].partition(" ")
+        session = sessions.get(int(session_id)) if session_id.isdigit() else None
+        if session is None:
+            io_manager.write(f"No session {session_id}")
+        else:
+            session.execute(command.strip())
+    else:
+        current.execute(command)
+
+
+def manage_sessions(action: str) -> None:
+    subcommand, _, args = action.partition(" ")
+    if subcommand == "list" or subcommand == "":
+        io_manager.write(
+            "\n".join(
+                ("* " if session is current else "  ") + session.describe()
+                for session in sessions.values()
+            )
+        )
+    elif subcommand == "new" and args.split():
+        launch(args.split())
+    elif subcommand == "attach" and args.strip().isdigit():
+        launch([], int(args))
+    elif subcommand.isdigit() and int(subcommand) in sessions:
+        select_session(sessions[int(subcommand)])
+        io_manager.write(sessions[int(subcommand)].describe())
+    else:
+        io_manager.write(
+            f"No session {subcommand}"
+            if subcommand.isdigit()
+            else "Usage: session list|new|attach|<id>"
+        )
+
+
+def launch(args: list[str], pid: Optional[int] = None) -> None:
+    try:
+        session = start_session(args, pid)
+    except LLDBException as e:
+        io_manager.write(str(e))
+        return
+    io_manager.write(f"Session {session.id} started")
+
+
+def parse_options(argv: list[str]) -> list[str]:
+    """
+    Takes the options of the controller off the front of argv.
+    Returns the rest, which is passed on to pdb.
+    """
+
+    global c_profiler, profile_format, profile_output, record_path, attach_pid
+    global dap_mode
+    argv = list(argv)
+    while argv and argv[0].startswith(("--profile", "--record", "--attach", "--dap")):
+        option, _, value = argv.pop(0).partition("=")
+        if option == "--profile" and value in ("", *profiler.FORMATS):
+            c_profiler = profiler.CProfiler()
+            profile_format = value or profile_format
+        elif option == "--profile-output" and value:
+            profile_output = value
+        elif option == "--record" and value:
+            record_path = value
+        elif option == "--attach" and value.isdigit():
+            attach_pid = int(value)
+        elif option == "--dap" and not value:
+            dap_mode = True
         else:
-            io_manager.write("Unknown Command")
-
-        pxc.process_python_command_queue()
-
-
-def start_controller_server():
-    global pipe, sock, stepping_in
-    ControlFlowLock.acquire()
-    with socket.socket() as s:
-        sock = s
-
-        logger.debug("Starting socket")
-        s.bind((HOST, PORT))
-        s.listen(1)
-
-        ControlFlowLock.release()
-
-        conn, addr = s.accept()
-        logger.debug(f"Connected to {addr}")
-        with conn:
-            pipe = conn
-
-            while True:
-                data = conn.recv(1024 * 1024)
-                if not data:
-                    break
-
-                data = pickle.loads(data)
-                logger.debug(f"Received: {data}")
-                if data is None:
-                    break
-
-                event, fn_name, fn_addr = data
-                if event == "c_call":
-                    # FIXME: move to separate function
-                    if stepping_in:
-                        if fn_addr:
-                            logger.debug(f"Setting a break point at {hex(fn_addr)}")
-                            result, _ = pxc.lldb_host.execute(f"b *{hex(fn_addr)}")
-                            # parsing lldb output to get breakpoint number
-                            # this breakpoint need to be removed later because
-                            # we are stepping-in
-                            if result.startswith("Breakpoint "):
-                                stepping_in_breakpoints.append(
-                                    int(result[11 : result.find(":")])
-                                )
-                        else:
-                            logger.debug(
-                                f"Should be stepping in but pointer for {fn_name} is NULL"
-                            )
-                    conn.send(pickle.dumps(True))
-
-        pipe = None
-    sock = None
-    logger.debug("Ending Socket Server")
+            print(USAGE, file=sys.stderr)
+            exit(2)
+    return argv
 
 
 def main() -> NoReturn:
-    if len(sys.argv) <= 1:  # ???: Might need to update to work as a module
+    global loop
+    args = parse_options(sys.argv[1:])
+    if dap_mode:
+        if args or attach_pid is not None or c_profiler or record_path:
+            print("--dap takes no script or other options", file=sys.stderr)
+            print(USAGE, file=sys.stderr)
+            exit(1)
+        dap_start()
+        return
+
+    if attach_pid is not None and (args or c_profiler or record_path):
+        print("--attach takes no script or other options", file=sys.stderr)
+        print(USAGE, file=sys.stderr)
+        exit(1)
+    if not args and attach_pid is None:  # ???: Might need to update to work as a module
         print("Expected at least one argument", file=sys.stderr)
+        print(USAGE, file=sys.stderr)
         exit(1)
 
-    controller_server = threading.Thread(target=start_controller_server)
-    logger.debug(f"Starting connection to debugger")
-    controller_server.start()
-
-    from pathlib import Path
-
-    dir_loc = Path(__file__).parent
-    pxc_module_path = dir_loc / "pxcdb.py"
-    with ControlFlowLock:
-        pxc_start([str(pxc_module_path), *sys.argv[1:]])
+    if record_path is not None:
+        # nothing to control, the debuggee records by itself
+        os.environ["PXC_RECORD"] = record_path
+        os.execv(sys.executable, [sys.executable, str(PXCDB), *args])
 
-    controller_server.join()
+    loop = asyncio.new_event_loop()
+    pxc_start(args, attach_pid)
+    loop.close()
     logger.debug("Exiting Safely")
 
 
@@ -0,0 +1,164 @@
+import os
+import sys
+import gc
+import bdb
+import types
+from typing import Optional
+
+# sys.monitoring replaces the trace function while running to a breakpoint,
+# set PXC_MONITORING=0 to always let bdb trace
+ENABLED = os.getenv("PXC_MONITORING", "1") != "0" and sys.version_info >= (3, 12)
+
+
+class MonitoringBackend:
+    """
+    Finds breakpoints with sys.monitoring instead of a trace function.
+
+    Only code objects of files with breakpoints get LINE events (and
+    PY_START when a breakpoint is set on the function itself), lines without
+    breakpoints are DISABLEd the first time they run. Once a breakpoint is
+    hit the regular bdb trace function takes over for stepping.
+
+    Code objects are found on the heap once per file with breakpoints. The
+    heap is only searched again for files that get their first breakpoint,
+    or for files not found before once more modules were imported.
+    """
+
+    def __init__(self, debugger: bdb.Bdb):
+        self.debugger = debugger
+        self.tool = sys.monitoring.DEBUGGER_ID
+        # armed code object -> lines with breakpoints
+        self.lines: dict[types.CodeType, set[int]] = {}
+        # file -> its code objects, of the files with breakpoints
+        self.codes: dict[str, list[types.CodeType]] = {}
+        # files with breakpoints last searched for in vain, and len(sys.modules)
+        # at the time
+        self.missed: tuple[set[str], int] = (set(), 0)
+        # functions with a breakpoint that started and did not run a line yet
+        self.entering: set[types.CodeType] = set()
+
+        sys.monitoring.use_tool_id(self.tool, "pxcdb")
+        sys.monitoring.register_callback(
+            self.tool, sys.monitoring.events.LINE, self._line
+        )
+        sys.monitoring.register_callback(
+            self.tool, sys.monitoring.events.PY_START, self._start
+        )
+
+    @classmethod
+    def create(cls, debugger: bdb.Bdb) -> Optional["MonitoringBackend"]:
+        if not ENABLED:
+            return None
+        try:
+            return cls(debugger)
+        except ValueError:
+            return None  # another debugger holds the tool id
+
+    def _find_code_objects(self, filenames: set[str]) -> None:
+        seen: set[int] = set()
+
+        def add(code: types.CodeType) -> None:
+            if id(code) in seen:
+                return
+            seen.add(id(code))
+            filename = self.debugger.canonic(code.co_filename)
+            if filename in filenames:
+                self.codes.setdefault(filename, []).append(code)
+            for const in code.co_consts:
+                if isinstance(const, types.CodeType):
+                    add(const)
+
+        for obj in gc.get_objects():
+            if isinstance(obj, types.FunctionType):
+                add(obj.__code__)
+        # module level code is only reachable from running frames
+        frame = sys._getframe()
+        while frame is not None:
+            add(frame.f_code)
+            frame = frame.f_back
+
+    def arm(self) -> bool:
+        """
+        Enables events for the code objects with breakpoints and disables
+        them for code objects that no longer have any.
+        Returns False if some breakpoint is in code that is not loaded yet,
+        only tracing notices it then.
+        """
+
+        breaks = self.debugger.breaks
+        for filename in set(self.codes) - set(breaks):
+            del self.codes[filename]
+        missing = set(breaks) - set(self.codes)
+        if missing:
+            if self.missed == (missing, len(sys.modules)):
+                return False  # nothing new to look at since the last search
+            self._find_code_objects(missing)
+            if set(breaks) - set(self.codes):
+                self.missed = (set(breaks) - set(self.codes), len(sys.modules))
+                return False
+
+        events = sys.monitoring.events
+        armed: dict[types.CodeType, set[int]] = {}
+        for filename, codes in self.codes.items():
+            file_breaks = breaks[filename]
+            for code in codes:
+                lines = {line for _, _, line in code.co_lines() if line in file_breaks}
+                starts = code.co_firstlineno in file_breaks
+                if not lines and not starts:
+                    continue
+                armed[code] = lines
+                sys.monitoring.set_local_events(
+                    self.tool,
+                    code,
+                    events.LINE | (events.PY_START if starts else events.NO_EVENTS),
+                )
+        for code in self.lines.keys() - armed.keys():
+            sys.monitoring.set_local_events(self.tool, code, events.NO_EVENTS)
+        self.lines = armed
+        self.entering.clear()
+        # lines disabled during an earlier run may have a breakpoint now
+        sys.monitoring.restart_events()
+        return True
+
+    def disarm(self) -> None:
+        for code in self.lines:
+            sys.monitoring.set_local_events(
+                self.tool, code, sys.monitoring.events.NO_EVENTS
+            )
+        self.lines.clear()
+        self.entering.clear()
+
+    def close(self) -> None:
+        # gives the tool id back, e.g. for a debugger attaching later
+        self.disarm()
+        events = sys.monitoring.events
+        for event in (events.LINE, events.PY_START):
+            sys.monitoring.register_callback(self.tool, event, None)
+        sys.monitoring.free_tool_id(self.tool)
+
+    def _line(self, code: types.CodeType, line: int):
+        lines = self.lines.get(code)
+        if lines is None:
+            return sys.monitoring.DISABLE
+        if code in self.entering:
+            # first line of a function with a breakpoint, bdb stops there as
+            # when tracing and it must never be disabled
+            self.entering.discard(code)
+            lines.add(line)
+        elif line not in lines:
+            return sys.monitoring.DISABLE
+        self._check(sys._getframe(1))
+
+    def _start(self, code: types.CodeType, offset: int):
+        # PY_START comes on the def line, the breakpoint is checked on the
+        # first line run
+        self.entering.add(code)
+
+    def _check(self, frame: types.FrameType) -> None:
+        # conditions and ignore counts are evaluated by bdb as usual, a
+        # breakpoint that does not match keeps its events
+        if not self.debugger.break_here(frame):
+            return
+
+        self.disarm()
+        self.debugger.resume_tracing(frame)
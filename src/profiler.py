@@ -0,0 +1,130 @@
+from typing import Callable, Optional, Union
+
+import protocol
+
+FORMATS = ("table", "collapsed")
+NS_PER_SECOND = 1_000_000_000
+NS_PER_US = 1_000
+
+# C function address, or its name when the address could not be resolved
+Key = Union[int, str]
+
+
+class FunctionStats:
+    __slots__ = ("name", "calls", "inclusive", "exclusive")
+
+    def __init__(self, name: Optional[str]):
+        self.name = name
+        self.calls = 0
+        # nanoseconds
+        self.inclusive = 0
+        self.exclusive = 0
+
+
+class CProfiler:
+    """
+    Times C functions from the c_call, c_return and c_exception events of a
+    profiled debuggee, timestamped by its profile hook.
+
+    Open calls are kept on a stack, time a C function spends in C functions
+    it reaches through Python callbacks is exclusive time of those. Only the
+    outermost call of a recursion adds to the inclusive time.
+    """
+
+    def __init__(self):
+        self.stats: dict[Key, FunctionStats] = {}
+        # open calls: [key, start timestamp, time spent in callees]
+        self.stack: list[list] = []
+        # path of keys from the outermost call -> exclusive time
+        self.stacks: dict[tuple[Key, ...], int] = {}
+
+    def process(self, events: list[tuple[int, Optional[str], int, int]]) -> None:
+        for opcode, name, addr, timestamp in events:
+            key = addr or name
+            if opcode == protocol.OP_C_CALL:
+                if key not in self.stats:
+                    self.stats[key] = FunctionStats(name)
+                self.stack.append([key, timestamp, 0])
+            else:
+                self._return(key, timestamp)
+
+    def _return(self, key: Key, timestamp: int) -> None:
+        path = [entry[0] for entry in self.stack]
+        if key not in path:
+            return  # called before profiling started
+
+        # calls above it did not report their return, they end with it
+        while True:
+            callee, start, callees = self.stack.pop()
+            elapsed = timestamp - start
+            depth = len(self.stack)
+
+            stats = self.stats[callee]
+            stats.calls += 1
+            stats.exclusive += elapsed - callees
+            if callee not in path[:depth]:
+                stats.inclusive += elapsed
+            stack = tuple(path[: depth + 1])
+            self.stacks[stack] = self.stacks.get(stack, 0) + elapsed - callees
+
+            if self.stack:
+                self.stack[-1][2] += elapsed
+            if callee == key:
+                return
+
+    def names(self, resolve: Callable[[int], Optional[str]]) -> dict[Key, str]:
+        """
+        Display names, resolving every address once.
+        """
+
+        names = {}
+        for key, stats in self.stats.items():
+            symbol = resolve(key) if isinstance(key, int) else None
+            names[key] = symbol or stats.name or "??"
+        return names
+
+    def report(
+        self, output_format: str, resolve: Callable[[int], Optional[str]]
+    ) -> str:
+        names = self.names(resolve)
+        if output_format == "collapsed":
+            return self.collapsed(names)
+        return self.table(names)
+
+    def table(self, names: dict[Key, str]) -> str:
+        """
+        Functions sorted by exclusive time, columns as printed by pstats.
+        """
+
+        called = [(key, stats) for key, stats in self.stats.items() if stats.calls]
+        called.sort(key=lambda item: item[1].exclusive, reverse=True)
+        total = sum(stats.exclusive for _, stats in called)
+
+        lines = [
+            f"{sum(stats.calls for _, stats in called)} calls of "
+            f"{len(called)} C functions in {total / NS_PER_SECOND:.3f} seconds",
+            "",
+            f"{'ncalls':>9} {'tottime':>9} {'percall':>9} {'cumtime':>9} "
+            f"{'percall':>9}  function",
+        ]
+        for key, stats in called:
+            exclusive = stats.exclusive / NS_PER_SECOND
+            inclusive = stats.inclusive / NS_PER_SECOND
+            lines.append(
+                f"{stats.calls:>9} {exclusive:>9.6f} {exclusive / stats.calls:>9.6f} "
+                f"{inclusive:>9.6f} {inclusive / stats.calls:>9.6f}  {names[key]}"
+            )
+        return "\n".join(lines)
+
+    def collapsed(self, names: dict[Key, str]) -> str:
+        """
+        One line per stack with its exclusive time in microseconds, the
+        input of flamegraph.pl and compatible tools.
+        """
+
+        lines = [
+            ";".join(names[key] for key in stack) + f" {elapsed // NS_PER_US}"
+            for stack, elapsed in self.stacks.items()
+            if elapsed >= NS_PER_US
+        ]
+        return "\n".join(sorted(lines))
@@ -0,0 +1,354 @@
+import json
+import socket
+import struct
+import threading
+import time
+from typing import Iterator, Optional
+
+from transport import Transport
+
+# Every message is a fixed header followed by `length` bytes of payload.
+HEADER = struct.Struct("<BI")  # opcode, payload length
+# payload of the C function events: function address, interned name id
+EVENT = struct.Struct("<QI")
+# payload of messages carrying a single flag
+FLAG = struct.Struct("<?")
+# payload of OP_NAME: name id followed by the utf-8 encoded name
+NAME = struct.Struct("<I")
+# payload of OP_BATCH is a sequence of these: opcode, address, name id
+BATCH_EVENT = struct.Struct("<BQI")
+# payload of OP_PROFILE_BATCH: like OP_BATCH plus a monotonic timestamp in ns
+PROFILE_EVENT = struct.Struct("<BQIQ")
+# payload of OP_PDB_COMMAND and OP_PDB_REPLY: request id, then utf-8 text
+REQUEST = struct.Struct("<I")
+
+OP_C_CALL = 1
+OP_C_RETURN = 2
+OP_C_EXCEPTION = 3
+OP_NAME = 4
+OP_REPLY = 5
+OP_STEP_IN = 6
+OP_STEP_IN_ACK = 7
+OP_BATCH = 8
+OP_INSPECT = 9
+OP_INSPECT_REPLY = 10
+# answer to OP_STEP_IN when the callee is known: an event whose address is
+# where to break, or 0 if no native breakpoint is needed
+OP_STEP_TARGET = 11
+OP_PROFILE_BATCH = 12
+# sent by a profiled debuggee once the program finished, it waits for an
+# OP_REPLY so that addresses can still be resolved in the live process
+OP_PROFILE_END = 13
+# pdb talks over the channel, not the stdin and stdout of the program: a
+# command line to it, and everything it wrote until it waits for the next
+# command as the reply. Request 0 gets the output nobody asked for, like
+# the first stop.
+OP_PDB_COMMAND = 14
+OP_PDB_REPLY = 15
+# the controller is going away, the debuggee removes its hooks and runs on
+OP_DETACH = 16
+
+BUFFER_SIZE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _unpack(s: struct.Struct, payload: memoryview) -> tuple:
+    try:
+        return s.unpack_from(payload)
+    except struct.error as e:
+        raise ProtocolError(f"Malformed message: {e}") from None
+
+
+class Channel:
+    """
+    Framed messages over a connected socket or shared memory transport.
+    Names of C functions are interned: the first event with a name is
+    preceded by an OP_NAME message, later events only carry its id.
+    """
+
+    def __init__(self, transport: Transport, buffer_size: int = BUFFER_SIZE):
+        self.transport = transport
+
+        # receiving side, bytes between start and end are not consumed yet
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.names: dict[int, str] = {}
+        self.closed = False
+
+        # sending side
+        self.send_lock = threading.Lock()
+        self.event_buffer = bytearray(HEADER.size + EVENT.size)
+        self.name_ids: dict[str, int] = {}
+        self.messages_sent = 0
+
+    def fileno(self) -> int:
+        return self.transport.fileno()
+
+    def shutdown(self) -> None:
+        # unblocks a thread waiting in recv
+        self.transport.shutdown(socket.SHUT_RDWR)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def send(self, opcode: int, payload: bytes = b"") -> None:
+        with self.send_lock:
+            self.transport.sendall(HEADER.pack(opcode, len(payload)) + payload)
+            self.messages_sent += 1
+
+    def send_flag(self, opcode: int, value: bool) -> None:
+        self.send(opcode, FLAG.pack(value))
+
+    def send_json(self, opcode: int, obj) -> None:
+        # for the few messages carrying structured data rather than events
+        self.send(opcode, json.dumps(obj, separators=(",", ":")).encode())
+
+    def send_request(self, opcode: int, request_id: int, text: str) -> None:
+        self.send(opcode, REQUEST.pack(request_id) + text.encode())
+
+    def send_requests(self, opcode: int, requests: list[tuple[int, str]]) -> None:
+        # pipelined, a message each but a single write
+        data = bytearray()
+        for request_id, text in requests:
+            encoded = text.encode()
+            data += HEADER.pack(opcode, REQUEST.size + len(encoded))
+            data += REQUEST.pack(request_id)
+            data += encoded
+        with self.send_lock:
+            self.transport.sendall(data)
+            self.messages_sent += len(requests)
+
+    def send_buffer(self, buffer: memoryview) -> None:
+        # buffer already starts with a header
+        with self.send_lock:
+            self.transport.sendall(buffer)
+            self.messages_sent += 1
+
+    def intern(self, name: Optional[str]) -> int:
+        with self.send_lock:
+            return self._intern(name)
+
+    def _intern(self, name: Optional[str]) -> int:
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.name_ids)
+            self.name_ids[name] = name_id
+            encoded = (name or "").encode()
+            self.transport.sendall(
+                HEADER.pack(OP_NAME, NAME.size + len(encoded))
+                + NAME.pack(name_id)
+                + encoded
+            )
+            self.messages_sent += 1
+        return name_id
+
+    def send_event(self, opcode: int, name: Optional[str], addr: int) -> None:
+        with self.send_lock:
+            name_id = self._intern(name)
+            HEADER.pack_into(self.event_buffer, 0, opcode, EVENT.size)
+            EVENT.pack_into(self.event_buffer, HEADER.size, addr or 0, name_id)
+            self.transport.sendall(self.event_buffer)
+            self.messages_sent += 1
+
+    def recv(self) -> Optional[tuple[int, memoryview]]:
+        """
+        Returns the next message as (opcode, payload) or None once the
+        connection is closed. The payload is a view into the receive buffer
+        and is only valid until the next call.
+        OP_NAME messages are consumed here.
+        """
+
+        while True:
+            message = self._next_message()
+            if message is not None:
+                return message
+            if not self._read(0):
+                self.closed = True
+                return None
+
+    def poll(self) -> Iterator[tuple[int, memoryview]]:
+        """
+        Yields the messages that can be received without blocking, meant to
+        be called when the transport is readable. Sets `closed` once the
+        other end went away.
+        """
+
+        while True:
+            message = self._next_message()
+            if message is not None:
+                yield message
+                continue
+
+            try:
+                if not self._read(socket.MSG_DONTWAIT):
+                    self.closed = True
+                    return
+            except BlockingIOError:
+                return
+
+    def decode_event(self, payload: memoryview) -> tuple[Optional[str], int]:
+        addr, name_id = _unpack(EVENT, payload)
+        try:
+            return self.names[name_id], addr
+        except KeyError:
+            raise ProtocolError(f"Unknown name id {name_id}") from None
+
+    def decode_batch(self, payload: memoryview) -> list[tuple[int, Optional[str], int]]:
+        names = self.names
+        try:
+            return [
+                (opcode, names[name_id], addr)
+                for opcode, addr, name_id in BATCH_EVENT.iter_unpack(payload)
+            ]
+        except KeyError as e:
+            raise ProtocolError(f"Unknown name id {e.args[0]}") from None
+        except struct.error as e:
+            raise ProtocolError(f"Malformed batch: {e}") from None
+
+    def decode_profile_batch(
+        self, payload: memoryview
+    ) -> list[tuple[int, Optional[str], int, int]]:
+        names = self.names
+        try:
+            return [
+                (opcode, names[name_id], addr, timestamp)
+                for opcode, addr, name_id, timestamp in PROFILE_EVENT.iter_unpack(
+                    payload
+                )
+            ]
+        except KeyError as e:
+            raise ProtocolError(f"Unknown name id {e.args[0]}") from None
+        except struct.error as e:
+            raise ProtocolError(f"Malformed batch: {e}") from None
+
+    @staticmethod
+    def decode_request(payload: memoryview) -> tuple[int, str]:
+        (request_id,) = _unpack(REQUEST, payload)
+        return request_id, bytes(payload[REQUEST.size :]).decode(errors="replace")
+
+    @staticmethod
+    def decode_flag(payload: memoryview) -> bool:
+        return _unpack(FLAG, payload)[0]
+
+    @staticmethod
+    def decode_json(payload: memoryview):
+        try:
+            return json.loads(bytes(payload))
+        except ValueError as e:
+            raise ProtocolError(f"Malformed JSON: {e}") from None
+
+    def _next_message(self) -> Optional[tuple[int, memoryview]]:
+        # returns a completely buffered message, if any
+        while True:
+            pending = self.end - self.start
+            if pending < HEADER.size:
+                self._reserve(HEADER.size)
+                return None
+
+            opcode, length = HEADER.unpack_from(self.buffer, self.start)
+            if pending < HEADER.size + length:
+                self._reserve(HEADER.size + length)
+                return None
+
+            offset = self.start + HEADER.size
+            self.start = offset + length
+            payload = self.view[offset : self.start]
+
+            if opcode == OP_NAME:
+                (name_id,) = _unpack(NAME, payload)
+                try:
+                    self.names[name_id] = bytes(payload[NAME.size :]).decode()
+                except UnicodeDecodeError as e:
+                    raise ProtocolError(f"Malformed name: {e}") from None
+                continue
+
+            return opcode, payload
+
+    def _read(self, flags: int) -> bool:
+        received = self.transport.recv_into(self.view[self.end :], 0, flags)
+        if not received:
+            return False
+        self.end += received
+        return True
+
+    def _reserve(self, size: int) -> None:
+        # make room for `size` bytes starting at the first unconsumed one
+        if self.start + size > len(self.buffer):
+            self._compact(size)
+
+    def _compact(self, size: int) -> None:
+        pending = self.end - self.start
+        if size > len(self.buffer):
+            buffer = bytearray(max(size, 2 * len(self.buffer)))
+            buffer[:pending] = self.view[self.start : self.end]
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        else:
+            self.buffer[:pending] = self.buffer[self.start : self.end]
+        self.start = 0
+        self.end = pending
+
+
+class EventBatch:
+    """
+    Buffers events that nobody waits for and sends them as one OP_BATCH
+    message once `capacity` events are buffered, when an event is added
+    `interval` seconds or more after the first buffered one, or on an
+    explicit flush. The interval is only checked by `add`: the last events
+    before the program goes quiet stay buffered until the next flush, which
+    the debuggee does whenever it stops or detaches.
+    Profile events go out as OP_PROFILE_BATCH with PROFILE_EVENT entries.
+    """
+
+    def __init__(
+        self,
+        channel: Channel,
+        capacity: int = 4096,
+        interval: float = 0.1,
+        opcode: int = OP_BATCH,
+        event: struct.Struct = BATCH_EVENT,
+    ):
+        self.channel = channel
+        self.capacity = capacity
+        self.interval = interval
+        self.opcode = opcode
+        self.event = event
+        self.buffer = bytearray(HEADER.size + capacity * event.size)
+        self.view = memoryview(self.buffer)
+        self.count = 0
+        self.deadline = 0.0
+        self.events_sent = 0
+
+    def add(self, opcode: int, name: Optional[str], addr: int, *fields: int) -> None:
+        if self.count == 0:
+            self.deadline = time.monotonic() + self.interval
+
+        self.event.pack_into(
+            self.buffer,
+            HEADER.size + self.count * self.event.size,
+            opcode,
+            addr or 0,
+            self.channel.intern(name),
+            *fields,
+        )
+        self.count += 1
+
+        # no timer: that would need a lock on this path, which runs on every
+        # C call of the program
+        if self.count == self.capacity or time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.count == 0:
+            return
+
+        length = self.count * self.event.size
+        HEADER.pack_into(self.buffer, 0, self.opcode, length)
+        self.channel.send_buffer(self.view[: HEADER.size + length])
+        self.events_sent += self.count
+        self.count = 0
@@ -1,7 +1,41 @@
+import os
 import lldb
-from typing import Optional
-from LLDBHost import LLDBHost
+import logging
+from collections import deque
+from typing import Callable, Optional
+from LLDBHost import LLDBHost, LLDBException
 from IOManager import IOManager
+import protocol
+import symbols
+
+logger = logging.getLogger("pxc-dbg")
+
+# characters of each value's repr shown by `vars`
+REPR_BUDGET = int(os.getenv("PXC_REPR_BUDGET", 80))
+
+BREAKPOINT_USAGE = """\
+    br list: lists breakpoints
+    br cond <id> [<expression>]: stops only when the expression is true
+    br ignore <id> <count>: ignores the next count hits
+    br enable <id> / br disable <id>
+    br delete <id>"""
+
+
+class CrossBreakpoint:
+    """
+    A breakpoint set in the engines owning its symbol (see
+    PXC.set_breakpoint). Each evaluates conditions and ignore counts in the
+    debuggee: lldb through the SBBreakpoint, pdb with a compiled condition
+    (see PSXDB.do_pxbreak).
+    """
+
+    def __init__(self, breakpoint_id: int, symbol: str):
+        self.id = breakpoint_id
+        self.symbol = symbol
+        self.lldb_id: Optional[int] = None
+        self.condition: Optional[str] = None
+        self.ignore_count = 0
+        self.enabled = True
 
 
 class PXC:
@@ -13,81 +47,337 @@ class PXC:
         # i.e. process is in stop state when things are enqueued
         self.python_command_queue: list[str] = []
 
-    def set_breakpoint(self, symbol: str) -> None:
-        # lldb
-        output, _ = self.lldb_host.execute(f"b {symbol}")
+        # connection to the debuggee, None until it connects
+        self.channel: Optional[protocol.Channel] = None
+
+        self.breakpoints: dict[int, CrossBreakpoint] = {}
+        self.next_breakpoint_id = 1
+
+        # request id -> pdb command waiting for its reply, 0 is never used
+        self.pdb_requests: dict[int, str] = {}
+        self.next_request_id = 1
+        # called with (request id, command, output) of every pdb reply
+        self.pdb_reply_handlers: list[Callable[[int, Optional[str], str], None]] = []
+        # callbacks of the inspections sent, the debuggee answers in order
+        self.inspections: deque[Callable[[dict], None]] = deque()
+
+    def send_pdb(self, commands: list[str]) -> None:
+        """
+        Sends commands to pdb in a single write, each with a request id
+        that pdb answers with an OP_PDB_REPLY (see show_pdb_reply).
+        """
+
+        if self.channel is None:
+            # sent once the debuggee connects
+            self.python_command_queue.extend(commands)
+            return
+
+        requests = []
+        for command in commands:
+            requests.append((self.next_request_id, command))
+            self.pdb_requests[self.next_request_id] = command
+            self.next_request_id += 1
+        self.channel.send_requests(protocol.OP_PDB_COMMAND, requests)
+
+    def show_pdb_reply(self, request_id: int, output: str) -> None:
+        command = self.pdb_requests.pop(request_id, None)
+        logger.debug(f"pdb replied to {request_id} ({command}): {output}")
+        if output:
+            self.io_manager.write(output.rstrip("\n"))
+        for handler in self.pdb_reply_handlers:
+            handler(request_id, command, output)
+
+    def detach(self) -> None:
+        """
+        Removes the breakpoints from an attached process and tells its
+        debugger to go, the process runs on once lldb detaches.
+        """
+
+        self.lldb_host.breakpoints.delete(
+            breakpoint.lldb_id
+            for breakpoint in self.breakpoints.values()
+            if breakpoint.lldb_id is not None
+        )
+        self.breakpoints.clear()
+        self.python_command_queue.clear()
+        if self.channel is not None:
+            self.channel.send(protocol.OP_DETACH)
 
-        # python
+    def send_python_command(self, command: str) -> None:
         if not self.lldb_host.is_stopped():
-            self.lldb_host.set_stdin(f"b {symbol}\n")
+            self.send_pdb([command])
+        else:
+            self.python_command_queue.append(command)
+
+    def set_breakpoint(self, symbol: str) -> CrossBreakpoint:
+        """
+        Sets a breakpoint in the engines owning the symbol. A file:line goes
+        to the engine of its language. A name goes to lldb for the modules
+        defining it (see SymbolIndex), and to pdb if the debuggee has a
+        Python function of that name. A name nobody defines yet is left to
+        lldb, which looks for it as modules load.
+        """
+
+        breakpoint = CrossBreakpoint(self.next_breakpoint_id, symbol)
+        self.next_breakpoint_id += 1
+        self.breakpoints[breakpoint.id] = breakpoint
+
+        if symbols.is_file_line(symbol):
+            if symbols.is_python_source(symbol):
+                # pdb reports itself whether the line exists
+                self.set_python_breakpoint(breakpoint)
+            else:
+                self.set_native_breakpoint(breakpoint)
+            return breakpoint
+
+        modules = self.lldb_host.symbols.lookup(symbol)
+        if modules:
+            self.set_native_breakpoint(breakpoint, modules)
+        if self.channel is None or self.lldb_host.is_stopped():
+            # nobody to ask, pdb looks for itself
+            self.set_python_breakpoint(breakpoint)
+            if not modules:
+                self.set_native_breakpoint(breakpoint)
         else:
-            self.python_command_queue.append(f"break {symbol}")
+            self.inspect(
+                {"symbol": symbol},
+                lambda reply: self.route_breakpoint(breakpoint, bool(modules), reply),
+            )
+        return breakpoint
 
+    def route_breakpoint(
+        self, breakpoint: CrossBreakpoint, native: bool, reply: dict
+    ) -> None:
+        if self.breakpoints.get(breakpoint.id) is not breakpoint:
+            return  # deleted while the debuggee looked
+        functions = reply.get("python", [])
+        if functions:
+            locations = ", ".join(f"{f['filename']}:{f['lineno']}" for f in functions)
+            self.io_manager.write(
+                f"Breakpoint {breakpoint.id}: {breakpoint.symbol}, "
+                f"Python function(s) at {locations}"
+            )
+            self.set_python_breakpoint(breakpoint)
+        elif not native:
+            self.set_native_breakpoint(breakpoint)
+
+    def set_native_breakpoint(
+        self, breakpoint: CrossBreakpoint, modules: Optional[list[str]] = None
+    ) -> None:
+        try:
+            native = self.lldb_host.breakpoints.by_symbol(breakpoint.symbol, modules)
+        except LLDBException as e:
+            self.io_manager.write(f"Breakpoint {breakpoint.id}: {e}")
+            return
+
+        breakpoint.lldb_id = native.GetID()
+        # changed while the symbol was looked up
+        if breakpoint.condition:
+            native.SetCondition(breakpoint.condition)
+        native.SetIgnoreCount(breakpoint.ignore_count)
+        native.SetEnabled(breakpoint.enabled)
+
+        output = (
+            f"Breakpoint {breakpoint.id}: {breakpoint.symbol}, "
+            f"{native.GetNumLocations()} native location(s)"
+        )
+        if modules:
+            output += " in " + ", ".join(os.path.basename(m) for m in modules)
         self.io_manager.write(output)
 
+    def set_python_breakpoint(self, breakpoint: CrossBreakpoint) -> None:
+        commands = [f"pxbreak {breakpoint.id} {breakpoint.symbol}"]
+        # commands for the breakpoint sent before pdb knew it were ignored
+        if breakpoint.condition:
+            commands.append(f"pxcondition {breakpoint.id} {breakpoint.condition}")
+        if breakpoint.ignore_count:
+            commands.append(f"pxignore {breakpoint.id} {breakpoint.ignore_count}")
+        if not breakpoint.enabled:
+            commands.append(f"pxdisable {breakpoint.id}")
+        for command in commands:
+            self.send_python_command(command)
+
+    def set_condition(self, breakpoint: CrossBreakpoint, condition: str) -> None:
+        breakpoint.condition = condition or None
+        native = None
+        if breakpoint.lldb_id is not None:
+            native = self.lldb_host.breakpoints.get(breakpoint.lldb_id)
+        if native:
+            native.SetCondition(condition)
+        self.send_python_command(f"pxcondition {breakpoint.id} {condition}")
+
+    def delete_breakpoint(self, breakpoint: CrossBreakpoint) -> None:
+        if breakpoint.lldb_id is not None:
+            self.lldb_host.breakpoints.delete([breakpoint.lldb_id])
+        self.send_python_command(f"pxclear {breakpoint.id}")
+        del self.breakpoints[breakpoint.id]
+
     def process_breakpoints(self, action: str) -> None:
-        raise NotImplementedError
+        subcommand, _, args = action.partition(" ")
+        if subcommand == "list":
+            self.list_breakpoints()
+            return
+
+        breakpoint_id, _, argument = args.strip().partition(" ")
+        argument = argument.strip()
+        try:
+            breakpoint = self.breakpoints[int(breakpoint_id)]
+        except (ValueError, KeyError):
+            self.io_manager.write(f"No breakpoint {breakpoint_id}")
+            return
+
+        native = None
+        if breakpoint.lldb_id is not None:
+            native = self.lldb_host.breakpoints.get(breakpoint.lldb_id)
+
+        if subcommand in ("cond", "condition"):
+            self.set_condition(breakpoint, argument)
+
+        elif subcommand == "ignore":
+            if not argument.isdecimal():
+                self.io_manager.write("Usage: br ignore <id> <count>")
+                return
+            breakpoint.ignore_count = int(argument)
+            if native:
+                native.SetIgnoreCount(breakpoint.ignore_count)
+            self.send_python_command(f"pxignore {breakpoint.id} {argument}")
+
+        elif subcommand in ("enable", "disable"):
+            breakpoint.enabled = subcommand == "enable"
+            if native:
+                native.SetEnabled(breakpoint.enabled)
+            self.send_python_command(f"px{subcommand} {breakpoint.id}")
+
+        elif subcommand == "delete":
+            self.delete_breakpoint(breakpoint)
+
+        else:
+            self.io_manager.write(BREAKPOINT_USAGE)
+            return
+
+        self.io_manager.write("")
+
+    def list_breakpoints(self) -> None:
+        lines = []
+        for breakpoint in self.breakpoints.values():
+            line = f"{breakpoint.id}: {breakpoint.symbol}"
+            if not breakpoint.enabled:
+                line += " (disabled)"
+            if breakpoint.condition:
+                line += f" if {breakpoint.condition}"
+            if breakpoint.ignore_count:
+                line += f", ignore next {breakpoint.ignore_count}"
+
+            native = None
+            if breakpoint.lldb_id is not None:
+                native = self.lldb_host.breakpoints.get(breakpoint.lldb_id)
+            if native and native.GetNumLocations():
+                line += f", native hits {native.GetHitCount()}"
+            lines.append(line)
+        self.io_manager.write("\n".join(lines) or "No breakpoints")
 
     def step_over(self) -> None:
         if self.lldb_host.is_stopped():
             output, _ = self.lldb_host.execute("n")
             self.io_manager.write(output)
         else:
-            self.lldb_host.set_stdin("n\n")
+            self.send_pdb(["n"])
 
     def step_in(self) -> None:
-        # TODO: cross step-in
         if self.lldb_host.is_stopped():
             output, _ = self.lldb_host.execute("s")
             self.io_manager.write(output)
         else:
-            self.lldb_host.set_stdin("s\n")
+            self.send_pdb(["s"])
 
     def continue_execution(self) -> None:
         if self.lldb_host.is_stopped():
             output, _ = self.lldb_host.execute("c")
             self.io_manager.write(output)
         else:
-            self.lldb_host.set_stdin("c\n")
+            self.send_pdb(["c"])
 
     def print_variable(self, variable: str) -> None:
         if self.lldb_host.is_stopped():
             output, _ = self.lldb_host.execute(f"p {variable}")
             self.io_manager.write(output)
         else:
-            self.lldb_host.set_stdin(f"p {variable}\n")
+            self.send_pdb([f"p {variable}"])
 
     def pprint_variable(self, variable: str) -> None:
         if self.lldb_host.is_stopped():
-            output, _ = self.lldb_host.execute(
-                f"expr (char*)PyUnicode_AsUTF8((PyObject*)PyObject_Str((PyObject*)({variable})))"
-            )
-            self.io_manager.write(output)
+            self.io_manager.write(self.lldb_host.format_pyobject(variable))
         else:
-            self.lldb_host.set_stdin(f"pp {variable}\n")
+            self.send_pdb([f"pp {variable}"])
 
     def process_python_command_queue(self) -> None:
-        if not self.lldb_host.is_stopped():
+        # pipelined, pdb reads them once the debuggee runs again
+        if self.channel is None:
             return
 
-        for i in self.python_command_queue:
-            self.lldb_host.set_stdin(i + "\n")
+        commands = list(self.python_command_queue)
         self.python_command_queue.clear()
+        self.send_pdb(commands)
+
+    def print_variables(self, path: list[str] = []) -> None:
+        """
+        Prints the local variables, or the children of the variable reached
+        by following `path` (a variable name followed by keys, indexes or
+        attribute names).
+        """
 
-    def print_variables(self) -> None:
         if self.lldb_host.is_stopped():
-            output, _ = self.lldb_host.execute("vars")
+            if path:
+                expression = path[0] + "".join(
+                    f"[{key}]" if key.isdigit() else f".{key}" for key in path[1:]
+                )
+                output, _ = self.lldb_host.execute(f"frame variable {expression}")
+            else:
+                output, _ = self.lldb_host.execute("vars")
             self.io_manager.write(output)
         else:
-            self.lldb_host.set_stdin(
-                'exec("from collections import deque; print(); deque((print(f\\"{k} = {v}\\") for k, v in locals().items() if ((not k.startswith(\\"_\\"))) and (k != \\"deque\\")), maxlen=1) and None")\n'
-            )
+            self.inspect({"path": path, "budget": REPR_BUDGET}, self.show_inspection)
+
+    def inspect(self, request: dict, callback: Callable[[dict], None]) -> None:
+        """
+        Sends an inspection request to the debuggee, `callback` gets the
+        reply once it arrives (see inspection_replied).
+        """
+
+        if self.channel is None:
+            callback({"error": "Not connected to the debuggee"})
+            return
+        self.inspections.append(callback)
+        self.channel.send_json(protocol.OP_INSPECT, request)
+
+    def inspection_replied(self, reply: dict) -> None:
+        if self.inspections:
+            self.inspections.popleft()(reply)
+
+    def show_inspection(self, reply: dict) -> None:
+        if "error" in reply:
+            self.io_manager.write(reply["error"])
+            return
+
+        lines = []
+        if "value" in reply:
+            lines.append(self.format_summary(reply["value"]))
+        indent = "    " if "value" in reply else ""
+        lines.extend(indent + self.format_summary(i) for i in reply["children"])
+        self.io_manager.write("\n".join(lines))
+
+    @staticmethod
+    def format_summary(summary: dict) -> str:
+        text = f"{summary['name']}: {summary['type']}"
+        if "length" in summary:
+            text += f"[{summary['length']}]"
+        text += f" = {summary['repr']}"
+        if summary["children"]:
+            text += " (+)"
+        return text
 
     def print_backtrace(self) -> None:
         if self.lldb_host.is_stopped():
-            output, _ = self.lldb_host.execute(
-                f"bt"
-            )
-            self.io_manager.write(output)
+            self.io_manager.write(self.lldb_host.backtrace())
         else:
-            self.lldb_host.set_stdin(f"bt\n")
+            self.send_pdb(["bt"])
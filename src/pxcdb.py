@@ -1,19 +1,40 @@
 import sys
 import os
+import bdb
+import json
 import logging
+from types import CodeType
 from pdb import Pdb, _usage, _ModuleTarget, _ScriptTarget, Restart
 import traceback
-import socket
 import threading
-import pickle
 import time
+import queue
 
-from pxc_extension import resolve_location
+import pxc_extension
+import protocol
+import inspection
+import monitoring
+import stepping
+import symbols
+import transport
 
-
-HOST = "127.0.0.1"
-PORT = 30_000
 pipe = ...
+debugger = ...
+# replies from the controller to a c_call, handed over by the controller reader
+replies = queue.Queue()
+# pdb commands from the controller as (request id, line), see PdbChannel
+pdb_commands = queue.Queue()
+# set by the controller in profile mode: runs the program once, timing C calls
+PROFILE = os.getenv("PXC_PROFILE") == "1"
+PROFILE_END_TIMEOUT = 60
+# set by the controller in record mode: runs the program once without the
+# debugger, writing its events to this trace log (see tracelog.py)
+RECORD = os.getenv("PXC_RECORD")
+PROFILE_OPCODES = {
+    "c_call": protocol.OP_C_CALL,
+    "c_return": protocol.OP_C_RETURN,
+    "c_exception": protocol.OP_C_EXCEPTION,
+}
 
 
 # Setup logging
@@ -32,6 +53,34 @@ else:
     logging.basicConfig(level=log_level)
 
 
+class PdbChannel:
+    """
+    stdin and stdout of pdb. Commands come from the controller with a
+    request id, everything pdb writes until it reads the next command is
+    the reply to it.
+    """
+
+    def __init__(self):
+        self.request_id = 0
+        self.output: list[str] = []
+
+    def readline(self) -> str:
+        self.reply()
+        self.request_id, line = pdb_commands.get()
+        return line + "\n"
+
+    def write(self, data: str) -> int:
+        self.output.append(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass  # output goes out with the reply
+
+    def reply(self) -> None:
+        pipe.send_request(protocol.OP_PDB_REPLY, self.request_id, "".join(self.output))
+        self.output.clear()
+
+
 class PSXDB(Pdb):
     def __init__(
         self,
@@ -43,52 +92,322 @@ class PSXDB(Pdb):
         readrc=True,
     ):
         super().__init__(completekey, stdin, stdout, skip, nosigint, readrc)
-        sys.setprofile(self.cfunction_dispatch_handler)
-
-    def cfunction_dispatch_handler(self, frame, event, arg):
-        if event == "c_call":
-            logger.debug(
-                f"cfunction_dispatch_handler: {event = } name = {arg.__name__}"
+        # replies end where pdb waits for a command, the controller needs
+        # no prompt to tell
+        self.prompt = ""
+        # the native hook filters C function events and resolves their
+        # address itself; it only calls back while a step-in is pending
+        pxc_extension.start_profile(self.cfunction_dispatch_handler)
+        # nobody waits on c_return and c_exception, they are sent in batches
+        self.events = protocol.EventBatch(pipe)
+        self.inspector = inspection.Inspector()
+        # breakpoint id of the controller -> pdb breakpoint numbers, one per
+        # function of that name
+        self.cross_breakpoints: dict[int, list[int]] = {}
+        # Python functions by name, fed by an import hook
+        self.symbols = symbols.PythonSymbolIndex()
+        # None when breakpoints can only be found by tracing
+        self.monitoring = monitoring.MonitoringBackend.create(self)
+        self.profile = None
+        if PROFILE:
+            self.profile = protocol.EventBatch(
+                pipe, opcode=protocol.OP_PROFILE_BATCH, event=protocol.PROFILE_EVENT
             )
-            pipe.send(
-                pickle.dumps(
-                    ("c_call", arg.__name__, resolve_location(arg.__name__, arg))
-                )
+            pxc_extension.set_profiling(self.profile_handler)
+        # set by attach, see detach
+        self.attached = False
+        self.detaching = False
+        # source of a breakpoint condition -> its code, see break_here
+        self.conditions: dict[str, CodeType] = {}
+
+    def interaction(self, frame, traceback):
+        if self.detaching:
+            self.finish_detach()
+            return
+        # the controller should have seen everything before the user
+        # gets the prompt
+        self.events.flush()
+        self.inspector.invalidate()
+        pxc_extension.set_stepping_in(False)
+        super().interaction(frame, traceback)
+
+    def precmd(self, line):
+        # any command might change locals or the current frame
+        self.inspector.invalidate()
+        return super().precmd(line)
+
+    def inspect(self, request: dict) -> dict:
+        # runs on the controller reader while pdb waits for a command
+        if "symbol" in request:
+            # or while the program runs, the index looks at no frame
+            locations = self.symbols.lookup(request["symbol"])
+            return {
+                "symbol": request["symbol"],
+                "python": [location._asdict() for location in locations],
+            }
+
+        frame = getattr(self, "curframe", None)
+        if frame is None:
+            return self.inspector.inspect(0, None, request)
+
+        # innermost first, "frame" indexes these
+        stack = [(f, lineno) for f, lineno in reversed(self.stack)]
+        if request.get("stack"):
+            return {
+                "frames": [
+                    {
+                        "name": f.f_code.co_name,
+                        "file": f.f_code.co_filename,
+                        "line": lineno,
+                    }
+                    for f, lineno in stack
+                ]
+            }
+
+        index = request.get("frame")
+        if index is not None:
+            if not 0 <= index < len(stack):
+                return {"error": f"No frame {index}"}
+            frame = stack[index][0]
+        local_vars = self.curframe_locals if frame is self.curframe else frame.f_locals
+        return self.inspector.inspect(id(frame), local_vars, request)
+
+    def step_target(self):
+        # runs on the controller reader while pdb waits for a command,
+        # see stepping.step_target
+        stack = getattr(self, "stack", None)
+        if not stack:
+            return None
+        frame = stack[-1][0]
+        local_vars = self.curframe_locals if frame is self.curframe else frame.f_locals
+        return stepping.step_target(frame, local_vars)
+
+    def set_continue(self):
+        super().set_continue()
+        if self.monitoring is None or not self.breaks:
+            return
+        if not self.monitoring.arm():
+            return
+
+        # sys.monitoring watches the breakpoints, run without tracing
+        sys.settrace(None)
+        frame = sys._getframe().f_back
+        while frame and frame is not self.botframe:
+            del frame.f_trace
+            frame = frame.f_back
+
+    def set_quit(self):
+        if self.monitoring is not None:
+            self.monitoring.disarm()
+        super().set_quit()
+
+    def resume_tracing(self, frame):
+        # called by the monitoring backend on a breakpoint, from here on
+        # the trace function handles stepping as if it had found it
+        f = frame
+        while f and f is not self.botframe:
+            f.f_trace = self.trace_dispatch
+            f = f.f_back
+        sys.settrace(self.trace_dispatch)
+
+        self.user_line(frame)
+        if self.quitting:
+            raise bdb.BdbQuit
+
+    def detach(self):
+        # runs on the controller reader once the controller is gone, hooks
+        # go right away, the traced thread drops its trace function at its
+        # next event or at the prompt
+        self.detaching = True
+        pxc_extension.set_stepping_in(False)
+        pxc_extension.stop_profile()
+        if self.monitoring is not None:
+            self.monitoring.close()
+            self.monitoring = None
+        self.set_step()
+        pdb_commands.put((0, "pxdetach"))
+
+    def finish_detach(self):
+        self.detaching = False
+        self.clear_all_breaks()
+        self.cross_breakpoints.clear()
+        self.symbols.close()
+        # without breakpoints this removes the trace function
+        self.set_continue()
+
+    def do_pxdetach(self, arg):
+        if self.detaching:
+            self.finish_detach()
+            return 1
+
+    # Breakpoints set by the controller, addressed with the controller's id.
+    # Conditions are kept as source, as pdb lists them, and compiled once:
+    # bdb.effective would compile the condition again on every hit.
+
+    def break_here(self, frame):
+        # as Bdb.break_here, with _effective for bdb.effective
+        filename = self.canonic(frame.f_code.co_filename)
+        if filename not in self.breaks:
+            return False
+        lineno = frame.f_lineno
+        if lineno not in self.breaks[filename]:
+            lineno = frame.f_code.co_firstlineno
+            if lineno not in self.breaks[filename]:
+                return False
+
+        bp, flag = self._effective(filename, lineno, frame)
+        if bp is None:
+            return False
+        self.currentbp = bp.number
+        if flag and bp.temporary:
+            self.do_clear(str(bp.number))
+        return True
+
+    def _effective(self, filename: str, lineno: int, frame) -> tuple:
+        # as bdb.effective, evaluating conditions from self.conditions
+        for bp in bdb.Breakpoint.bplist[filename, lineno]:
+            if not bp.enabled or not bdb.checkfuncname(bp, frame):
+                continue
+            bp.hits += 1
+            if bp.cond:
+                try:
+                    code = self.conditions.get(bp.cond)
+                    if code is None:
+                        # set with pdb's condition command
+                        code = compile(bp.cond, "<condition>", "eval")
+                        self.conditions[bp.cond] = code
+                    if not eval(code, frame.f_globals, frame.f_locals):
+                        continue
+                except Exception:
+                    # stops whatever the ignore count, keeping a temporary
+                    # breakpoint as a hint
+                    return bp, False
+            if bp.ignore > 0:
+                bp.ignore -= 1
+                continue
+            return bp, True
+        return None, None
+
+    def _cross_breakpoints(self, breakpoint_id: str) -> list:
+        # none if the symbol is not a Python one
+        bps = []
+        for number in self.cross_breakpoints.get(int(breakpoint_id), []):
+            try:
+                bps.append(self.get_bpbynumber(str(number)))
+            except ValueError:
+                pass  # deleted directly in pdb
+        return bps
+
+    def python_functions(self, name: str) -> list[symbols.Location]:
+        locations = self.symbols.lookup(name)
+        frame = getattr(self, "curframe", None)
+        if locations or frame is None:
+            return locations
+        # names only the current frame knows, as pdb's break would
+        try:
+            value = eval(name, frame.f_globals, self.curframe_locals)
+        except Exception:
+            return []
+        location = symbols.function_location(value)
+        return [location] if location else []
+
+    def do_pxbreak(self, arg):
+        breakpoint_id, _, location = arg.partition(" ")
+        if symbols.is_file_line(location):
+            number = bdb.Breakpoint.next
+            self.do_break(location)
+            if bdb.Breakpoint.next != number:
+                self.cross_breakpoints[int(breakpoint_id)] = [number]
+            return
+
+        functions = self.python_functions(location)
+        if not functions:
+            self.error(f"{location} is not a Python function")
+            return
+        numbers = []
+        for function in functions:
+            error = self.set_break(
+                function.filename, function.lineno, funcname=function.funcname
             )
-            # TODO: A C helper function is required here doing what
-            #       CPython's cfunction_call function does but it should
-            #       return the function pointer instead.
-            #       Along with the arg.__name__ this might be able to
-            #       search the appropriate address when overloads like
-            #       __add__ or __getitem__ need to be stepped into
+            if error:
+                self.error(error)
+                continue
+            bp = self.get_breaks(self.canonic(function.filename), function.lineno)[-1]
+            self.message(f"Breakpoint {bp.number} at {bp.file}:{bp.line}")
+            numbers.append(bp.number)
+        if numbers:
+            self.cross_breakpoints[int(breakpoint_id)] = numbers
+
+    def do_pxcondition(self, arg):
+        breakpoint_id, _, condition = arg.partition(" ")
+        bps = self._cross_breakpoints(breakpoint_id)
+        if not bps:
+            return
+        condition = condition.strip()
+        if condition and condition not in self.conditions:
+            try:
+                self.conditions[condition] = compile(condition, "<condition>", "eval")
+            except SyntaxError as e:
+                self.error(f"Invalid condition {condition}: {e.msg}")
+                return
+        for bp in bps:
+            bp.cond = condition or None
 
-            # pipe.recv will wait till the breakpoint is set if required
-            assert pickle.loads(pipe.recv(1024)) == True
+    def do_pxignore(self, arg):
+        breakpoint_id, _, count = arg.partition(" ")
+        count = count.strip()
+        if not count.isdecimal():
+            self.error("Usage: pxignore <id> <count>")
+            return
+        for bp in self._cross_breakpoints(breakpoint_id):
+            bp.ignore = int(count)
+
+    def do_pxenable(self, arg):
+        for bp in self._cross_breakpoints(arg):
+            bp.enable()
+
+    def do_pxdisable(self, arg):
+        for bp in self._cross_breakpoints(arg):
+            bp.disable()
+
+    def do_pxclear(self, arg):
+        for bp in self._cross_breakpoints(arg):
+            self.clear_bpbynumber(bp.number)
+        self.cross_breakpoints.pop(int(arg), None)
+
+    def cfunction_dispatch_handler(self, event, fn_name, fn_addr):
+        if event == "c_call":
+            logger.debug(f"cfunction_dispatch_handler: {event = } name = {fn_name}")
+            # keep events in order for the controller
+            self.events.flush()
+            pipe.send_event(protocol.OP_C_CALL, fn_name, fn_addr)
+
+            # replies.get will wait till the breakpoint is set if required
+            assert replies.get() == True
+            # execution stops in the first C call, later ones do not matter
+            pxc_extension.set_stepping_in(False)
 
         elif event == "c_return":
-            logger.debug(
-                f"cfunction_dispatch_handler: {event = } name = {arg.__name__}"
-            )
-            pipe.send(
-                pickle.dumps(
-                    ("c_return", arg.__name__, resolve_location(arg.__name__, arg))
-                )
-            )
+            self.events.add(protocol.OP_C_RETURN, fn_name, fn_addr)
 
         elif event == "c_exception":
-            logger.debug(
-                f"cfunction_dispatch_handler: {event = } name = {arg.__name__}"
-            )
-            pipe.send(
-                pickle.dumps(
-                    ("c_exception", arg.__name__, resolve_location(arg.__name__, arg))
-                )
-            )
+            self.events.add(protocol.OP_C_EXCEPTION, fn_name, fn_addr)
 
-        return self.cfunction_dispatch_handler
+    def profile_handler(self, event, fn_name, fn_addr, timestamp):
+        self.profile.add(PROFILE_OPCODES[event], fn_name, fn_addr, timestamp)
 
+    def finish_profile(self):
+        pxc_extension.set_profiling(None)
+        self.profile.flush()
+        pipe.send(protocol.OP_PROFILE_END)
+        # the controller resolves addresses while the process is still around
+        try:
+            replies.get(timeout=PROFILE_END_TIMEOUT)
+        except queue.Empty:
+            logger.debug("Controller did not acknowledge the end of the profile")
 
-def start_debugger():
+
+def parse_target():
     import getopt
 
     opts, args = getopt.getopt(sys.argv[1:], "mhc:", ["help", "command="])
@@ -110,50 +429,168 @@ def start_debugger():
     target.check()
 
     sys.argv[:] = args  # Hide "pdb.py" and pdb options from argument list
+    return target, commands
+
+
+def start_debugger():
+    target, commands = parse_target()
 
     # Note on saving/restoring sys.argv: it's a good idea when sys.argv was
     # modified by the script being debugged. It's a bad idea when it was
     # changed by the user from the command line. There is a "restart" command
     # which allows explicit specification of command line arguments.
-    pdb = PSXDB()
+    global debugger
+    channel = PdbChannel()
+    pdb = debugger = PSXDB(stdin=channel, stdout=channel)
     pdb.rcLines.extend(commands)
+    # its functions can be found before it defines them
+    pdb.symbols.add_source(target.filename)
+    if PROFILE:
+        pdb.rcLines.append("continue")
     while True:
         try:
             pdb._run(target)
             if pdb._user_requested_quit:
+                pdb.events.flush()
                 break
-            print("The program finished and will be restarted")
+            if PROFILE:
+                break
+            pdb.message("The program finished and will be restarted")
         except Restart:
-            print("Restarting", target, "with arguments:")
-            print("\t" + " ".join(sys.argv[1:]))
+            pdb.message(f"Restarting {target} with arguments:")
+            pdb.message("\t" + " ".join(sys.argv[1:]))
         except SystemExit as e:
             # In most cases SystemExit does not warrant a post-mortem session.
-            print("The program exited via sys.exit(). Exit status:", end=" ")
-            print(e)
+            pdb.message(f"The program exited via sys.exit(). Exit status: {e}")
         except SyntaxError:
             traceback.print_exc()
             sys.exit(1)
         except BaseException as e:
             traceback.print_exc()
-            print("Uncaught exception. Entering post mortem debugging")
-            print("Running 'cont' or 'step' will restart the program")
+            pdb.message("Uncaught exception. Entering post mortem debugging")
+            pdb.message("Running 'cont' or 'step' will restart the program")
             t = e.__traceback__
             pdb.interaction(None, t)
-            print("Post mortem debugger finished. The " + target + " will be restarted")
+            pdb.message(
+                f"Post mortem debugger finished. The {target} will be restarted"
+            )
+        if PROFILE:
+            break
+
+    if PROFILE and not pdb._user_requested_quit:
+        pdb.finish_profile()
+    # whatever pdb said since the last command
+    channel.reply()
+
+
+def record(path):
+    target, _ = parse_target()
+
+    # like Pdb._run, the target runs in the __main__ namespace
+    import __main__
+
+    __main__.__dict__.clear()
+    __main__.__dict__.update(target.namespace)
+    code = target.code
+    if isinstance(code, str):
+        code = compile(code, "<string>", "exec")
+
+    pxc_extension.start_recording(path)
+    try:
+        exec(code, __main__.__dict__)
+    finally:
+        records = pxc_extension.stop_recording()
+        print(f"{records} records written to {path}", file=sys.stderr)
+
+
+def controller_reader():
+    while True:
+        try:
+            message = pipe.recv()
+        except OSError:
+            break
+        if message is None:
+            break
+
+        opcode, payload = message
+        logger.debug(f"Received from controller: {opcode = }")
+        if opcode == protocol.OP_STEP_IN:
+            value = pipe.decode_flag(payload)
+            target = None
+            if value and isinstance(debugger, PSXDB):
+                target = debugger.step_target()
+            if target is not None:
+                pipe.send_event(protocol.OP_STEP_TARGET, *target)
+            else:
+                # unknown callee, report C calls while pdb steps
+                pxc_extension.set_stepping_in(value)
+                pipe.send_flag(protocol.OP_STEP_IN_ACK, value)
+        elif opcode == protocol.OP_REPLY:
+            replies.put(pipe.decode_flag(payload))
+        elif opcode == protocol.OP_INSPECT:
+            request = pipe.decode_json(payload)
+            if isinstance(debugger, PSXDB):
+                reply = debugger.inspect(request)
+            else:
+                reply = {"error": "Debugger is not running"}
+            pipe.send_json(protocol.OP_INSPECT_REPLY, reply)
+        elif opcode == protocol.OP_PDB_COMMAND:
+            pdb_commands.put(pipe.decode_request(payload))
+        elif opcode == protocol.OP_DETACH:
+            break
+
+    if isinstance(debugger, PSXDB) and debugger.attached:
+        # the process outlives the controller, see attach
+        debugger.detach()
+        pipe.close()
+    logger.debug("Controller reader exiting")
 
 
 def start_debugger_server():
     global pipe
-    logger.debug("Starting socket")
-    pipe = socket.socket()
+    logger.debug(f"Connecting to controller at {os.getenv(transport.ENDPOINT_ENV)}")
+    pipe = protocol.Channel(transport.debuggee_connect())
+
+    threading.Thread(target=controller_reader, daemon=True).start()
+
+
+def attach(address: str, frame) -> None:
+    """
+    Starts debugging a process that was already running, called in its main
+    thread by the code the controller injects (see main.py --attach). pdb
+    stops in `frame`.
+    """
+
+    global pipe, debugger
+    logger.debug(f"Attaching to controller at {address}")
+    pipe = protocol.Channel(transport.debuggee_connect(address))
+    # leaves the SIGINT handler of the process alone and ignores .pdbrc
+    channel = PdbChannel()
+    debugger = PSXDB(stdin=channel, stdout=channel, nosigint=True, readrc=False)
+    debugger.attached = True
+    threading.Thread(target=controller_reader, daemon=True).start()
+    debugger.set_trace(frame)
+
 
-    logger.debug("Connecting to controller")
-    pipe.connect((HOST, PORT))
+def write_stats(path: str) -> None:
+    # read by bench/run.py
+    stats = {"messages_sent": pipe.messages_sent}
+    if isinstance(debugger, PSXDB):
+        stats["events_batched"] = debugger.events.events_sent
+    with open(path, "w") as f:
+        json.dump(stats, f)
 
 
 def main():
+    if RECORD:
+        record(RECORD)
+        return
     start_debugger_server()
     start_debugger()
+    stats_file = os.getenv("PXC_STATS_FILE")
+    if stats_file:
+        write_stats(stats_file)
+    pipe.close()
     logger.debug("Exiting safely")
 
 
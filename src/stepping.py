@@ -0,0 +1,245 @@
+import dis
+import sys
+import types
+import builtins
+import functools
+import inspect
+from typing import Any, Optional
+
+import pxc_extension
+
+# Where a step-in on the current line goes first, found from the bytecode
+# of the line before running it. Only loads that cannot run code are
+# followed, anything else makes the line unknown.
+
+UNKNOWN = object()
+NULL = object()
+
+# operator of BINARY_OP -> (method, slot)
+BINARY_SLOTS = {
+    "+": ("__add__", "nb_add"),
+    "-": ("__sub__", "nb_subtract"),
+    "*": ("__mul__", "nb_multiply"),
+    "@": ("__matmul__", "nb_matrix_multiply"),
+    "/": ("__truediv__", "nb_true_divide"),
+    "//": ("__floordiv__", "nb_floor_divide"),
+    "%": ("__mod__", "nb_remainder"),
+    "**": ("__pow__", "nb_power"),
+    "<<": ("__lshift__", "nb_lshift"),
+    ">>": ("__rshift__", "nb_rshift"),
+    "&": ("__and__", "nb_and"),
+    "|": ("__or__", "nb_or"),
+    "^": ("__xor__", "nb_xor"),
+}
+BINARY_SLOTS.update(
+    {
+        op + "=": ("__i" + method[2:], "nb_inplace_" + slot[3:])
+        for op, (method, slot) in list(BINARY_SLOTS.items())
+    }
+)
+COMPARE_METHODS = {
+    "<": "__lt__",
+    "<=": "__le__",
+    "==": "__eq__",
+    "!=": "__ne__",
+    ">": "__gt__",
+    ">=": "__ge__",
+}
+
+LOAD_LOCAL = {
+    "LOAD_FAST",
+    "LOAD_FAST_CHECK",
+    "LOAD_FAST_AND_CLEAR",
+    "LOAD_DEREF",
+    "LOAD_CLOSURE",
+}
+STORE = {"STORE_FAST", "STORE_NAME", "STORE_GLOBAL", "STORE_DEREF", "POP_TOP"}
+NO_OP = {"RESUME", "NOP", "PRECALL", "KW_NAMES", "CACHE", "EXTENDED_ARG"}
+BUILD = {"BUILD_TUPLE", "BUILD_LIST", "BUILD_SET"}
+
+PYTHON_CALLABLES = (types.FunctionType, types.MethodType, staticmethod, classmethod)
+C_METHODS = (types.MethodDescriptorType, types.ClassMethodDescriptorType)
+# 3.13 puts NULL above the callable, only the 3.11 and 3.12 layout is known
+SUPPORTED = sys.version_info < (3, 13)
+
+
+class Unresolved(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=256)
+def _instructions(code: types.CodeType) -> list[dis.Instruction]:
+    return list(dis.get_instructions(code))
+
+
+def _line_instructions(frame: types.FrameType) -> list[dis.Instruction]:
+    instructions = []
+    for instruction in _instructions(frame.f_code):
+        if instruction.offset < frame.f_lasti:
+            continue
+        line = instruction.positions.lineno if instruction.positions else None
+        if line is not None and line != frame.f_lineno:
+            break
+        instructions.append(instruction)
+    return instructions
+
+
+def _is_builtin_type(cls: type) -> bool:
+    # slots of the interpreter's own types are not worth stopping in
+    return cls.__module__ == "builtins"
+
+
+def _slot_target(
+    cls: type, method: str, slots: tuple[str, ...]
+) -> Optional[tuple[str, int]]:
+    """
+    Returns (name, address) of the C function an operator dispatches to,
+    (name, 0) if it runs Python code and None if there is nothing to stop in.
+    """
+
+    if isinstance(inspect.getattr_static(cls, method, None), PYTHON_CALLABLES):
+        return f"{cls.__qualname__}.{method}", 0
+    if _is_builtin_type(cls):
+        return None
+    for slot in slots:
+        addr = pxc_extension.resolve_slot(cls, slot)
+        if addr:
+            return f"{cls.__qualname__}.{slot}", addr
+    return None
+
+
+def _call_target(callee: Any) -> Optional[tuple[str, int]]:
+    if callee is UNKNOWN:
+        raise Unresolved
+    name = getattr(callee, "__qualname__", None) or type(callee).__qualname__
+
+    if isinstance(callee, PYTHON_CALLABLES):
+        return name, 0
+    if isinstance(callee, (types.BuiltinFunctionType,) + C_METHODS):
+        return name, pxc_extension.resolve_location(name, callee)
+    if isinstance(callee, type):
+        for method in ("__new__", "__init__"):
+            if isinstance(
+                inspect.getattr_static(callee, method, None), PYTHON_CALLABLES
+            ):
+                return f"{name}.{method}", 0
+        return _slot_target(callee, "__new__", ("tp_new",))
+    return _slot_target(type(callee), "__call__", ("tp_call",))
+
+
+def _load(name: str, *namespaces: dict) -> Any:
+    for namespace in namespaces:
+        if name in namespace:
+            return namespace[name]
+    return UNKNOWN
+
+
+def _attribute(obj: Any, name: str) -> Any:
+    if obj is UNKNOWN:
+        return UNKNOWN
+    value = inspect.getattr_static(obj, name, UNKNOWN)
+    # properties and other descriptors run code when loaded
+    if hasattr(type(value), "__get__") and not isinstance(
+        value, PYTHON_CALLABLES + C_METHODS
+    ):
+        return UNKNOWN
+    return value
+
+
+def step_target(frame: types.FrameType, local_vars: dict) -> Optional[tuple[str, int]]:
+    """
+    Finds the first call of the current line of `frame`, including operators
+    dispatching to type slots of extension types.
+    Returns (name, address) where address is 0 if the call does not need a
+    native breakpoint (Python code, pdb steps into it, or no call at all),
+    or None if the line cannot be followed statically.
+    """
+
+    if not SUPPORTED:
+        return None
+
+    globals_, builtins_ = frame.f_globals, frame.f_builtins or vars(builtins)
+    stack: list[Any] = []
+    try:
+        for instruction in _line_instructions(frame):
+            opname, arg, argval = (
+                instruction.opname,
+                instruction.arg,
+                instruction.argval,
+            )
+            if opname in NO_OP:
+                continue
+
+            if opname in LOAD_LOCAL:
+                stack.append(_load(argval, local_vars))
+            elif opname == "LOAD_CONST":
+                stack.append(argval)
+            elif opname == "LOAD_GLOBAL":
+                if arg & 1:
+                    stack.append(NULL)
+                stack.append(_load(argval, globals_, builtins_))
+            elif opname == "LOAD_NAME":
+                stack.append(_load(argval, local_vars, globals_, builtins_))
+            elif opname == "PUSH_NULL":
+                stack.append(NULL)
+            elif opname == "LOAD_METHOD" or (opname == "LOAD_ATTR" and arg & 1):
+                # 3.11 LOAD_METHOD, 3.12 LOAD_ATTR with the method flag
+                obj = stack.pop()
+                stack.extend([NULL, _attribute(obj, argval)])
+            elif opname == "LOAD_ATTR":
+                stack.append(_attribute(stack.pop(), argval))
+            elif opname in BUILD:
+                del stack[len(stack) - arg :]
+                stack.append(UNKNOWN)
+
+            elif opname == "CALL":
+                callable_or_null, callee = stack[-arg - 2], stack[-arg - 1]
+                if callable_or_null is not NULL:
+                    callee = callable_or_null
+                target = _call_target(callee)
+                if target is not None:
+                    return target
+                del stack[-arg - 2 :]
+                stack.append(UNKNOWN)
+
+            elif opname in ("BINARY_OP", "BINARY_SUBSCR", "STORE_SUBSCR"):
+                if opname == "BINARY_OP":
+                    method, slot = BINARY_SLOTS[instruction.argrepr]
+                    operand, slots = stack[-2], (slot,)
+                elif opname == "BINARY_SUBSCR":
+                    method, operand = "__getitem__", stack[-2]
+                    slots = ("mp_subscript", "sq_item")
+                else:
+                    method, operand = "__setitem__", stack[-2]
+                    slots = ("mp_ass_subscript", "sq_ass_item")
+                if operand is UNKNOWN:
+                    raise Unresolved
+                target = _slot_target(type(operand), method, slots)
+                if target is not None:
+                    return target
+                # the interpreter's own implementation, keep looking
+                del stack[-3 if opname == "STORE_SUBSCR" else -2 :]
+                if opname != "STORE_SUBSCR":
+                    stack.append(UNKNOWN)
+
+            elif opname == "COMPARE_OP":
+                operand = stack[-2]
+                if operand is UNKNOWN:
+                    raise Unresolved
+                method = COMPARE_METHODS.get(instruction.argrepr, "__eq__")
+                target = _slot_target(type(operand), method, ("tp_richcompare",))
+                if target is not None:
+                    return target
+                del stack[-2:]
+                stack.append(UNKNOWN)
+
+            elif opname in STORE:
+                stack.pop()
+            elif opname.startswith(("RETURN", "JUMP")):
+                break
+            else:
+                raise Unresolved
+    except (Unresolved, IndexError, KeyError):
+        return None
+
+    return "", 0
@@ -0,0 +1,197 @@
+import os
+import ast
+import sys
+import types
+import tokenize
+import threading
+from typing import Any, NamedTuple, Optional
+
+# functions of the debugger itself are never breakpoint targets
+SRC = os.path.dirname(os.path.abspath(__file__))
+DEBUGGER_MODULES = {"bdb", "pdb", "cmd"}
+PYTHON_SOURCES = (".py", ".pyw")
+
+
+class Location(NamedTuple):
+    """
+    Where a Python function starts: pdb breaks on the first line run in a
+    code object named `funcname` starting at `lineno` of `filename`.
+    """
+
+    qualname: str
+    filename: str
+    lineno: int
+    funcname: str
+
+
+def is_file_line(symbol: str) -> bool:
+    filename, _, line = symbol.rpartition(":")
+    return bool(filename) and line.isdigit()
+
+
+def is_python_source(symbol: str) -> bool:
+    return symbol.rpartition(":")[0].endswith(PYTHON_SOURCES)
+
+
+def function_location(value: Any) -> Optional[Location]:
+    func = getattr(value, "__func__", value)  # methods, classmethods
+    if not isinstance(func, types.FunctionType):
+        return None
+    code = func.__code__
+    if os.path.dirname(os.path.abspath(code.co_filename)) == SRC:
+        return None
+    return Location(
+        func.__qualname__, code.co_filename, code.co_firstlineno, code.co_name
+    )
+
+
+class ImportRecorder:
+    """
+    First finder on sys.meta_path, notes the name of every module that
+    gets imported and leaves finding it to the others. Costs an append
+    per import, the module is indexed once somebody looks a name up.
+    """
+
+    def __init__(self, imported: list[str]):
+        self.imported = imported
+
+    def find_spec(self, name, path=None, target=None):
+        self.imported.append(name)
+        return None
+
+
+class PythonSymbolIndex:
+    """
+    Qualified names of the Python functions of every imported module, by
+    qualname and by module.qualname. Modules are indexed when a name is
+    first looked up after they were imported, each only once, except
+    __main__ which fills up as the script runs. Sources added with
+    add_source are indexed from their text, before any of them ran.
+    Functions of the script shadow those of the modules it imports.
+
+    Looked up by pdb and by the controller reader thread, hence the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names: dict[str, list[Location]] = {}
+        # imported since the last lookup, sys.modules to begin with
+        self.pending: list[str] = list(sys.modules)
+        self.recorder = ImportRecorder(self.pending)
+        sys.meta_path.insert(0, self.recorder)
+
+    def close(self) -> None:
+        if self.recorder in sys.meta_path:
+            sys.meta_path.remove(self.recorder)
+
+    def lookup(self, name: str) -> list[Location]:
+        with self.lock:
+            self._index_pending()
+            locations = self._main_locations(name)
+            for location in self.names.get("__main__." + name, ()):
+                if location not in locations:
+                    locations.append(location)
+            if not locations:
+                locations = list(self.names.get(name, ()))
+            if not locations:
+                location = self._resolve(name)
+                if location is not None:
+                    locations.append(location)
+            return locations
+
+    def add_source(self, filename: str, module_name: str = "__main__") -> None:
+        filename = os.path.realpath(filename)
+        try:
+            with tokenize.open(filename) as f:
+                tree = ast.parse(f.read(), filename)
+        except (OSError, SyntaxError, ValueError):
+            return
+
+        def visit(body: list[ast.stmt], prefix: str) -> None:
+            for node in body:
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    # code objects of decorated functions start at the decorator
+                    lineno = min(
+                        [node.lineno] + [d.lineno for d in node.decorator_list]
+                    )
+                    location = Location(prefix + node.name, filename, lineno, node.name)
+                    self._add(module_name, location)
+                elif isinstance(node, ast.ClassDef):
+                    visit(node.body, prefix + node.name + ".")
+
+        with self.lock:
+            visit(tree.body, "")
+
+    def _add(self, module_name: str, location: Location) -> None:
+        for key in (location.qualname, f"{module_name}.{location.qualname}"):
+            locations = self.names.setdefault(key, [])
+            if location not in locations:
+                locations.append(location)
+
+    def _index_pending(self) -> None:
+        still_importing = []
+        while self.pending:
+            name = self.pending.pop()
+            module = sys.modules.get(name)
+            if module is None or name == "__main__" or name in DEBUGGER_MODULES:
+                continue  # failed to import, or looked at on every lookup
+            spec = getattr(module, "__spec__", None)
+            if getattr(spec, "_initializing", False):
+                still_importing.append(name)
+                continue
+            for location in self._module_locations(name, module):
+                self._add(name, location)
+        self.pending.extend(still_importing)
+
+    @staticmethod
+    def _module_locations(name: str, module: types.ModuleType) -> list[Location]:
+        try:
+            values = list(vars(module).values())
+        except TypeError:
+            return []
+
+        locations = []
+        for value in values:
+            if getattr(value, "__module__", None) != name:
+                continue  # imported from elsewhere, indexed there
+            if isinstance(value, type):
+                try:
+                    members = list(vars(value).values())
+                except TypeError:
+                    continue
+                locations.extend(filter(None, map(function_location, members)))
+            else:
+                location = function_location(value)
+                if location is not None:
+                    locations.append(location)
+        return locations
+
+    def _main_locations(self, name: str) -> list[Location]:
+        module = sys.modules.get("__main__")
+        if module is None:
+            return []
+        return [
+            location
+            for location in self._module_locations("__main__", module)
+            if location.qualname == name
+        ]
+
+    @staticmethod
+    def _resolve(name: str) -> Optional[Location]:
+        # a dotted path through modules or the globals of __main__, read
+        # statically so that looking up never runs code of the program
+        parts = name.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            module = sys.modules.get(".".join(parts[:i]))
+            if module is not None:
+                value, rest = module, parts[i:]
+                break
+        else:
+            value, rest = sys.modules.get("__main__"), parts
+
+        for part in rest:
+            try:
+                value = vars(value)[part]
+            except (TypeError, KeyError):
+                return None
+        return function_location(value)
@@ -0,0 +1,341 @@
+"""
+Reads trace logs recorded with `main.py --record=<log>`.
+
+    tracelog.py <log> summary
+    tracelog.py <log> calls <function>
+    tracelog.py <log> exception [<n> | <type>]
+
+The log is a header followed by fixed size records in the byte order of the
+recording machine (little endian on everything pxc runs on):
+
+    header  magic "PXCTRACE", u32 version, u32 record size, u64 start (ns), u64
+    record  u8 kind, u8 flags, u16 depth, u32 func, u32 file, u32 line,
+            u64 timestamp (ns), u64 arg
+
+func and file are ids of strings in <log>.strings, a sequence of u32 length
+and utf-8 bytes; id 0 is the empty string. depth counts the Python frames
+entered since recording started, a C event has the depth of its caller.
+arg is the caller's line of a CALL, the exception type name of an
+EXCEPTION and the function address of a C event.
+
+The log is mapped, records are only decoded when looked at and the index
+is built by the first query that needs it.
+"""
+
+import re
+import sys
+import mmap
+import bisect
+import struct
+import functools
+from array import array
+from typing import Iterator, NamedTuple, Optional
+
+MAGIC = b"PXCTRACE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+RECORD = struct.Struct("<BBHIIIQQ")
+STRING_LENGTH = struct.Struct("<I")
+
+CALL = 1
+RETURN = 2
+LINE = 3
+EXCEPTION = 4
+C_CALL = 5
+C_RETURN = 6
+C_EXCEPTION = 7
+
+KIND_NAMES = {
+    CALL: "call",
+    RETURN: "return",
+    LINE: "line",
+    EXCEPTION: "exception",
+    C_CALL: "c_call",
+    C_RETURN: "c_return",
+    C_EXCEPTION: "c_exception",
+}
+C_KINDS = (C_CALL, C_RETURN, C_EXCEPTION)
+
+
+class TraceLogError(Exception):
+    pass
+
+
+class Record(NamedTuple):
+    index: int
+    kind: int
+    depth: int
+    func: str
+    file: str
+    line: int
+    timestamp: int
+    arg: int
+
+
+class Frame(NamedTuple):
+    func: str
+    file: str
+    line: int
+
+
+class Index:
+    def __init__(self):
+        # func id -> positions of its CALL and C_CALL records
+        self.calls: dict[int, array] = {}
+        # depth -> positions of the CALL records entering it
+        self.calls_by_depth: dict[int, array] = {}
+        # positions of EXCEPTION and C_EXCEPTION records
+        self.exceptions = array("Q")
+
+
+class TraceLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.memory = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise TraceLogError(f"{path} is empty") from None
+
+        magic, version, record_size, self.start, _ = HEADER.unpack_from(self.memory)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise TraceLogError(f"{path} is not a version {VERSION} trace log")
+        # a record cut short by a crash is ignored
+        self.count = (len(self.memory) - HEADER.size) // RECORD.size
+
+    def __enter__(self) -> "TraceLog":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.memory.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Record:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        kind, _, depth, func, file, line, timestamp, arg = RECORD.unpack_from(
+            self.memory, HEADER.size + index * RECORD.size
+        )
+        strings = self.strings
+        return Record(
+            index, kind, depth, strings[func], strings[file], line, timestamp, arg
+        )
+
+    @functools.cached_property
+    def strings(self) -> list[str]:
+        with open(self.path + ".strings", "rb") as f:
+            data = f.read()
+        strings = []
+        offset = 0
+        while offset + STRING_LENGTH.size <= len(data):
+            (length,) = STRING_LENGTH.unpack_from(data, offset)
+            offset += STRING_LENGTH.size
+            strings.append(data[offset : offset + length].decode(errors="replace"))
+            offset += length
+        return strings
+
+    @functools.cached_property
+    def kinds(self) -> bytes:
+        with memoryview(self.memory) as view:
+            return bytes(view[HEADER.size :: RECORD.size][: self.count])
+
+    def positions(self, kind: int) -> Iterator[int]:
+        # scanning the column of kinds is much faster than decoding records
+        for match in re.finditer(re.escape(bytes([kind])), self.kinds):
+            yield match.start()
+
+    @functools.cached_property
+    def index(self) -> Index:
+        index = Index()
+        end = HEADER.size + self.count * RECORD.size
+        with memoryview(self.memory) as view, view[HEADER.size : end] as records:
+            with records.cast("H") as halves, records.cast("I") as words:
+                depths = halves[1 :: RECORD.size // 2]
+                funcs = words[1 :: RECORD.size // 4]
+
+                calls: dict[int, list[int]] = {}
+                for kind in (CALL, C_CALL):
+                    for position in self.positions(kind):
+                        calls.setdefault(funcs[position], []).append(position)
+                index.calls = {
+                    func: array("Q", sorted(positions))
+                    for func, positions in calls.items()
+                }
+
+                by_depth: dict[int, array] = {}
+                for position in self.positions(CALL):
+                    depth = depths[position]
+                    if depth not in by_depth:
+                        by_depth[depth] = array("Q")
+                    by_depth[depth].append(position)
+                index.calls_by_depth = by_depth
+
+                depths.release()
+                funcs.release()
+
+        exceptions = list(self.positions(EXCEPTION))
+        exceptions.extend(self.positions(C_EXCEPTION))
+        index.exceptions = array("Q", sorted(exceptions))
+        return index
+
+    def function_ids(self, name: str) -> list[int]:
+        """
+        Ids of the functions called `name`, either the qualified name or
+        its last components, e.g. `norm` or `Vector.norm`.
+        """
+
+        suffix = "." + name
+        return [
+            func
+            for func, string in enumerate(self.strings)
+            if string == name or string.endswith(suffix)
+        ]
+
+    def calls(self, name: str) -> list[Record]:
+        positions: list[int] = []
+        for func in self.function_ids(name):
+            positions.extend(self.index.calls.get(func, ()))
+        return [self[position] for position in sorted(positions)]
+
+    def exceptions(self) -> list[Record]:
+        return [self[position] for position in self.index.exceptions]
+
+    def enclosing_call(self, depth: int, position: int) -> Optional[Record]:
+        """
+        The CALL record of the frame at `depth` that was running at
+        `position`, None if it was entered before recording started.
+        """
+
+        calls = self.index.calls_by_depth.get(depth)
+        if not calls:
+            return None
+        i = bisect.bisect_right(calls, position) - 1
+        return self[calls[i]] if i >= 0 else None
+
+    def stack(self, record: Record) -> list[Frame]:
+        """
+        The Python stack at a record, outermost frame first, and the C
+        function for C events.
+        """
+
+        frames = []
+        if record.kind in C_KINDS:
+            frames.append(Frame(record.func, "", 0))
+
+        line, position = record.line, record.index
+        for depth in range(record.depth, 0, -1):
+            call = self.enclosing_call(depth, position)
+            if call is None:
+                break
+            frames.append(Frame(call.func, call.file, line))
+            line, position = call.arg, call.index
+        frames.reverse()
+        return frames
+
+    def caller(self, record: Record) -> Optional[Frame]:
+        # a Python call is made from the frame below it, a C call from its own
+        if record.kind in C_KINDS:
+            depth, line = record.depth, record.line
+        else:
+            depth, line = record.depth - 1, record.arg
+        call = self.enclosing_call(depth, record.index) if depth > 0 else None
+        return Frame(call.func, call.file, line) if call else None
+
+    def exception_name(self, record: Record) -> str:
+        if record.kind == EXCEPTION:
+            return self.strings[record.arg]
+        return record.func  # the C function that raised
+
+    def seconds(self, record: Record) -> float:
+        return (record.timestamp - self.start) / 1e9
+
+
+def format_frame(frame: Frame) -> str:
+    if not frame.file:
+        return f"  [C] {frame.func}"
+    return f'  File "{frame.file}", line {frame.line}, in {frame.func}'
+
+
+def summary(log: TraceLog) -> None:
+    duration = log.seconds(log[len(log) - 1]) if len(log) else 0.0
+    print(f"{len(log)} records over {duration:.6f} seconds")
+    for kind, name in KIND_NAMES.items():
+        print(f"{log.kinds.count(kind):>12} {name}")
+
+
+def show_calls(log: TraceLog, name: str) -> None:
+    calls = log.calls(name)
+    for record in calls:
+        caller = log.caller(record)
+        where = f" from {caller.func} ({caller.file}:{caller.line})" if caller else ""
+        print(f"#{record.index} +{log.seconds(record):.6f}s {record.func}{where}")
+    print(f"{len(calls)} calls")
+
+
+def show_exception(log: TraceLog, which: Optional[str]) -> None:
+    exceptions = log.exceptions()
+    if which is None:
+        candidates = exceptions[-1:]
+    elif which.lstrip("-").isdigit():
+        try:
+            candidates = [exceptions[int(which)]]
+        except IndexError:
+            candidates = []
+    else:
+        suffix = "." + which
+        candidates = [
+            record
+            for record in exceptions
+            if record.kind == EXCEPTION
+            and (
+                log.exception_name(record) == which
+                or log.exception_name(record).endswith(suffix)
+            )
+        ][:1]
+    if not candidates:
+        print("No such exception recorded")
+        return
+
+    record = candidates[0]
+    print(
+        f"Path to #{record.index} ({log.exception_name(record)}) "
+        f"at +{log.seconds(record):.6f}s:"
+    )
+    for frame in log.stack(record):
+        print(format_frame(frame))
+
+
+def main() -> None:
+    if len(sys.argv) < 3:
+        print(__doc__.split("\n\n")[1], file=sys.stderr)
+        sys.exit(2)
+
+    path, command, *args = sys.argv[1:]
+    try:
+        log = TraceLog(path)
+    except (OSError, TraceLogError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    with log:
+        if command == "summary":
+            summary(log)
+        elif command == "calls" and len(args) == 1:
+            show_calls(log, args[0])
+        elif command == "exception" and len(args) <= 1:
+            show_exception(log, args[0] if args else None)
+        else:
+            print(__doc__.split("\n\n")[1], file=sys.stderr)
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
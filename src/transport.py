@@ -0,0 +1,368 @@
+"""
+Connections between the controller and the debuggee: TCP or Unix sockets,
+or two rings in shared memory (PXC_TRANSPORT=shm).
+
+The rings are plain Python over an mmap, there are no atomics or memory
+fences. They rely on the following, which holds on x86-64 but which nothing
+enforces:
+
+- Stores to the shared memory become visible to the other process in the
+  order they were made, so a consumer that sees `head` move also sees the
+  data written before it. A weakly ordered CPU (ARM, POWER) does not
+  guarantee that. There, a consumer can read stale bytes, so use a socket
+  transport.
+- The 8 byte `head` and `tail` are read and written whole. They are
+  aligned, and struct copies them with a single move.
+
+Even on x86-64 a store can be overtaken by a later load. The consumer sets
+`waiting` and then reads `head`, while the producer moves `head` and then
+reads `waiting`. Both can see the old value, and then the doorbell is not
+rung. The consumer only finds the data after WAKEUP_TIMEOUT, so a lost
+wakeup costs up to that long, not a hang.
+
+A producer facing a full ring has no doorbell to wait on. It polls every
+FULL_RING_POLL seconds until the consumer makes room, so each stall adds
+up to that much latency. The ring is sized so that this only happens when
+the consumer falls far behind.
+"""
+
+import os
+import mmap
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import time
+from typing import Optional, Protocol
+
+# Selects how the debuggee talks to the controller, "tcp", "unix" or "shm".
+TRANSPORT = os.getenv("PXC_TRANSPORT", "tcp")
+# every session has an endpoint of its own, a launched debuggee finds its
+# address (see endpoint_address) in this variable
+ENDPOINT_ENV = "PXC_ENDPOINT"
+
+HOST = "127.0.0.1"
+UNIX_SOCKET = "socket"
+
+RING_CAPACITY = 1024 * 1024
+# how long a consumer sleeps before looking at an idle ring again,
+# only matters if a wakeup is lost (see the module docstring)
+WAKEUP_TIMEOUT = 0.1
+# how often a producer looks at a full ring again
+FULL_RING_POLL = 0.0001
+
+
+class Transport(Protocol):
+    def sendall(self, data) -> None: ...
+
+    def recv_into(self, buffer: memoryview, nbytes: int, flags: int) -> int: ...
+
+    def fileno(self) -> int: ...
+
+    def shutdown(self, how: int) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class Ring:
+    """
+    Single producer / single consumer byte ring in shared memory.
+
+    `head` and `tail` count all bytes ever written and read, only the
+    producer writes `head` and only the consumer writes `tail`. A consumer
+    that runs out of data sets `waiting` and blocks on its doorbell FIFO,
+    the producer only rings the doorbell when it sees that flag, so a busy
+    consumer costs the producer no syscalls.
+
+    The consumer also leaves its pid, and `reader_closed` once it is done,
+    so that a producer waiting for room finds out when nobody will read.
+    """
+
+    HEAD = 0
+    TAIL = 64
+    WAITING = 128
+    CLOSED = 132
+    READER_CLOSED = 136
+    READER = 140
+    SIZE = 192
+
+    U64 = struct.Struct("<Q")
+    U32 = struct.Struct("<I")
+
+    def __init__(self, memory: mmap.mmap, offset: int, capacity: int, doorbell: str):
+        self.memory = memory
+        self.offset = offset
+        self.data = offset + Ring.SIZE
+        self.capacity = capacity
+        # O_RDWR so opening never blocks waiting for the other end
+        self.doorbell = os.open(doorbell, os.O_RDWR | os.O_NONBLOCK)
+
+    def _get(self, field: int, fmt: struct.Struct) -> int:
+        return fmt.unpack_from(self.memory, self.offset + field)[0]
+
+    def _set(self, field: int, fmt: struct.Struct, value: int) -> None:
+        fmt.pack_into(self.memory, self.offset + field, value)
+
+    def close(self) -> None:
+        self._set(Ring.CLOSED, Ring.U32, 1)
+        self.ring()
+
+    def attach_reader(self) -> None:
+        self._set(Ring.READER, Ring.U32, os.getpid())
+
+    def close_reader(self) -> None:
+        self._set(Ring.READER_CLOSED, Ring.U32, 1)
+
+    def reader_gone(self) -> bool:
+        if self._get(Ring.READER_CLOSED, Ring.U32):
+            return True
+        pid = self._get(Ring.READER, Ring.U32)
+        if not pid:
+            return False  # not connected yet
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def ring(self) -> None:
+        try:
+            os.write(self.doorbell, b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+    def drain_doorbell(self) -> None:
+        try:
+            os.read(self.doorbell, 4096)
+        except BlockingIOError:
+            pass
+
+    def write(self, data) -> None:
+        data = memoryview(data).cast("B")
+        while data:
+            head = self._get(Ring.HEAD, Ring.U64)
+            free = self.capacity - (head - self._get(Ring.TAIL, Ring.U64))
+            if not free:
+                # the consumer is behind, give it time to catch up unless
+                # it will never read again, which a socket would report too
+                if self.reader_gone():
+                    raise BrokenPipeError("The reader of the ring is gone")
+                time.sleep(FULL_RING_POLL)
+                continue
+
+            size = min(free, len(data))
+            start = head % self.capacity
+            first = min(size, self.capacity - start)
+            self.memory[self.data + start : self.data + start + first] = data[:first]
+            if first < size:
+                self.memory[self.data : self.data + size - first] = data[first:size]
+
+            # data has to be visible before head moves, which only the
+            # store order of the CPU ensures
+            self._set(Ring.HEAD, Ring.U64, head + size)
+            data = data[size:]
+
+            if self._get(Ring.WAITING, Ring.U32):
+                self.ring()
+
+    def read_into(
+        self, buffer: memoryview, closed: bool = False, blocking: bool = True
+    ) -> int:
+        while True:
+            tail = self._get(Ring.TAIL, Ring.U64)
+            available = self._get(Ring.HEAD, Ring.U64) - tail
+            if available:
+                break
+            if closed or self._get(Ring.CLOSED, Ring.U32):
+                return 0
+
+            # may be read before waiting is set, see WAKEUP_TIMEOUT
+            self._set(Ring.WAITING, Ring.U32, 1)
+            if self._get(Ring.HEAD, Ring.U64) == tail:
+                if not blocking:
+                    # stays waiting, the doorbell tells the caller's selector
+                    self.drain_doorbell()
+                    if self._get(Ring.HEAD, Ring.U64) == tail:
+                        raise BlockingIOError
+                    continue
+                select.select([self.doorbell], [], [], WAKEUP_TIMEOUT)
+                self.drain_doorbell()
+
+        # busy again, the producer can stop ringing
+        self._set(Ring.WAITING, Ring.U32, 0)
+
+        size = min(available, len(buffer))
+        start = tail % self.capacity
+        first = min(size, self.capacity - start)
+        buffer[:first] = self.memory[self.data + start : self.data + start + first]
+        if first < size:
+            buffer[first:size] = self.memory[self.data : self.data + size - first]
+
+        self._set(Ring.TAIL, Ring.U64, tail + size)
+        return size
+
+
+class SharedMemoryTransport:
+    """
+    Two rings in a file mapped by both processes, one per direction.
+    The directory holding the file and the doorbells is the endpoint.
+    """
+
+    FILE = "rings"
+
+    def __init__(self, path: str, controller: bool, capacity: int = RING_CAPACITY):
+        self.path = path
+        self.controller = controller
+        self.closed = False
+
+        # the controller creates everything before the debuggee is launched
+        size = 2 * (Ring.SIZE + capacity)
+        file = os.path.join(path, SharedMemoryTransport.FILE)
+        if controller:
+            with open(file, "wb") as f:
+                f.truncate(size)
+            os.mkfifo(os.path.join(path, "to_controller"))
+            os.mkfifo(os.path.join(path, "to_debuggee"))
+        else:
+            size = os.path.getsize(file)
+            capacity = size // 2 - Ring.SIZE
+
+        with open(file, "r+b") as f:
+            self.memory = mmap.mmap(f.fileno(), size)
+
+        to_controller = Ring(
+            self.memory, 0, capacity, os.path.join(path, "to_controller")
+        )
+        to_debuggee = Ring(
+            self.memory,
+            Ring.SIZE + capacity,
+            capacity,
+            os.path.join(path, "to_debuggee"),
+        )
+        if controller:
+            self.incoming, self.outgoing = to_controller, to_debuggee
+        else:
+            self.incoming, self.outgoing = to_debuggee, to_controller
+        self.incoming.attach_reader()
+
+    def __enter__(self) -> "SharedMemoryTransport":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def sendall(self, data) -> None:
+        self.outgoing.write(data)
+
+    def recv_into(self, buffer: memoryview, nbytes: int = 0, flags: int = 0) -> int:
+        # same signature as socket, MSG_DONTWAIT makes a single call non blocking
+        if nbytes:
+            buffer = buffer[:nbytes]
+        return self.incoming.read_into(
+            buffer, self.closed, not flags & socket.MSG_DONTWAIT
+        )
+
+    def fileno(self) -> int:
+        return self.incoming.doorbell
+
+    def shutdown(self, how: int = socket.SHUT_RDWR) -> None:
+        # wakes up a reader blocked in recv_into, same signature as socket
+        self.closed = True
+        self.incoming.ring()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.shutdown()
+        self.outgoing.close()
+        self.incoming.close_reader()
+        os.close(self.incoming.doorbell)
+        os.close(self.outgoing.doorbell)
+        self.memory.close()
+        if self.controller:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _shm_dir() -> Optional[str]:
+    # keep the rings in memory when possible
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def controller_listen() -> socket.socket | SharedMemoryTransport:
+    """
+    Prepares a new endpoint before the debuggee is launched, on an
+    ephemeral port or in a temporary directory so that any number of
+    sessions can run side by side.
+    Returns the listening socket or the already usable shared memory.
+    """
+
+    if TRANSPORT == "shm":
+        path = tempfile.mkdtemp(prefix="pxc-", dir=_shm_dir())
+        return SharedMemoryTransport(path, controller=True)
+
+    if TRANSPORT == "unix":
+        s = socket.socket(socket.AF_UNIX)
+        s.bind(os.path.join(tempfile.mkdtemp(prefix="pxc-"), UNIX_SOCKET))
+    else:
+        s = socket.socket()
+        s.bind((HOST, 0))
+    s.listen(1)
+    return s
+
+
+def controller_accept(endpoint: socket.socket | SharedMemoryTransport) -> Transport:
+    if isinstance(endpoint, SharedMemoryTransport):
+        return endpoint
+
+    conn, addr = endpoint.accept()
+    if conn.family == socket.AF_INET:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return conn
+
+
+def controller_close(endpoint: socket.socket | SharedMemoryTransport) -> None:
+    # the shared memory is the connection, it is closed with the channel
+    if isinstance(endpoint, SharedMemoryTransport):
+        return
+
+    if endpoint.family == socket.AF_UNIX:
+        path = endpoint.getsockname()
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    endpoint.close()
+
+
+def endpoint_address(endpoint: socket.socket | SharedMemoryTransport) -> str:
+    """
+    Where the debuggee connects to: "tcp:<host>:<port>", "unix:<path>" or
+    "shm:<directory>", see debuggee_connect.
+    """
+
+    if isinstance(endpoint, SharedMemoryTransport):
+        return f"shm:{endpoint.path}"
+    if endpoint.family == socket.AF_UNIX:
+        return f"unix:{endpoint.getsockname()}"
+    host, port = endpoint.getsockname()
+    return f"tcp:{host}:{port}"
+
+
+def debuggee_connect(address: Optional[str] = None) -> Transport:
+    # a launched debuggee finds the endpoint in its environment
+    if address is None:
+        address = os.environ[ENDPOINT_ENV]
+
+    kind, _, where = address.partition(":")
+    if kind == "shm":
+        return SharedMemoryTransport(where, controller=False)
+
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX)
+        sock.connect(where)
+        return sock
+
+    host, _, port = where.rpartition(":")
+    sock = socket.socket()
+    sock.connect((host, int(port)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
@@ -4,20 +4,32 @@ from typing import Optional, Any
 from multiprocessing import Process, Pipe
 from multiprocessing.connection import Connection
 from LLDBHost import LLDBHost
+from IOManager import IOManager
+
+
+read_buffer = bytearray(64 * 1024)
 
 
 def readfd(fd: int, blocking: bool = False) -> Optional[str]:
-    block = True
-    while block:
+    # only a non-blocking fd is drained, a blocking one would wait for its
+    # writer to close it
+    drain = not os.get_blocking(fd)
+    while True:
+        # everything available into one string, reusing the buffer
+        data = bytearray()
         try:
-            data = os.read(fd, 1024 * 1024 * 10)  # read 10MBs at a time
-            if data:
-                string = data.decode("utf-8")
-                return string
+            while size := os.readv(fd, [read_buffer]):
+                data += read_buffer[:size]
+                if not drain:
+                    break
         except BlockingIOError:
-            block = blocking
-            if block:
-                time.sleep(0.1)
+            pass
+
+        if data:
+            return data.decode("utf-8")
+        if not blocking:
+            return None
+        time.sleep(0.1)
 
 
 class Terminate:
@@ -27,11 +39,12 @@ class Terminate:
 class LLDBProcessWrapper:
     @staticmethod
     def run(pid: int, pipe: Connection):
-        instance = LLDBHost(pid)
+        instance = LLDBHost(None, IOManager(), pid=pid)
         while True:
             command = pipe.recv()
             if isinstance(command, Terminate):
-                instance.stop_events_handler()
+                # detaches, the process keeps running
+                instance.stop()
                 exit(0)
             output, result = instance.execute(command)
             pipe.send((output, result))
@@ -0,0 +1,154 @@
+import pytest
+
+pytest.importorskip("lldb")
+
+from pxc import PXC, BREAKPOINT_USAGE
+
+
+class NativeBreakpoint:
+    def __init__(self, breakpoint_id):
+        self.id = breakpoint_id
+        self.condition, self.ignore_count, self.enabled = None, 0, True
+
+    def GetID(self):
+        return self.id
+
+    def GetNumLocations(self):
+        return 1
+
+    def GetHitCount(self):
+        return 0
+
+    def SetCondition(self, condition):
+        self.condition = condition
+
+    def SetIgnoreCount(self, count):
+        self.ignore_count = count
+
+    def SetEnabled(self, enabled):
+        self.enabled = enabled
+
+
+class Breakpoints:
+    def __init__(self):
+        self.native = {}
+
+    def by_symbol(self, symbol, modules=None):
+        native = NativeBreakpoint(len(self.native) + 1)
+        self.native[native.id] = native
+        return native
+
+    def get(self, breakpoint_id):
+        return self.native.get(breakpoint_id)
+
+    def delete(self, ids):
+        for breakpoint_id in ids:
+            del self.native[breakpoint_id]
+
+
+class Symbols:
+    def lookup(self, symbol):
+        return ["libnative.so"] if symbol.startswith("native_") else []
+
+
+class Host:
+    def __init__(self):
+        self.breakpoints = Breakpoints()
+        self.symbols = Symbols()
+
+    def is_stopped(self):
+        return False
+
+
+class Output:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data, prompt=True):
+        self.lines.append(data)
+
+
+@pytest.fixture
+def pxc():
+    return PXC(Host(), Output())
+
+
+def test_arguments(pxc):
+    pxc.set_breakpoint("native_add")
+    output = pxc.io_manager.lines
+    output.clear()
+
+    for action in ("cond", "cond x", "ignore 2 3", "enable one", "delete"):
+        pxc.process_breakpoints(action)
+    assert output == [f"No breakpoint {i}" for i in ("", "x", "2", "one", "")]
+
+    output.clear()
+    pxc.process_breakpoints("ignore 1")
+    pxc.process_breakpoints("ignore 1 -2")
+    pxc.process_breakpoints("break 1")
+    assert output == [
+        "Usage: br ignore <id> <count>",
+        "Usage: br ignore <id> <count>",
+        BREAKPOINT_USAGE,
+    ]
+    assert pxc.breakpoints[1].ignore_count == 0
+
+
+def test_state(pxc):
+    breakpoint = pxc.set_breakpoint("native_add")
+    native = pxc.lldb_host.breakpoints.get(breakpoint.lldb_id)
+    queued = pxc.python_command_queue
+    queued.clear()
+
+    pxc.process_breakpoints("cond 1  n > 10 ")
+    pxc.process_breakpoints("ignore 1 3")
+    pxc.process_breakpoints("disable 1")
+    assert (breakpoint.condition, breakpoint.ignore_count) == ("n > 10", 3)
+    assert not breakpoint.enabled
+    # both engines hear of every change
+    assert (native.condition, native.ignore_count, native.enabled) == (
+        "n > 10",
+        3,
+        False,
+    )
+    assert queued == ["pxcondition 1 n > 10", "pxignore 1 3", "pxdisable 1"]
+
+    pxc.io_manager.lines.clear()
+    pxc.process_breakpoints("list")
+    assert pxc.io_manager.lines == [
+        "1: native_add (disabled) if n > 10, ignore next 3, native hits 0"
+    ]
+
+    pxc.process_breakpoints("enable 1")
+    pxc.process_breakpoints("cond 1")
+    assert breakpoint.enabled and native.enabled
+    assert breakpoint.condition is None and native.condition == ""
+
+    pxc.process_breakpoints("delete 1")
+    assert not pxc.breakpoints
+    assert pxc.lldb_host.breakpoints.get(breakpoint.lldb_id) is None
+    assert queued[-1] == "pxclear 1"
+
+
+def test_condition_propagation(pxc):
+    # pdb sets its breakpoints once the debuggee connects, with the state
+    # given to the breakpoint in the meantime
+    breakpoint = pxc.set_breakpoint("script.py:3")
+    pxc.process_breakpoints("cond 1 x")
+    pxc.process_breakpoints("disable 1")
+    pxc.python_command_queue.clear()
+    pxc.set_python_breakpoint(breakpoint)
+    assert pxc.python_command_queue == [
+        "pxbreak 1 script.py:3",
+        "pxcondition 1 x",
+        "pxdisable 1",
+    ]
+    assert breakpoint.lldb_id is None
+
+    # lldb gets it once its symbol is found
+    breakpoint = pxc.set_breakpoint("helper")
+    pxc.process_breakpoints("cond 2 y")
+    pxc.process_breakpoints("ignore 2 1")
+    pxc.set_native_breakpoint(breakpoint)
+    native = pxc.lldb_host.breakpoints.get(breakpoint.lldb_id)
+    assert (native.condition, native.ignore_count) == ("y", 1)
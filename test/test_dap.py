@@ -0,0 +1,27 @@
+import pytest
+
+import dap
+
+
+def test_messages():
+    first = {"seq": 1, "type": "request", "command": "initialize"}
+    second = {"seq": 2, "type": "request", "command": "threads", "arguments": {}}
+    data = dap.encode(first) + dap.encode(second)
+    assert data.startswith(b"Content-Length: ")
+
+    # a message split anywhere comes out once complete, several in one read
+    reader = dap.MessageReader()
+    assert reader.feed(data[:10]) == []
+    assert reader.feed(data[10:30]) == []
+    assert reader.feed(data[30:]) == [first, second]
+    assert reader.feed(b"") == []
+
+
+def test_headers():
+    reader = dap.MessageReader()
+    body = b'{"seq":1}'
+    header = b"Content-Type: application/json\r\ncontent-length: %d\r\n\r\n" % len(body)
+    assert reader.feed(header + body) == [{"seq": 1}]
+
+    with pytest.raises(dap.DAPError):
+        reader.feed(b"Content-Type: application/json\r\n\r\n{}")
@@ -0,0 +1,60 @@
+import time
+import weakref
+
+import pytest
+
+pxc_extension = pytest.importorskip("pxc_extension")
+
+
+def resolve(func) -> int:
+    return pxc_extension.resolve_location(func.__name__, func)
+
+
+@pytest.mark.parametrize(
+    "unbound, bound",
+    [
+        (list.append, [].append),
+        (dict.get, {}.get),
+        (str.join, "".join),
+        # classmethod descriptor, bound to the type when looked up on it
+        (vars(dict)["fromkeys"], dict.fromkeys),
+    ],
+)
+def test_method_descriptors(unbound, bound):
+    pxc_extension.clear_location_cache()
+    # an unbound method calls the same C function as a bound one, not the
+    # trampoline of its calling convention
+    address = resolve(bound)
+    assert address and resolve(unbound) == address
+    assert resolve(unbound) == address
+    # read from the method definition, a bound method is not kept track of
+    assert weakref.getweakrefcount(bound) == 0
+
+
+def test_cache():
+    pxc_extension.clear_location_cache()
+    assert resolve(len) == resolve(len) != resolve(sorted)
+    assert resolve(list.append) != resolve(list.pop)
+    # other C callables resolve to their vectorcall
+    assert resolve(list) == resolve(list) != 0
+    # not C functions
+    assert resolve(test_cache) == 0
+    assert pxc_extension.resolve_location("obj", object()) == 0
+
+
+def test_profile_timestamps():
+    timestamps = {}
+
+    def profiled(event, name, addr, timestamp):
+        if name == "len":
+            timestamps[event] = timestamp
+        time.sleep(0.01)  # work of the hook, not of the function
+
+    pxc_extension.start_profile(lambda *args: None)
+    pxc_extension.set_profiling(profiled)
+    try:
+        len("")
+    finally:
+        pxc_extension.set_profiling(None)
+        pxc_extension.stop_profile()
+    assert 0 <= timestamps["c_return"] - timestamps["c_call"] < 5_000_000
@@ -0,0 +1,113 @@
+import pytest
+
+import inspection
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+def test_paging():
+    numbers = list(range(250))
+    page = inspection.children(numbers, start=100)
+    assert len(page) == inspection.PAGE_SIZE
+    assert (page[0]["name"], page[0]["repr"]) == ("100", "100")
+    assert [c["name"] for c in inspection.children(numbers, 240, 20)] == [
+        str(i) for i in range(240, 250)
+    ]
+
+    mapping = {f"k{i}": i for i in range(10)}
+    assert [c["name"] for c in inspection.children(mapping, 8, 5)] == [
+        "'k8'",
+        "'k9'",
+    ]
+    assert [c["name"] for c in inspection.children(Point(1, 2), 1)] == ["y"]
+
+
+def test_truncation():
+    summary = inspection.summarize("s", "x" * 1000, budget=20)
+    assert len(summary["repr"]) <= 20 and "..." in summary["repr"]
+    assert (summary["length"], summary["children"]) == (1000, False)
+
+    summary = inspection.summarize("p", Point(1, 2))
+    assert (summary["type"], summary["children"]) == ("Point", True)
+    assert "length" not in summary
+
+
+def test_child():
+    key = "k" * 50
+    mapping = {key: 1, 2: "two"}
+    # keys are looked up as the listing named them, whatever its budget
+    listed, _ = inspection.children(mapping, budget=20)
+    assert "..." in listed["name"]
+    assert inspection.child(mapping, listed["name"], budget=20) == 1
+    assert inspection.child(mapping, key) == 1
+    assert inspection.child(mapping, "2") == "two"
+    with pytest.raises(inspection.InspectionError):
+        inspection.child(mapping, listed["name"])
+
+    assert inspection.child(["a", "b"], "1") == "b"
+    assert inspection.child(Point(1, 2), "y") == 2
+    for value, key in ((["a"], "1"), (["a"], "x"), (Point(1, 2), "z")):
+        with pytest.raises(inspection.InspectionError):
+            inspection.child(value, key)
+
+    local_vars = {"points": [Point(1, {"z": 3})]}
+    assert inspection.resolve(local_vars, ["points", "0", "y", "'z'"]) == 3
+
+
+def test_inspector():
+    inspector = inspection.Inspector()
+    local_vars = {"numbers": [1, 2, 3], "_hidden": 0}
+
+    reply = inspector.inspect(1, local_vars, {})
+    assert reply["length"] == 1
+    assert [c["name"] for c in reply["children"]] == ["numbers"]
+
+    request = {"path": ["numbers"], "start": 1, "count": 1}
+    reply = inspector.inspect(1, local_vars, request)
+    assert reply["value"]["length"] == 3
+    assert [c["repr"] for c in reply["children"]] == ["2"]
+
+    # answered from the cache until the program runs
+    local_vars["numbers"].append(4)
+    assert inspector.inspect(1, local_vars, request) is reply
+    inspector.invalidate()
+    assert inspector.inspect(1, local_vars, request)["value"]["length"] == 4
+
+    assert "error" in inspector.inspect(1, local_vars, {"path": ["missing"]})
+    assert "error" in inspector.inspect(2, None, {})
+
+
+class Sized(list):
+    def __len__(self):
+        raise RuntimeError("len")
+
+
+class Guarded:
+    def __getattribute__(self, name):
+        raise RuntimeError(name)
+
+
+class Broken:
+    @property
+    def __dict__(self):
+        raise RuntimeError("dict")
+
+
+def test_user_code():
+    # the length of exact builtin types only, the attributes of anything else
+    summary = inspection.summarize("s", Sized([1]))
+    assert (summary["type"], summary["children"]) == ("Sized", False)
+    assert "length" not in summary and "error" not in summary
+    assert inspection.summarize("g", Guarded())["children"] is False
+
+    # what still runs code of the value fails for that value alone
+    inspector = inspection.Inspector()
+    local_vars = {"broken": Broken(), "number": 1}
+    reply = inspector.inspect(1, local_vars, {})
+    broken, number = reply["children"]
+    assert broken["error"] == "RuntimeError: RuntimeError('dict')"
+    assert number["repr"] == "1"
+    assert "error" in inspector.inspect(1, local_vars, {"path": ["broken", "x"]})
@@ -0,0 +1,102 @@
+import bdb
+import gc
+import sys
+
+import pytest
+
+import monitoring
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 12), reason="sys.monitoring is new in 3.12"
+)
+
+
+class Debugger(bdb.Bdb):
+    def __init__(self):
+        super().__init__()
+        self.stops = []
+
+    def resume_tracing(self, frame):
+        self.stops.append((frame.f_code.co_name, frame.f_lineno))
+
+
+def work(n):
+    """Adds up."""
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+
+def idle():
+    pass
+
+
+FIRST = work.__code__.co_firstlineno
+LOOP = FIRST + 4  # total += i
+
+
+@pytest.fixture
+def debugger():
+    debugger = Debugger()
+    debugger.monitoring = monitoring.MonitoringBackend(debugger)
+    yield debugger
+    debugger.monitoring.close()
+    debugger.clear_all_breaks()
+
+
+def test_line_breakpoint(debugger):
+    debugger.set_break(__file__, LOOP)
+    assert debugger.monitoring.arm()
+    work(3)
+    # disarmed by the hit, the trace function would take over
+    assert debugger.stops == [("work", LOOP)]
+
+    debugger.clear_break(__file__, LOOP)
+    debugger.set_break(__file__, LOOP, cond="i == 2")
+    assert debugger.monitoring.arm()
+    work(3)
+    assert debugger.stops[1:] == [("work", LOOP)]
+
+
+def test_function_breakpoint(debugger):
+    debugger.set_break(__file__, FIRST, funcname="work")
+    assert debugger.monitoring.arm()
+    work(3)
+    work(3)
+    # the first line run as with tracing, not the def line
+    assert debugger.stops == [("work", FIRST + 2)]
+
+
+def test_deleted_breakpoint(debugger):
+    debugger.set_break(__file__, LOOP)
+    assert debugger.monitoring.arm()
+    # stopped some other way, the breakpoint deleted before continuing
+    debugger.clear_break(__file__, LOOP)
+    debugger.set_break(__file__, idle.__code__.co_firstlineno + 1)
+    assert debugger.monitoring.arm()
+    work(3)
+    assert debugger.stops == []
+    events = sys.monitoring.get_local_events(debugger.monitoring.tool, work.__code__)
+    assert events == sys.monitoring.events.NO_EVENTS
+
+
+def test_heap_searched_once(debugger, monkeypatch):
+    searches = []
+    get_objects = gc.get_objects
+    monkeypatch.setattr(gc, "get_objects", lambda: searches.append(1) or get_objects())
+
+    debugger.set_break(__file__, LOOP)
+    assert debugger.monitoring.arm()
+    debugger.set_break(__file__, FIRST + 5)
+    assert debugger.monitoring.arm()
+    assert len(searches) == 1
+
+    # code not loaded yet, searched again once more modules are imported
+    debugger.breaks["/not/loaded.py"] = [1]
+    assert not debugger.monitoring.arm()
+    assert not debugger.monitoring.arm()
+    assert len(searches) == 2
+    monkeypatch.setitem(sys.modules, "loaded", None)
+    assert not debugger.monitoring.arm()
+    assert len(searches) == 3
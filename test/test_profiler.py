@@ -0,0 +1,42 @@
+import protocol
+from profiler import CProfiler
+
+CALL, RETURN = protocol.OP_C_CALL, protocol.OP_C_RETURN
+
+
+def test_exclusive_and_inclusive_time():
+    profiler = CProfiler()
+    profiler.process(
+        [
+            (RETURN, "started_before", 0x10, 0),  # ignored
+            (CALL, "sorted", 0x1, 1_000),
+            (CALL, "sqrt", 0x2, 2_000),
+            (RETURN, "sqrt", 0x2, 3_000),
+            (CALL, "sorted", 0x1, 4_000),  # recursion through a callback
+            (CALL, "lost", 0x3, 5_000),  # its return never arrives
+            (RETURN, "sorted", 0x1, 7_000),
+            (protocol.OP_C_EXCEPTION, "sorted", 0x1, 10_000),
+        ]
+    )
+
+    stats = profiler.stats
+    assert (stats[0x1].calls, stats[0x1].exclusive, stats[0x1].inclusive) == (
+        2,
+        6_000,
+        9_000,
+    )
+    assert (stats[0x2].calls, stats[0x2].exclusive) == (1, 1_000)
+    assert (stats[0x3].calls, stats[0x3].exclusive) == (1, 2_000)
+    assert 0x10 not in stats
+    assert profiler.stack == []
+
+    names = {0x1: "libc.so`sorted_impl"}
+    assert profiler.collapsed(profiler.names(names.get)).splitlines() == [
+        "libc.so`sorted_impl 5",
+        "libc.so`sorted_impl;libc.so`sorted_impl 1",
+        "libc.so`sorted_impl;libc.so`sorted_impl;lost 2",
+        "libc.so`sorted_impl;sqrt 1",
+    ]
+    assert profiler.table(profiler.names(names.get)).startswith(
+        "4 calls of 3 C functions"
+    )
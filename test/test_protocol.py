@@ -0,0 +1,136 @@
+import socket
+
+import pytest
+
+import protocol
+
+
+def test_channel_events():
+    a, b = socket.socketpair()
+    sender, receiver = protocol.Channel(a), protocol.Channel(b, buffer_size=16)
+
+    # several messages arrive in one read and a message larger than the buffer
+    sender.send_event(protocol.OP_C_CALL, "len", 0x1234)
+    sender.send_event(protocol.OP_C_RETURN, "len", 0x1234)
+    sender.send_flag(protocol.OP_REPLY, True)
+    sender.send(protocol.OP_REPLY, b"x" * 100)
+
+    opcode, payload = receiver.recv()
+    assert opcode == protocol.OP_C_CALL
+    assert receiver.decode_event(payload) == ("len", 0x1234)
+
+    opcode, payload = receiver.recv()
+    assert opcode == protocol.OP_C_RETURN
+    assert receiver.decode_event(payload) == ("len", 0x1234)
+    assert sender.name_ids == {"len": 0}
+
+    opcode, payload = receiver.recv()
+    assert opcode == protocol.OP_REPLY
+    assert receiver.decode_flag(payload) is True
+
+    opcode, payload = receiver.recv()
+    assert bytes(payload) == b"x" * 100
+
+    a.close()
+    assert receiver.recv() is None
+    b.close()
+
+
+def test_event_batch():
+    a, b = socket.socketpair()
+    sender, receiver = protocol.Channel(a), protocol.Channel(b)
+    batch = protocol.EventBatch(sender, capacity=2, interval=60)
+
+    batch.add(protocol.OP_C_RETURN, "len", 1)
+    batch.add(protocol.OP_C_EXCEPTION, "int", 2)  # capacity reached
+    batch.add(protocol.OP_C_RETURN, "len", 3)
+    batch.flush()
+
+    opcode, payload = receiver.recv()
+    assert opcode == protocol.OP_BATCH
+    assert receiver.decode_batch(payload) == [
+        (protocol.OP_C_RETURN, "len", 1),
+        (protocol.OP_C_EXCEPTION, "int", 2),
+    ]
+    opcode, payload = receiver.recv()
+    assert receiver.decode_batch(payload) == [(protocol.OP_C_RETURN, "len", 3)]
+
+    a.close()
+    b.close()
+
+
+def test_profile_batch():
+    a, b = socket.socketpair()
+    sender, receiver = protocol.Channel(a), protocol.Channel(b)
+    batch = protocol.EventBatch(
+        sender, opcode=protocol.OP_PROFILE_BATCH, event=protocol.PROFILE_EVENT
+    )
+
+    batch.add(protocol.OP_C_CALL, "len", 1, 10**15)
+    batch.add(protocol.OP_C_RETURN, "len", 1, 10**15 + 5)
+    batch.flush()
+
+    opcode, payload = receiver.recv()
+    assert opcode == protocol.OP_PROFILE_BATCH
+    assert receiver.decode_profile_batch(payload) == [
+        (protocol.OP_C_CALL, "len", 1, 10**15),
+        (protocol.OP_C_RETURN, "len", 1, 10**15 + 5),
+    ]
+
+    a.close()
+    b.close()
+
+
+def test_pdb_requests():
+    a, b = socket.socketpair()
+    sender, receiver = protocol.Channel(a), protocol.Channel(b)
+
+    sender.send_requests(protocol.OP_PDB_COMMAND, [(1, "break f"), (2, "p 'ü'")])
+    sender.send_request(protocol.OP_PDB_REPLY, 0, "")
+    assert sender.messages_sent == 3
+
+    received = []
+    for _ in range(3):
+        opcode, payload = receiver.recv()
+        received.append((opcode, *receiver.decode_request(payload)))
+    assert received == [
+        (protocol.OP_PDB_COMMAND, 1, "break f"),
+        (protocol.OP_PDB_COMMAND, 2, "p 'ü'"),
+        (protocol.OP_PDB_REPLY, 0, ""),
+    ]
+
+    a.close()
+    b.close()
+
+
+def test_malformed_messages():
+    a, b = socket.socketpair()
+    sender, receiver = protocol.Channel(a), protocol.Channel(b)
+
+    sender.send(protocol.OP_C_CALL, b"short")
+    sender.send(protocol.OP_INSPECT_REPLY, b"{not json")
+    # a name never sent, then a name that is not UTF-8
+    sender.send(protocol.OP_C_CALL, protocol.EVENT.pack(0x1234, 7))
+    sender.send(protocol.OP_NAME, protocol.NAME.pack(1) + b"\xff")
+
+    messages = receiver.poll()
+    for decode in (
+        receiver.decode_event,
+        receiver.decode_json,
+        receiver.decode_event,
+    ):
+        _, payload = next(messages)
+        with pytest.raises(protocol.ProtocolError):
+            decode(payload)
+    with pytest.raises(protocol.ProtocolError):
+        next(messages)
+    a.close()
+    b.close()
+
+
+if __name__ == "__main__":
+    test_channel_events()
+    test_event_batch()
+    test_profile_batch()
+    test_pdb_requests()
+    test_malformed_messages()
@@ -0,0 +1,47 @@
+import io
+import sys
+
+import pytest
+
+pxc_extension = pytest.importorskip("pxc_extension")
+
+import pxcdb
+
+
+@pytest.fixture
+def debugger():
+    debugger = pxcdb.PSXDB(stdout=io.StringIO())
+    yield debugger
+    pxc_extension.stop_profile()
+    debugger.clear_all_breaks()
+
+
+def test_cross_breakpoint(debugger):
+    stops = []
+
+    def count(n):
+        for i in range(n):
+            stops.append(debugger.break_here(sys._getframe()))
+
+    line = count.__code__.co_firstlineno + 2
+    debugger.set_break(__file__, line)
+    bp = debugger.get_breaks(debugger.canonic(__file__), line)[-1]
+    debugger.cross_breakpoints[1] = [bp.number]
+
+    for argument in ("x", "-1", "", "²"):
+        debugger.do_pxignore(f"1 {argument}")
+    assert bp.ignore == 0
+    assert debugger.stdout.getvalue().count("Usage: pxignore") == 4
+
+    debugger.do_pxcondition("1 i >= 2")
+    debugger.do_pxignore("1 1")
+    count(5)
+    assert stops == [False, False, False, True, True]
+    # listed by pdb as it was written
+    assert bp.cond == "i >= 2"
+    assert "stop only if i >= 2" in bp.bpformat()
+
+    debugger.do_pxcondition("1 (")
+    assert bp.cond == "i >= 2"
+    debugger.do_pxcondition("1 ")
+    assert bp.cond is None
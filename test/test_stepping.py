@@ -0,0 +1,79 @@
+import sys
+from decimal import Decimal
+
+import pytest
+
+pxc_extension = pytest.importorskip("pxc_extension")
+
+import stepping
+
+pytestmark = pytest.mark.skipif(
+    not stepping.SUPPORTED, reason="bytecode of this Python is not followed"
+)
+
+
+class Lazy:
+    @property
+    def make(self):
+        return list
+
+
+def helper(items):
+    return items
+
+
+def sample(items, text, number, lazy):
+    items.append(1)
+    text.join(["a", "b"])
+    len(items)
+    helper(items)
+    number + number
+    items[0]
+    lazy.make()
+
+
+def step_targets(func, *args) -> list:
+    """
+    step_target of every line of `func` as it is about to run, as pdb
+    would ask for it.
+    """
+
+    targets = []
+
+    def trace(frame, event, arg):
+        if frame.f_code is not func.__code__:
+            return None
+        if event == "line":
+            targets.append(stepping.step_target(frame, frame.f_locals))
+        return trace
+
+    sys.settrace(trace)
+    try:
+        func(*args)
+    finally:
+        sys.settrace(None)
+    return targets
+
+
+def address(func) -> int:
+    return pxc_extension.resolve_location(func.__name__, func)
+
+
+def test_step_target():
+    number = Decimal(1)
+    targets = step_targets(sample, [], "", number, Lazy())
+    assert targets == [
+        # unbound methods resolve to the function a bound one calls, not to
+        # the trampoline of their calling convention
+        ("list.append", address([].append)),
+        ("str.join", address("".join)),
+        ("len", address(len)),
+        # pdb steps into Python code itself
+        ("helper", 0),
+        ("Decimal.nb_add", pxc_extension.resolve_slot(Decimal, "nb_add")),
+        # operators of builtin types are not followed, nothing else is called
+        ("", 0),
+        # loading a property runs code
+        None,
+    ]
+    assert address(list.append) != address(dict.get)
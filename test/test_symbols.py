@@ -0,0 +1,87 @@
+import sys
+import importlib
+
+import symbols
+
+MODULE = """\
+import os.path
+
+def helper():
+    return 1
+
+class Shape:
+    def area(self):
+        return 0
+
+    @staticmethod
+    def unit():
+        return Shape()
+"""
+
+SCRIPT = """\
+import functools
+
+@functools.cache
+def helper():
+    return 2
+
+class Shape:
+    def area(self):
+        return 1
+"""
+
+
+def test_imported_modules(tmp_path, monkeypatch):
+    (tmp_path / "shapes.py").write_text(MODULE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    index = symbols.PythonSymbolIndex()
+    try:
+        # imported after the index was made, found through the import hook
+        assert "shapes" not in index.names
+        shapes = importlib.import_module("shapes")
+        assert "shapes" in index.pending
+
+        (area,) = index.lookup("Shape.area")
+        assert area.filename == shapes.__file__
+        assert (area.lineno, area.funcname) == (7, "area")
+        assert index.lookup("shapes.Shape.area") == [area]
+        assert index.lookup("Shape.unit")[0].funcname == "unit"
+        assert not index.pending
+
+        # names it does not define, found through the module that does
+        (join,) = index.lookup("shapes.os.path.join")
+        assert join.funcname == "join"
+        # not Python functions
+        assert index.lookup("len") == []
+        assert index.lookup("Shape") == []
+    finally:
+        index.close()
+        sys.modules.pop("shapes", None)
+    assert index.recorder not in sys.meta_path
+
+
+def test_script_source(tmp_path, monkeypatch):
+    (tmp_path / "shapes.py").write_text(MODULE)
+    (tmp_path / "script.py").write_text(SCRIPT)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    index = symbols.PythonSymbolIndex()
+    try:
+        importlib.import_module("shapes")
+        # before the script ran, its functions shadow those of modules
+        index.add_source(str(tmp_path / "script.py"))
+        (helper,) = index.lookup("helper")
+        assert helper.filename == str((tmp_path / "script.py").resolve())
+        # the code object of a decorated function starts at the decorator
+        assert helper.lineno == 3
+        assert index.lookup("__main__.Shape.area")[0].lineno == 8
+        assert index.lookup("shapes.helper")[0].lineno == 3
+    finally:
+        index.close()
+        sys.modules.pop("shapes", None)
+
+
+def test_locations():
+    assert symbols.is_file_line("src/module.c:10")
+    assert not symbols.is_file_line("module.function")
+    assert symbols.is_python_source("script.py:3")
+    assert not symbols.is_python_source("module.c:3")
@@ -0,0 +1,60 @@
+import tracelog
+from tracelog import C_CALL, C_RETURN, CALL, EXCEPTION, LINE, RETURN, TraceLog
+
+STRINGS = ["", "<module>", "main.py", "load", "parse", "json.loads", "ValueError"]
+
+
+def write_log(path, records):
+    with open(path, "wb") as f:
+        f.write(tracelog.HEADER.pack(tracelog.MAGIC, tracelog.VERSION, 32, 1000, 0))
+        for timestamp, (kind, depth, func, file, line, arg) in enumerate(records):
+            f.write(
+                tracelog.RECORD.pack(
+                    kind, 0, depth, func, file, line, 2000 + timestamp, arg
+                )
+            )
+        f.write(b"\0" * 5)  # cut short while recording
+    with open(str(path) + ".strings", "wb") as f:
+        for string in STRINGS:
+            f.write(tracelog.STRING_LENGTH.pack(len(string)) + string.encode())
+
+
+def test_queries(tmp_path):
+    path = tmp_path / "trace.pxct"
+    write_log(
+        path,
+        [
+            (CALL, 1, 1, 2, 1, 0),  # <module>
+            (LINE, 1, 1, 2, 5, 0),
+            (CALL, 2, 3, 2, 2, 5),  # load, called on line 5
+            (LINE, 2, 3, 2, 3, 0),
+            (CALL, 3, 4, 2, 7, 3),  # parse
+            (RETURN, 3, 4, 2, 8, 0),
+            (CALL, 3, 4, 2, 7, 3),  # parse again
+            (LINE, 3, 4, 2, 8, 0),
+            (C_CALL, 3, 5, 0, 8, 0xABC),
+            (EXCEPTION, 3, 4, 2, 8, 6),
+            (RETURN, 3, 4, 2, 8, 0),
+            (C_RETURN, 3, 5, 0, 8, 0xABC),
+        ],
+    )
+
+    with TraceLog(str(path)) as log:
+        assert len(log) == 12
+        assert log.kinds.count(CALL) == 4
+
+        calls = log.calls("parse")
+        assert [record.index for record in calls] == [4, 6]
+        assert log.caller(calls[1]) == tracelog.Frame("load", "main.py", 3)
+        (loads,) = log.calls("loads")
+        assert loads.arg == 0xABC
+        assert log.caller(loads) == tracelog.Frame("parse", "main.py", 8)
+
+        (exception,) = log.exceptions()
+        assert log.exception_name(exception) == "ValueError"
+        assert log.stack(exception) == [
+            tracelog.Frame("<module>", "main.py", 5),
+            tracelog.Frame("load", "main.py", 3),
+            tracelog.Frame("parse", "main.py", 8),
+        ]
+        assert log.stack(loads)[-1] == tracelog.Frame("json.loads", "", 0)
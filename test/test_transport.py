@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import protocol
+import transport
+
+
+@pytest.mark.parametrize("kind", ["tcp", "unix", "shm"])
+def test_endpoints(kind, monkeypatch):
+    monkeypatch.setattr(transport, "TRANSPORT", kind)
+    # every session gets an endpoint of its own
+    first, second = transport.controller_listen(), transport.controller_listen()
+    address = transport.endpoint_address(first)
+    assert address.startswith(kind + ":")
+    assert address != transport.endpoint_address(second)
+
+    monkeypatch.setenv(transport.ENDPOINT_ENV, address)
+    debuggee = protocol.Channel(transport.debuggee_connect())
+    controller = protocol.Channel(transport.controller_accept(first))
+    debuggee.send_request(protocol.OP_PDB_REPLY, 1, "hello")
+    opcode, payload = controller.recv()
+    assert controller.decode_request(payload) == (1, "hello")
+
+    debuggee.close()
+    # shared memory is the connection, the channel closed the first one
+    controller.close()
+    if isinstance(second, transport.SharedMemoryTransport):
+        second.close()
+    transport.controller_close(first)
+    transport.controller_close(second)
+    if kind != "tcp":
+        assert not os.path.exists(address.partition(":")[2])
+
+
+def dead_pid():
+    pid = os.fork()
+    if not pid:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def test_ring_reader_gone(tmp_path):
+    controller = transport.SharedMemoryTransport(
+        str(tmp_path), controller=True, capacity=16
+    )
+    debuggee = transport.SharedMemoryTransport(str(tmp_path), controller=False)
+
+    # a full ring waits for the reader only while it may still read
+    debuggee.sendall(b"x" * 16)
+    controller.close()
+    with pytest.raises(BrokenPipeError):
+        debuggee.sendall(b"x")
+
+    # or until it died without closing
+    ring = debuggee.incoming
+    ring._set(ring.HEAD, ring.U64, ring.capacity)
+    ring._set(ring.READER, ring.U32, dead_pid())
+    with pytest.raises(BrokenPipeError):
+        ring.write(b"x")
+    debuggee.close()
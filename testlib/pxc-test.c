@@ -1,10 +1,14 @@
 #include "pxc-test.h"
 #include <Python.h>
+#include <math.h>
 #include <stddef.h>
 #include <stdio.h>
 
 static PyMethodDef pxctestMethods[] = {
     {"print_stdout", print_stdout, METH_VARARGS, "Prints."},
+    {"add", add, METH_VARARGS, "Adds two integers, a cheap C call."},
+    {"fib", fib, METH_VARARGS, "Recursive fibonacci number, CPU bound."},
+    {"spin", spin, METH_VARARGS, "Busy loop of n iterations, CPU bound."},
     {NULL, NULL, 0, NULL},
 };
 
@@ -54,10 +58,111 @@ static PyTypeObject CustomType = {
     .tp_methods = Custom_methods,
 };
 
+// Small vector type with methods, operators and item access, to measure
+// the cost of calls dispatched through type slots
+typedef struct {
+    PyObject_HEAD double x, y, z;
+} VectorObject;
+
+static PyTypeObject VectorType;
+
+static PyObject *Vector_create(double x, double y, double z) {
+    VectorObject *v = (VectorObject *)VectorType.tp_alloc(&VectorType, 0);
+    if (v == NULL)
+        return NULL;
+    v->x = x;
+    v->y = y;
+    v->z = z;
+    return (PyObject *)v;
+}
+
+static int Vector_init(VectorObject *self, PyObject *args, PyObject *kwds) {
+    self->x = self->y = self->z = 0.0;
+    if (!PyArg_ParseTuple(args, "|ddd", &self->x, &self->y, &self->z))
+        return -1;
+    return 0;
+}
+
+static PyObject *Vector_norm(VectorObject *self, PyObject *Py_UNUSED(ignored)) {
+    return PyFloat_FromDouble(
+        sqrt(self->x * self->x + self->y * self->y + self->z * self->z));
+}
+
+static PyObject *Vector_dot(VectorObject *self, PyObject *other) {
+    if (!PyObject_TypeCheck(other, &VectorType)) {
+        PyErr_SetString(PyExc_TypeError, "expected a Vector");
+        return NULL;
+    }
+    VectorObject *o = (VectorObject *)other;
+    return PyFloat_FromDouble(self->x * o->x + self->y * o->y + self->z * o->z);
+}
+
+static PyObject *Vector_scale(VectorObject *self, PyObject *args) {
+    double k;
+    if (!PyArg_ParseTuple(args, "d", &k))
+        return NULL;
+    return Vector_create(self->x * k, self->y * k, self->z * k);
+}
+
+static PyObject *Vector_add(PyObject *a, PyObject *b) {
+    if (!PyObject_TypeCheck(a, &VectorType) ||
+        !PyObject_TypeCheck(b, &VectorType))
+        Py_RETURN_NOTIMPLEMENTED;
+    VectorObject *u = (VectorObject *)a, *v = (VectorObject *)b;
+    return Vector_create(u->x + v->x, u->y + v->y, u->z + v->z);
+}
+
+static Py_ssize_t Vector_length(PyObject *self) { return 3; }
+
+static PyObject *Vector_item(VectorObject *self, Py_ssize_t i) {
+    switch (i) {
+    case 0:
+        return PyFloat_FromDouble(self->x);
+    case 1:
+        return PyFloat_FromDouble(self->y);
+    case 2:
+        return PyFloat_FromDouble(self->z);
+    }
+    PyErr_SetString(PyExc_IndexError, "Vector index out of range");
+    return NULL;
+}
+
+static PyMethodDef Vector_methods[] = {
+    {"norm", (PyCFunction)Vector_norm, METH_NOARGS, "returns the length"},
+    {"dot", (PyCFunction)Vector_dot, METH_O, "returns the dot product"},
+    {"scale", (PyCFunction)Vector_scale, METH_VARARGS,
+     "returns the vector scaled by k"},
+    {NULL} /* Sentinel */
+};
+
+static PyNumberMethods Vector_as_number = {
+    .nb_add = Vector_add,
+};
+
+static PySequenceMethods Vector_as_sequence = {
+    .sq_length = Vector_length,
+    .sq_item = (ssizeargfunc)Vector_item,
+};
+
+static PyTypeObject VectorType = {
+    .ob_base = PyVarObject_HEAD_INIT(NULL, 0).tp_name = "pxctest.Vector",
+    .tp_doc = PyDoc_STR("Vector objects"),
+    .tp_basicsize = sizeof(VectorObject),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc)Vector_init,
+    .tp_methods = Vector_methods,
+    .tp_as_number = &Vector_as_number,
+    .tp_as_sequence = &Vector_as_sequence,
+};
+
 PyMODINIT_FUNC PyInit_pxctest(void) {
     PyObject *m;
     if (PyType_Ready(&CustomType) < 0)
         return NULL;
+    if (PyType_Ready(&VectorType) < 0)
+        return NULL;
 
     m = PyModule_Create(&pxctestModule);
     if (m == NULL)
@@ -67,6 +172,10 @@ PyMODINIT_FUNC PyInit_pxctest(void) {
         Py_DECREF(m);
         return NULL;
     }
+    if (PyModule_AddObjectRef(m, "Vector", (PyObject *)&VectorType) < 0) {
+        Py_DECREF(m);
+        return NULL;
+    }
     return m;
 }
 
@@ -79,3 +188,32 @@ static PyObject *print_stdout(PyObject *self, PyObject *args) {
     sts = fprintf(stdout, "%s\n", command);
     return PyLong_FromLong(sts);
 }
+
+static PyObject *add(PyObject *self, PyObject *args) {
+    long a, b;
+
+    if (!PyArg_ParseTuple(args, "ll", &a, &b))
+        return NULL;
+    return PyLong_FromLong(a + b);
+}
+
+static long fib_c(long n) { return n < 2 ? n : fib_c(n - 1) + fib_c(n - 2); }
+
+static PyObject *fib(PyObject *self, PyObject *args) {
+    long n;
+
+    if (!PyArg_ParseTuple(args, "l", &n))
+        return NULL;
+    return PyLong_FromLong(fib_c(n));
+}
+
+static PyObject *spin(PyObject *self, PyObject *args) {
+    long n;
+    volatile unsigned long acc = 0;
+
+    if (!PyArg_ParseTuple(args, "l", &n))
+        return NULL;
+    for (long i = 0; i < n; i++)
+        acc = acc * 31 + i;
+    return PyLong_FromUnsignedLong(acc);
+}
@@ -4,6 +4,9 @@
 #include <Python.h>
 
 static PyObject *print_stdout(PyObject *self, PyObject *args);
+static PyObject *add(PyObject *self, PyObject *args);
+static PyObject *fib(PyObject *self, PyObject *args);
+static PyObject *spin(PyObject *self, PyObject *args);
 
 
 #endif
@@ -2,7 +2,7 @@
 
 from setuptools import setup, Extension
 
-module = Extension("pxctest", sources=["pxc-test.c"])
+module = Extension("pxctest", sources=["pxc-test.c"], libraries=["m"])
 
 setup(
     name="pxctest",